@@ -33,7 +33,7 @@ from a2a.types import (
     AgentCard,
     AgentSkill,
 )
-from slide_agent.agent import root_agent
+from slide_agent.agent import root_agent, start_registry
 
 @click.command()
 @click.option("--host", "host", default="localhost", help="服务器绑定的主机名（默认为 localhost,可以指定具体本机ip）")
@@ -70,6 +70,8 @@ def main(host, port, agent_url=""):
         skills=[skill],
     )
 
+    # 启动前拉取 MCP 工具并启动后台刷新线程
+    start_registry()
     runner = Runner(
         app_name=agent_card.name,
         agent=root_agent,
@@ -4,9 +4,13 @@ from google.adk.agents.callback_context import CallbackContext
 from google.genai import types
 from dotenv import load_dotenv
 import os
+import time
+import random
+import asyncio
 
 # 问题求解循环 Agent（新的）
-from .sub_agents.innovation_agents.agent import solver_loop_agent, get_cache, DEFAULT_MAX_ATTEMPTS
+from .sub_agents.innovation_agents.agent import (solver_loop_agent, get_cache, replay_cached_tool, start_registry,
+                                                 DEFAULT_MAX_ATTEMPTS, DEFAULT_DEADLINE_SEC)
 
 # 加载环境变量
 load_dotenv('.env')
@@ -21,20 +25,29 @@ def _get_text_from_context(callback_context: CallbackContext) -> str | None:
                 return text
     return None
 
-def before_agent_callback(callback_context: CallbackContext):
+async def before_agent_callback(callback_context: CallbackContext):
     """
     初始化：抽取问题文本、读取 metadata 配置、接入本地工具命中缓存（SQLite）。
+    缓存命中且记录了参数模板时直接调用工具(不调用 LLM)，成功则跳过整个求解循环；
+    metadata.replay 为 false 或环境变量 SOLVER_CACHE_REPLAY=0 时关闭。
     约定 state 字段：
       - question: 本次用户问题
       - attempts/max_attempts: 当前/最大尝试次数
       - tried_tools: 已尝试的工具名列表
       - failed_attempts: [{tool, error, raw}] 失败轨迹
       - tool_candidates: 分析 Agent 给出的候选工具名（当前轮）
-      - cached_tool: 命中缓存的工具名（若有则优先仅用该工具）
+      - cached_tool: 命中缓存的工具名（若有则优先仅用该工具），相似问题也会命中
+      - cached_similarity: 命中的历史问题与本次问题的相似度（1.0 为完全相同）
       - try_tool_number: 每一轮最多暴露的工具数量（默认 2）
+      - deadline: 本次求解的截止时间戳（metadata.deadline_sec 或 SOLVER_DEADLINE_SEC 秒后）
+      - pipeline: 求解流水线，staged(分析->执行->控制) 或 merged(一个 Agent 直接选工具并调用)；
+        metadata.pipeline 或 SOLVER_PIPELINE 指定，ab 表示按 SOLVER_PIPELINE_AB_RATIO 的比例随机选 merged 做对比
+      - speculative: 推测执行模式（metadata.speculative 或 SOLVER_SPECULATIVE=1），每轮候选工具并发执行，先成功者胜出
     """
     st = callback_context.state
     md = st.get("metadata") or {}
+    # 入口(main_api)已经启动过时直接返回；adk web 等没有经过入口的运行方式在第一次请求时加载工具
+    await asyncio.to_thread(start_registry)
 
     text = _get_text_from_context(callback_context)
     if not text:
@@ -53,13 +66,38 @@ def before_agent_callback(callback_context: CallbackContext):
     st["solved"] = False
     st["final_answer"] = None
     st["used_tool"] = None
+    st["started_at"] = time.time()
+
+    # ---- 整个求解过程的截止时间，传递给每一次 MCP 工具调用 ----
+    st["deadline"] = time.time() + float(md.get("deadline_sec") or os.getenv("SOLVER_DEADLINE_SEC", DEFAULT_DEADLINE_SEC))
 
     # ---- 每轮暴露多少工具给 LLM（避免上下文过大）----
     st["try_tool_number"] = int(md.get("try_tool_number") or os.getenv("SOLVER_TRY_TOOL_NUMBER", 2))
 
-    # ---- 工具命中缓存：问题 -> 工具名 ----
+    # ---- 求解流水线：三段式 / 合并模式 / 按比例 A/B ----
+    pipeline = str(md.get("pipeline") or os.getenv("SOLVER_PIPELINE", "staged")).lower()
+    if pipeline == "ab":
+        pipeline = "merged" if random.random() < float(os.getenv("SOLVER_PIPELINE_AB_RATIO", "0.5")) else "staged"
+    st["pipeline"] = pipeline
+
+    # ---- 推测执行：分析Agent一次抽取参数，候选工具并发调用 ----
+    st["speculative"] = bool(md.get("speculative", os.getenv("SOLVER_SPECULATIVE", "0") == "1"))
+    st["tool_arguments"] = {}
+    st["speculated_attempt"] = None
+
+    # ---- 工具命中缓存：问题(或相似问题) -> 工具名 ----
     cache = get_cache()
-    st["cached_tool"] = cache.get(st["question"])
+    hit = cache.lookup(st["question"])
+    st["cached_tool"] = hit["tool_name"] if hit else None
+    st["cached_similarity"] = hit["score"] if hit else None
+
+    # ---- 缓存直达：按参数模板直接调用工具 ----
+    replay = md.get("replay", os.getenv("SOLVER_CACHE_REPLAY", "1") != "0")
+    if hit and replay:
+        answer = await replay_cached_tool(st, hit)
+        if answer is not None:
+            msg = f"✅ 已解决：{answer}\n（工具：{hit['tool_name']}；缓存直达，未调用模型）"
+            return types.Content(role="model", parts=[types.Part(text=msg)])
 
     return None
 
@@ -1,10 +1,11 @@
 # 文件: sub_agents/innovation_agents/agent.py
 import os
+import time
 import json
-import sqlite3
-import hashlib
+import re
+import asyncio
 import logging
-from typing import AsyncGenerator, Optional, Dict, Any, List
+from typing import AsyncGenerator, Optional, Dict, Any, List, Tuple
 
 from google.genai import types
 from google.adk.events import Event, EventActions
@@ -12,13 +13,16 @@ from google.adk.agents import LoopAgent, BaseAgent
 from google.adk.agents.llm_agent import LlmAgent
 from google.adk.agents.invocation_context import InvocationContext
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmResponse
 
 # ADK 工具：FunctionTool（函数即工具），BaseToolset（动态供工具）
 from google.adk.tools.base_toolset import BaseToolset
 from ...config import CONTENT_WRITER_AGENT_CONFIG, CHECKER_AGENT_CONFIG
 from ...create_model import create_model
-from .tools import ALL_TOOLS, TOOLS_INFO
-from .prompt import AnalyzerAgent_PROMPT, ExecutorAgent_PROMPT
+from .tools import REGISTRY, TURN_PREFETCHER, MYFunctionTool, start_registry
+# 工具命中缓存（本地 sqlite，支持相似问题查找）
+from .tool_cache import ToolCache, get_cache, get_cache_key
+from .prompt import AnalyzerAgent_PROMPT, AnalyzerAgent_SPECULATIVE_PROMPT, ExecutorAgent_PROMPT, PlanExecuteAgent_PROMPT
 
 
 logger = logging.getLogger(__name__)
@@ -26,68 +30,242 @@ logger = logging.getLogger(__name__)
 # ========= 全局常量 =========
 DEFAULT_MODEL = os.getenv("SOLVER_MODEL", "gemini-2.0-flash")
 DEFAULT_MAX_ATTEMPTS = int(os.getenv("SOLVER_MAX_ATTEMPTS", "6"))
-CACHE_DB_PATH = os.getenv("SOLVER_TOOL_CACHE_DB", "tool_cache.db")
-
-# ========= 工具命中缓存（本地 sqlite） =========
-class ToolCache:
-    def __init__(self, db_path: str = CACHE_DB_PATH):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS cache(
-                key TEXT PRIMARY KEY,
-                tool_name TEXT NOT NULL
-            )
-        """)
-        self.conn.commit()
-
-    @staticmethod
-    def _key_from_query(q: str) -> str:
-        norm = " ".join(q.strip().lower().split())
-        return hashlib.sha256(norm.encode("utf-8")).hexdigest()
-
-    def get(self, query: str) -> Optional[str]:
-        k = self._key_from_query(query)
-        cur = self.conn.execute("SELECT tool_name FROM cache WHERE key=?", (k,))
-        row = cur.fetchone()
-        return row[0] if row else None
-
-    def put(self, query: str, tool_name: str):
-        k = self._key_from_query(query)
-        self.conn.execute("REPLACE INTO cache(key, tool_name) VALUES(?,?)", (k, tool_name))
-        self.conn.commit()
-
+DEFAULT_DEADLINE_SEC = float(os.getenv("SOLVER_DEADLINE_SEC", "900"))
+# 本地排序足够有把握时跳过分析Agent：工具的加权历史调用次数和后验成功率的下限
+ANALYZER_SKIP_MIN_CALLS = float(os.getenv("SOLVER_ANALYZER_SKIP_MIN_CALLS", "3"))
+ANALYZER_SKIP_MIN_RATE = float(os.getenv("SOLVER_ANALYZER_SKIP_MIN_RATE", "0.8"))
+# 分析Agent的提示词中最多放入多少个工具的描述
+ANALYZER_TOOL_TOP_N = int(os.getenv("SOLVER_ANALYZER_TOOL_TOP_N", "20"))
+# 最近连续多少次失败的错误相同时提前结束（设为 0 关闭）
+REPEATED_FAILURE_LIMIT = int(os.getenv("SOLVER_REPEATED_FAILURE_LIMIT", "2"))
+# 合并模式(一个 Agent 直接选工具并调用)每轮暴露给模型的工具数
+MERGED_TOOL_TOP_N = int(os.getenv("SOLVER_MERGED_TOOL_TOP_N", "5"))
+
+# ========= 根据历史成败和耗时给工具排序 =========
+def rank_tools_for_query(q: str, exclude: Optional[List[str]] = None) -> List[str]:
+    """
+    如果分析Agent没有分析出要使用的工具时或者出现异常时，用这个本地排序兜底：
+    按 (域名, 相似问题簇) 的历史成功率和耗时做 Thompson 采样，没有历史数据的工具也会被探索到。
+    """
+    return get_cache().rank_tools(q, list(REGISTRY.tools.keys()), exclude=exclude)
+
+
+def analyzer_tool_names(q: str, exclude: Optional[List[str]] = None, top_n: int = ANALYZER_TOOL_TOP_N) -> List[str]:
+    """
+    放进分析Agent提示词的工具：先取与问题文本最相关的(BM25)，不足 top_n 时用本地排序补齐，
+    工具总数不超过 top_n 时就是全部未尝试的工具。
+    """
+    names = REGISTRY.search(q, top_n, exclude=exclude)
+    if len(names) < top_n:
+        picked = set(names)
+        names += [n for n in rank_tools_for_query(q, exclude=exclude) if n not in picked][:top_n - len(names)]
+    return names
+
+
+def shortcut_candidates(st: Dict[str, Any]) -> Optional[tuple]:
+    """
+    不需要分析Agent就能确定候选工具时，返回 (候选工具列表, 原因)，否则返回 None：
+    1) 命中缓存的工具还没试过；
+    2) 只剩一个没试过的工具；
+    3) 本地统计中有历史数据充足、成功率高的工具。
+    """
+    q = st.get("question", "")
+    tried = st.get("tried_tools") or []
+    all_tools = REGISTRY.tools
+    cached = st.get("cached_tool")
+    if cached and cached in all_tools and cached not in tried:
+        return [cached], "cache"
+    remaining = [name for name in all_tools if name not in tried]
+    if len(remaining) == 1:
+        return remaining, "last_tool"
+    k = int(st.get("try_tool_number", 2) or 2)
+    confident = get_cache().confident_tools(q, remaining, min_calls=ANALYZER_SKIP_MIN_CALLS,
+                                            min_rate=ANALYZER_SKIP_MIN_RATE)
+    if confident:
+        return confident[:k], "confident"
+    return None
 
-# 单例获取
-_CACHE_SINGLETON: Optional[ToolCache] = None
-def get_cache() -> ToolCache:
-    global _CACHE_SINGLETON
-    if _CACHE_SINGLETON is None:
-        _CACHE_SINGLETON = ToolCache(CACHE_DB_PATH)
-    return _CACHE_SINGLETON
 
-def get_cache_key(query: str) -> str:
-    return ToolCache._key_from_query(query)
+def round_tool_results(ctx: InvocationContext, stop_authors: List[str]) -> List[Dict[str, Any]]:
+    """
+    本轮(上一次控制Agent输出之后)所有 function_response 的结构化结果：[{tool, status, text}]。
+    MCP 工具返回 {"status": "success"|"error", "text": ...}；没有 status 的返回值 status 为 None。
+    """
+    results = []
+    for event in reversed(ctx.session.events):
+        if event.invocation_id != ctx.invocation_id or event.author in stop_authors:
+            break
+        for response in reversed(event.get_function_responses()):
+            payload = response.response if isinstance(response.response, dict) else {}
+            results.append({"tool": response.name, "status": payload.get("status"),
+                            "text": str(payload.get("text") or payload.get("result") or "")})
+    results.reverse()
+    return results
+
+
+def decide_from_tool_status(st: Dict[str, Any], results: List[Dict[str, Any]], record_failure: bool = True):
+    """
+    由工具返回的结构化 status 判定本轮结果：有调用返回 success 即已解决，
+    used_tool 取最后一个成功的工具，答案优先用模型的最终回复，没有回复(成功后跳过了总结)时用工具输出；
+    调用失败的工具都记为已尝试。record_failure=False 时失败的结论和轨迹保留执行Agent给出的，
+    但本轮每个调用都返回 error 时，模型声称已解决也不采信，按失败记录。
+    """
+    reply = st.get("final_reply") or ""
+    succeeded = [r for r in results if r.get("status") == "success"]
+    failed = [r for r in results if r.get("status") != "success"]
+    tried = st.get("tried_tools") or []
+    st["tried_tools"] = tried + [t for t in dict.fromkeys(r["tool"] for r in failed) if t not in tried]
+    if succeeded:
+        st["solved"] = True
+        st["used_tool"] = succeeded[-1]["tool"]
+        st["final_answer"] = reply or succeeded[-1].get("text") or ""
+        return
+    all_errors = bool(results) and all(r.get("status") == "error" for r in results)
+    raw = reply
+    if not record_failure:
+        if not (st.get("solved") and all_errors):
+            return
+        # 模型的说法既不是答案也不是错误原因，失败轨迹里记工具返回的错误
+        reply = ""
+    st["solved"] = False
+    st["used_tool"] = failed[-1]["tool"] if failed else None
+    st["final_answer"] = reply
+    err = {"tool": st["used_tool"] or "none", "error": reply or (failed[-1].get("text") if failed else "")
+           or "没有成功的工具调用", "raw": raw}
+    st["failed_attempts"] = (st.get("failed_attempts") or []) + [err]
+
+
+def prefetch_function_calls(callback_context: CallbackContext, parts) -> bool:
+    """模型回复是函数调用时返回 True；一次给出多个调用时并发执行，ADK 顺序执行工具时直接取结果"""
+    calls = [p.function_call for p in parts if getattr(p, "function_call", None)]
+    if not calls:
+        return False
+    print(f"进行函数调用: {calls[0]}")
+    if len(calls) > 1:
+        TURN_PREFETCHER.prefetch(callback_context.invocation_id, calls, callback_context.state)
+    return True
+
+
+def record_attempt_outcomes(st: Dict[str, Any]):
+    """把本轮每次工具调用的结果写入工具统计：调用返回 success，或本轮已解决且是最终使用的工具，记为成功"""
+    question = st.get("question", "")
+    solved = bool(st.get("solved"))
+    used_tool = st.get("used_tool")
+    calls = st.get("tool_calls") or []
+    cache = get_cache()
+    for call in calls:
+        success = call.get("status") == "success" or (solved and call.get("tool") == used_tool)
+        cache.record_outcome(question, call["tool"], success, float(call.get("elapsed") or 0))
+    if solved and used_tool and used_tool not in {c.get("tool") for c in calls}:
+        cache.record_outcome(question, used_tool, True, 0.0)
+
+def successful_call_arguments(calls: List[Dict[str, Any]], tool_name: Optional[str]) -> Optional[Dict[str, Any]]:
+    """本轮最终使用的工具最后一次调用的参数，优先取返回 success 的那次"""
+    matched = [c for c in calls if c.get("tool") == tool_name]
+    succeeded = [c for c in matched if c.get("status") == "success"]
+    picked = (succeeded or matched or [None])[-1]
+    return picked.get("args") if picked else None
+
+
+# ========= 缓存直达：命中的工具带参数模板时，不经过 LLM 直接调用 =========
+async def replay_cached_tool(st: Dict[str, Any], hit: Dict[str, Any]) -> Optional[str]:
+    """
+    用缓存的参数模板为当前问题填参数，直接调用工具。
+    成功返回工具输出的文本并写好 solved/final_answer/used_tool；无法重放或调用失败返回 None，
+    失败时把该工具记为已尝试，后续交给求解循环。
+    """
+    question = st.get("question", "")
+    cache = get_cache()
+    arguments = cache.replay_arguments(hit, question)
+    tool = REGISTRY.tools.get(hit["tool_name"]) if arguments is not None else None
+    if tool is None or getattr(tool, "invoke", None) is None:
+        return None
+    tool_name = hit["tool_name"]
+    logger.info(f"[Replay] {tool_name} args={arguments} similarity={hit['score']}")
+    start = time.monotonic()
+    try:
+        result = await tool.invoke(arguments, st.get("deadline"))
+    except Exception as e:
+        result = {"status": "error", "text": f"❌ {e!r}"}
+    elapsed = time.monotonic() - start
+    success = isinstance(result, dict) and result.get("status") == "success"
+    cache.record_outcome(question, tool_name, success, elapsed)
+    text = result.get("text", "") if isinstance(result, dict) else str(result)
+    if not success:
+        st["tried_tools"] = (st.get("tried_tools") or []) + [tool_name]
+        st["failed_attempts"] = (st.get("failed_attempts") or []) + [
+            {"tool": tool_name, "error": text[:500], "raw": "cache replay"}]
+        st["cached_tool"] = None
+        return None
+    cache.put(question, tool_name, arguments)
+    st["solved"] = True
+    st["final_answer"] = text
+    st["used_tool"] = tool_name
+    return text
+
+
+# ========= 推测执行：候选工具用同一组参数并发调用，第一个成功的胜出 =========
+async def speculative_execute(st: Dict[str, Any]) -> Optional[Tuple[bool, Optional[str], str]]:
+    """
+    用分析Agent抽取的参数(state.tool_arguments)同时调用前 try_tool_number 个候选工具，
+    第一个返回 success 的作为结果并取消其余调用，耗时取决于最快的可用工具。
+    返回 (是否解决, 工具名, 答案或错误汇总)；可并发的候选少于 2 个时返回 None，交给执行Agent按原流程处理。
+    被取消的调用没有结果，不记入工具统计，也不算作已尝试。
+    """
+    arguments = st.get("tool_arguments") or {}
+    k = int(st.get("try_tool_number", 2) or 2)
+    all_tools = REGISTRY.tools
+    jobs = {}
+    for name in (st.get("tool_candidates") or [])[:k]:
+        tool = all_tools.get(name)
+        if not isinstance(tool, MYFunctionTool) or tool.invoke is None:
+            continue
+        bound = tool.bind_arguments(arguments)
+        if bound is not None:
+            jobs[name] = bound
+    if len(jobs) < 2:
+        return None
 
+    logger.info(f"[Speculative] launch {list(jobs)} args={arguments}")
+    deadline = st.get("deadline")
+    start = time.monotonic()
+    tasks = {asyncio.ensure_future(all_tools[name].invoke(args, deadline)): name for name, args in jobs.items()}
+    pending = set(tasks)
+    winner = None
+    calls, failures = [], []
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = tasks[task]
+                try:
+                    result = task.result()
+                except Exception as e:
+                    result = {"status": "error", "text": f"❌ {e!r}"}
+                status = result.get("status") if isinstance(result, dict) else None
+                text = result.get("text", "") if isinstance(result, dict) else str(result)
+                calls.append({"tool": name, "args": jobs[name], "status": status,
+                              "elapsed": round(time.monotonic() - start, 3)})
+                if status == "success" and winner is None:
+                    winner = (name, text)
+                else:
+                    failures.append({"tool": name, "error": text[:500], "raw": "speculative"})
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.info(f"[Speculative] cancelled {[tasks[t] for t in pending]}")
+
+    # 失败轨迹由执行Agent按返回的汇总统一记录，这里只记调用结果和已尝试的工具
+    st["tool_calls"] = (st.get("tool_calls") or []) + calls
+    tried = st.get("tried_tools") or []
+    st["tried_tools"] = tried + [f["tool"] for f in failures if f["tool"] not in tried]
+    if winner:
+        return True, winner[0], winner[1]
+    summary = "；".join(f"{f['tool']}: {f['error'][:200]}" for f in failures)
+    return False, failures[-1]["tool"] if failures else None, summary
 
-# ========= 根据问题做一个轻量级的启发式排序（后期改成Embedding排序） =========
-def rank_tools_for_query(q: str, exclude: Optional[List[str]] = None) -> List[str]:
-    """如果分析Agent没有分析出要使用的工具时或者出现异常时，改成这个备用的启发式排序工具"""
-    ql = (q or "").lower()
-    exclude = set(exclude or [])
-    scores = []
-    for name in ALL_TOOLS.keys():
-        score = 0
-        if any(ch in ql for ch in "+-*/()") or "计算" in ql:
-            score += 5 if name == "calc_expression" else 0
-        if "km" in ql or "mile" in ql or "转换" in ql or "换算" in ql:
-            score += 5 if name == "unit_convert" else 0
-        if "是什么" in ql or "介绍" in ql or "定义" in ql:
-            score += 5 if name == "lookup_fact" else 0
-        # 默认轻微偏好：表达式 > 换算 > 事实
-        base = {"calc_expression": 2, "unit_convert": 1, "lookup_fact": 0}.get(name, 0)
-        scores.append((score, base, name))
-    ordered = [n for _, _, n in sorted(scores, key=lambda x: (x[0], x[1]), reverse=True)]
-    return [n for n in ordered if n not in exclude]
 
 # ========= 动态 Toolset：只把“候选工具”暴露给 LLM =========
 class CandidateToolset(BaseToolset):
@@ -103,10 +281,20 @@ class CandidateToolset(BaseToolset):
         """
         st = getattr(readonly_context, "state", {}) if readonly_context else {}
         q = st.get("question", "")
+        # 每次取一次注册表快照，热更新后新工具立即可见
+        all_tools = REGISTRY.tools
         cached = st.get("cached_tool")
-        if cached and cached in ALL_TOOLS:
-            return [ALL_TOOLS[cached]]
+        if cached and cached in all_tools:
+            tools = [all_tools[cached]]
+        else:
+            tools = self._candidate_tools(st, q, all_tools)
+        logger.info(f"[CandidateToolset] expose tools: {[t.name for t in tools]}")
+        if readonly_context is not None:
+            # 并发预取只执行这里暴露的工具
+            TURN_PREFETCHER.expose(readonly_context.invocation_id, [t.name for t in tools])
+        return tools
 
+    def _candidate_tools(self, st, q: str, all_tools) -> list:
         tried = st.get("tried_tools") or []
         # 分析Agent猜测可以使用的tool
         candidates = st.get("tool_candidates") or []
@@ -115,13 +303,12 @@ class CandidateToolset(BaseToolset):
             topk = int(st.get("try_tool_number", self.default_top_k) or self.default_top_k)
             candidates = rank_tools_for_query(q, exclude=tried)[:topk]
 
-        tools = [ALL_TOOLS[n] for n in candidates if n in ALL_TOOLS]
+        tools = [all_tools[n] for n in candidates if n in all_tools]
         # 如果候选为空，兜底给一个最可能的（避免模型无工具可用）
         if not tools:
             ordered = rank_tools_for_query(q, exclude=tried)
-            if ordered:
-                tools = [ALL_TOOLS[ordered[0]]]
-        logger.info(f"[CandidateToolset] expose tools: {[t.name for t in tools]}")
+            if ordered and ordered[0] in all_tools:
+                tools = [all_tools[ordered[0]]]
         return tools
 
     async def close(self) -> None:
@@ -176,9 +363,23 @@ class AnalyzerAgent(LlmAgent):
         tried_list = ctx.state.get("tried_tools", [])
         tried = ", ".join(tried_list) if tried_list else "无"
         try_num = int(ctx.state.get("try_tool_number", 2) or 2)
+        # 只放入和问题相关的工具，工具再多提示词长度也基本不变
+        names = analyzer_tool_names(question, exclude=tried_list)
+        tool_desc = REGISTRY.info_for(names)
+        if ctx.state.get("speculative"):
+            # 推测执行模式：同时抽取各候选工具共用的参数
+            all_tools = REGISTRY.tools
+            params = "\n".join(all_tools[n].signature() for n in names if isinstance(all_tools.get(n), MYFunctionTool))
+            return AnalyzerAgent_SPECULATIVE_PROMPT.format(
+                try_num=try_num,
+                tool_desc=tool_desc,
+                tool_params=params,
+                question=question,
+                tried=tried
+            )
         return AnalyzerAgent_PROMPT.format(
             try_num=try_num,
-            tool_desc=TOOLS_INFO,
+            tool_desc=tool_desc,
             question=question,
             tried=tried
         )
@@ -192,8 +393,20 @@ class AnalyzerAgent(LlmAgent):
         # 返回 None，继续调用 LLM
         return None
     def _before_model_cb(self, callback_context: CallbackContext, llm_request) -> Optional[Any]:
-        logger.info(f"[AnalyzerAgent] start. question={callback_context.state.get('question')}")
-        return None
+        """候选工具已经可以确定时直接写入 tool_candidates，返回构造的响应跳过这次 LLM 调用"""
+        st = callback_context.state
+        logger.info(f"[AnalyzerAgent] start. question={st.get('question')}")
+        shortcut = shortcut_candidates(st)
+        if shortcut is None:
+            st["analyzer_skipped"] = None
+            return None
+        cands, reason = shortcut
+        st["tool_candidates"] = cands
+        st["tool_arguments"] = {}
+        st["analyzer_skipped"] = reason
+        logger.info(f"[AnalyzerAgent] skip LLM ({reason}), candidates={cands}")
+        text = json.dumps({"candidates": cands, "reason": reason}, ensure_ascii=False)
+        return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
 
     def _after_model_cb(self, callback_context: CallbackContext, llm_response) -> Optional[Any]:
         parts = llm_response.content.parts or []
@@ -204,8 +417,10 @@ class AnalyzerAgent(LlmAgent):
             data = json.loads(txt[s:e+1]) if s != -1 and e != -1 else json.loads(txt)
             cands = data.get("candidates") or []
             # 仅保留已注册的工具名
-            cands = [c for c in cands if c in ALL_TOOLS]
+            cands = [c for c in cands if c in REGISTRY.tools]
             callback_context.state["tool_candidates"] = cands
+            arguments = data.get("arguments")
+            callback_context.state["tool_arguments"] = arguments if isinstance(arguments, dict) else {}
         except Exception:
             # 兜底：用本地启发式
             q = callback_context.state.get("question", "")
@@ -225,6 +440,7 @@ class ExecutorAgent(LlmAgent):
             # 关键：把动态 Toolset 放入 tools，当前轮只暴露“候选工具”
             tools=[CandidateToolset()],
             instruction=self._instruction,
+            before_model_callback=self._before_model_cb,
             after_model_callback=self._after_model_cb,
             **kwargs
         )
@@ -233,37 +449,109 @@ class ExecutorAgent(LlmAgent):
         question = ctx.state.get("question", "")
         return ExecutorAgent_PROMPT.format(question=question)
 
+    async def _before_model_cb(self, callback_context: CallbackContext, llm_request) -> Optional[Any]:
+        """推测执行模式下，每轮第一次调用 LLM 前先并发执行候选工具，有结果时直接作为本轮回复"""
+        st = callback_context.state
+        if not st.get("speculative") or st.get("speculated_attempt") == st.get("attempts"):
+            return None
+        st["speculated_attempt"] = st.get("attempts")
+        outcome = await speculative_execute(st)
+        if outcome is None:
+            return None
+        solved, tool_name, answer = outcome
+        payload = json.dumps({"tool": tool_name or "none", "answer": answer}, ensure_ascii=False)
+        text = f"SOLVED:{'true' if solved else 'false'} JSON:{payload}"
+        self._record_result(st, _parse_solved(text))
+        return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+
     def _after_model_cb(self, callback_context: CallbackContext, llm_response) -> Optional[Any]:
         parts = llm_response.content.parts or []
-        if getattr(parts[0], "function_call"):
+        if prefetch_function_calls(callback_context, parts):
             #不是模型回复，是函数的调用
-            print(f"进行函数调用: {parts[0]}")
             return llm_response
         txt = "\n".join([p.text for p in parts if getattr(p, "text", None)])
-        result = _parse_solved(txt)
-        st = callback_context.state
+        self._record_result(callback_context.state, _parse_solved(txt))
+        return llm_response
+
+    @staticmethod
+    def _record_result(st, result: SolveResult):
         st["solved"] = result.solved
         st["final_answer"] = result.answer
+        # 模型判定失败时的说明不作为答案，工具实际成功时由控制Agent改用工具输出
+        st["final_reply"] = result.answer if result.solved else None
         st["used_tool"] = result.tool_name
         st["last_raw"] = result.raw
         # 记录失败轨迹（便于前端/日志观测）
         if not result.solved:
             err = {"tool": result.tool_name or "none", "error": result.answer, "raw": result.raw}
             st["failed_attempts"] = (st.get("failed_attempts") or []) + [err]
+
+
+# ========= 合并模式的求解 Agent：一次 LLM 调用内选工具并直接调用 =========
+class PlanExecuteAgent(LlmAgent):
+    def __init__(self, **kwargs):
+        super().__init__(
+            name="PlanExecuteAgent",
+            model=DEFAULT_MODEL,
+            description="从检索出的少量相关工具中直接选择并调用，不单独做候选分析",
+            tools=[CandidateToolset(default_top_k=MERGED_TOOL_TOP_N)],
+            instruction=self._instruction,
+            before_agent_callback=self._before_agent_cb,
+            after_model_callback=self._after_model_cb,
+            **kwargs
+        )
+
+    def _instruction(self, ctx: InvocationContext) -> str:
+        return PlanExecuteAgent_PROMPT.format(question=ctx.state.get("question", ""))
+
+    def _before_agent_cb(self, callback_context: CallbackContext) -> None:
+        """本轮暴露的工具：能直接确定候选时用它，否则取检索出的前 MERGED_TOOL_TOP_N 个未尝试工具"""
+        st = callback_context.state
+        shortcut = shortcut_candidates(st)
+        if shortcut:
+            st["tool_candidates"] = shortcut[0]
+        else:
+            st["tool_candidates"] = analyzer_tool_names(st.get("question", ""), exclude=st.get("tried_tools") or [],
+                                                        top_n=MERGED_TOOL_TOP_N)
+        st["final_reply"] = None
+        return None
+
+    def _after_model_cb(self, callback_context: CallbackContext, llm_response) -> Optional[Any]:
+        parts = (llm_response.content.parts if llm_response.content else None) or []
+        if prefetch_function_calls(callback_context, parts):
+            return llm_response
+        callback_context.state["final_reply"] = "\n".join(p.text for p in parts if getattr(p, "text", None))
         return llm_response
 
 
 # ========= 控制 Agent：更新尝试计数、缓存命中、终止条件与输出 =========
 class ControllerAgent(BaseAgent):
-    def __init__(self, **kwargs):
+    """
+    本轮有 MCP 工具返回了结构化 status 时直接据此判定：任一工具 success 即已解决，
+    工具成功后跳过了模型总结(skip_summarization)也能收敛；没有结构化结果时使用执行Agent给出的 SOLVED 结果。
+    """
+    # True 时只按工具的结构化 status 判定(合并模式，模型不输出 SOLVED 格式)
+    structured_status: bool = False
+
+    def __init__(self, name: str = "ControllerAgent", **kwargs):
         super().__init__(
-            name="ControllerAgent",
+            name=name,
             description="根据执行结果决定是否收敛输出或继续下一轮",
             **kwargs
         )
 
     async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
         st = ctx.session.state
+        TURN_PREFETCHER.discard(ctx.invocation_id)
+        calls = st.get("tool_calls") or []
+        results = round_tool_results(ctx, stop_authors=[self.name])
+        if self.structured_status:
+            decide_from_tool_status(st, results)
+        elif any(r["status"] in ("success", "error") for r in results):
+            decide_from_tool_status(st, results, record_failure=False)
+        record_attempt_outcomes(st)
+        st["tool_calls"] = []
+        st["final_reply"] = None
         st["attempts"] = int(st.get("attempts", 0)) + 1
         attempts = st["attempts"]
         max_attempts = int(st.get("max_attempts", DEFAULT_MAX_ATTEMPTS))
@@ -277,8 +565,9 @@ class ControllerAgent(BaseAgent):
         # 成功：输出+缓存映射
         if solved:
             if used_tool:
-                # 成功记忆：问题 -> 工具
-                get_cache().put(question, used_tool)
+                # 成功记忆：问题 -> 工具，以及调用参数（下次相同/相似问题可直接重放）
+                get_cache().put(question, used_tool, successful_call_arguments(calls, used_tool))
+            log_solver_run(st, solved=True)
             msg = f"✅ 已解决：{final_answer}\n（工具：{used_tool or 'none'}；尝试次数：{attempts}）"
             yield Event(author=self.name, content=types.Content(parts=[types.Part(text=msg)]))
             yield Event(author=self.name, actions=EventActions(escalate=True))
@@ -287,8 +576,12 @@ class ControllerAgent(BaseAgent):
         # 失败但未超出最大次数：记录已尝试工具并继续下一轮
         if used_tool and used_tool not in tried:
             st["tried_tools"] = tried + [used_tool]
+        # 缓存的工具这次没解决，后续轮次不再只暴露它
+        st["cached_tool"] = None
 
-        if attempts < max_attempts:
+        deadline = st.get("deadline")
+        stop_reason = early_stop_reason(st)
+        if attempts < max_attempts and not (deadline and time.time() >= deadline) and not stop_reason:
             # 给前端一个中间态说明（可选）
             last_err = (st.get("failed_attempts") or [{}])[-1]
             note = f"第 {attempts}/{max_attempts} 次尝试失败：{last_err.get('error','unknown')}（工具：{used_tool or 'none'}）。将换用其他工具重试。"
@@ -297,8 +590,13 @@ class ControllerAgent(BaseAgent):
             return
 
         # 彻底失败：汇总轨迹
+        log_solver_run(st, solved=False)
         logs = st.get("failed_attempts") or []
         lines = ["❌ 未能解决问题。", f"问题：{question}", f"共尝试 {attempts} 次。", "失败轨迹："]
+        if deadline and time.time() >= deadline:
+            lines.insert(1, "已超过本次求解的截止时间。")
+        elif stop_reason:
+            lines.insert(1, f"提前结束：{stop_reason}")
         for i, it in enumerate(logs, 1):
             lines.append(f"{i}. 工具={it.get('tool')}，错误/输出={it.get('error')}")
         yield Event(author=self.name, content=types.Content(parts=[types.Part(text="\n".join(lines))]))
@@ -306,18 +604,54 @@ class ControllerAgent(BaseAgent):
         return
 
 
+def _error_signature(error: Any) -> str:
+    """错误的归一化形式：去掉 URL、数字和多余空白，只比较前 200 个字符"""
+    text = re.sub(r"https?://\S+", "<url>", str(error or "")).lower()
+    text = re.sub(r"\d+", "0", text)
+    return " ".join(text.split())[:200]
+
+
+def early_stop_reason(st: Dict[str, Any]) -> Optional[str]:
+    """
+    继续尝试已经不可能成功时返回原因，控制Agent据此提前结束：
+    1) 所有已注册的工具都已尝试过；
+    2) 最近 REPEATED_FAILURE_LIMIT 次失败的错误完全相同(例如目标站点无法访问)。
+    """
+    tried = set(st.get("tried_tools") or [])
+    all_tools = REGISTRY.tools
+    if all_tools and all(name in tried for name in all_tools):
+        return f"所有 {len(all_tools)} 个工具都已尝试过。"
+    logs = st.get("failed_attempts") or []
+    if REPEATED_FAILURE_LIMIT > 0 and len(logs) >= REPEATED_FAILURE_LIMIT:
+        signatures = {_error_signature(it.get("error")) for it in logs[-REPEATED_FAILURE_LIMIT:]}
+        if len(signatures) == 1 and signatures != {""}:
+            return f"最近 {REPEATED_FAILURE_LIMIT} 次尝试的错误相同，继续重试不会成功。"
+    return None
+
+
+def log_solver_run(st: Dict[str, Any], solved: bool):
+    """每次求解结束记录一行：流水线模式、是否解决、尝试次数、总耗时，用于对比两种模式"""
+    started = st.get("started_at")
+    elapsed = round(time.time() - started, 2) if started else None
+    logger.info(f"[Solver] pipeline={st.get('pipeline') or 'staged'} solved={solved} "
+                f"attempts={st.get('attempts')} elapsed={elapsed}s tool={st.get('used_tool')}")
+
+
 # ========= Loop 入口 =========
 def _loop_before(callback_context: CallbackContext):
     # 每次 run 前清理“当前轮”的候选集合
+    # 其余字段已由上层 before_agent_callback 初始化时保留(例如缓存直达失败后记下的已尝试工具)
     st = callback_context.state
     st["tool_candidates"] = []
-    st["attempts"] = 0
-    st["max_attempts"] = DEFAULT_MAX_ATTEMPTS
-    st["tried_tools"] = []
-    st["failed_attempts"] = []
+    st["tool_calls"] = []
+    st["final_reply"] = None
+    st["attempts"] = st.get("attempts") or 0
+    st["max_attempts"] = st.get("max_attempts") or DEFAULT_MAX_ATTEMPTS
+    st["tried_tools"] = st.get("tried_tools") or []
+    st["failed_attempts"] = st.get("failed_attempts") or []
     return None
 
-solver_loop_agent = LoopAgent(
+staged_loop_agent = LoopAgent(
     name="ProblemSolverLoopAgent",
     max_iterations=200,  # 安全上限（真正终止由 Controller 控制）
     sub_agents=[
@@ -327,3 +661,34 @@ solver_loop_agent = LoopAgent(
     ],
     before_agent_callback=_loop_before
 )
+
+# 合并模式：每轮只有一次(带工具调用的)LLM 交互，由 Controller 按工具的结构化 status 判定结果
+merged_loop_agent = LoopAgent(
+    name="ProblemSolverMergedLoopAgent",
+    max_iterations=200,
+    sub_agents=[
+        PlanExecuteAgent(),
+        ControllerAgent(name="MergedControllerAgent", structured_status=True),
+    ],
+    before_agent_callback=_loop_before
+)
+
+
+class SolverRouterAgent(BaseAgent):
+    """按 state.pipeline 选择求解流水线：merged 走合并模式，其余走 分析->执行->控制 三段式"""
+    def __init__(self, **kwargs):
+        super().__init__(
+            name="ProblemSolverRouterAgent",
+            description="选择三段式或合并模式的求解循环",
+            sub_agents=[staged_loop_agent, merged_loop_agent],
+            **kwargs
+        )
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        merged = ctx.session.state.get("pipeline") == "merged"
+        agent = merged_loop_agent if merged else staged_loop_agent
+        async for event in agent.run_async(ctx):
+            yield event
+
+
+solver_loop_agent = SolverRouterAgent()
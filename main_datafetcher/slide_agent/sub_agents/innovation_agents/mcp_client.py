@@ -6,12 +6,48 @@
 # @Contact : github: johnson7788
 # @Desc  : List all MCP tools from an SSE server
 
+import os
 import json
+import atexit
+import time
+import random
+import weakref
 import threading
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from fastmcp import Client
-import asyncio, nest_asyncio
-nest_asyncio.apply()
+from fastmcp.exceptions import ClientError, ToolError
+from mcp.shared.exceptions import McpError
+import anyio
+import asyncio
+import concurrent.futures
+
+# 空闲多久关闭长连接（秒）、建立连接超时（秒）
+MCP_SESSION_IDLE_TIMEOUT = float(os.getenv("MCP_SESSION_IDLE_TIMEOUT", "300"))
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "30"))
+# 副本连续失败多少次后摘除、摘除多少秒后再试探、延迟 EWMA 的平滑系数
+MCP_REPLICA_MAX_FAILURES = int(os.getenv("MCP_REPLICA_MAX_FAILURES", "3"))
+MCP_REPLICA_EJECT_SECONDS = float(os.getenv("MCP_REPLICA_EJECT_SECONDS", "30"))
+MCP_REPLICA_EWMA_ALPHA = 0.3
+# 单次工具调用的默认超时（秒），下载类工具会启动浏览器，需要留足时间
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "300"))
+# 熔断：连续失败多少次后打开、打开多少秒后放一个试探请求
+MCP_BREAKER_FAILURES = int(os.getenv("MCP_BREAKER_FAILURES", "5"))
+MCP_BREAKER_RESET_SECONDS = float(os.getenv("MCP_BREAKER_RESET_SECONDS", "30"))
+# 幂等工具的最大重试次数、退避基数（秒）；重试预算：每次调用存入的令牌比例和令牌上限
+MCP_MAX_RETRIES = int(os.getenv("MCP_MAX_RETRIES", "2"))
+MCP_RETRY_BACKOFF = float(os.getenv("MCP_RETRY_BACKOFF", "0.5"))
+MCP_RETRY_BUDGET_RATIO = float(os.getenv("MCP_RETRY_BUDGET_RATIO", "0.2"))
+MCP_RETRY_BUDGET_MAX = float(os.getenv("MCP_RETRY_BUDGET_MAX", "10"))
+# 返回给 Agent 的文本最多保留多少字符，超出部分截断(完整的结构化字段不受影响)
+MCP_RESULT_MAX_CHARS = int(os.getenv("MCP_RESULT_MAX_CHARS", "20000"))
+# 这些异常说明服务端正常返回了错误，连接本身没问题，不需要重连
+_NON_TRANSPORT_ERRORS = (ClientError, ToolError, McpError)
+# 写入已关闭的会话流时抛出这些异常，此时请求还没有写出去
+_WRITE_CLOSED_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError)
+
+
+class RequestNotSentError(ConnectionError):
+    """连接没建立起来或会话已断开，请求没有发出去，对非幂等工具换副本重试也是安全的"""
 
 def clean_none(obj):
     if isinstance(obj, dict):
@@ -45,13 +81,23 @@ def tool_definition_to_dict(tool) -> Dict[str, Any]:
     if parameters:
         parameters = remove_title_fields(parameters)  # 递归清理
         parameters = clean_none(parameters)
+    annotations = getattr(tool, "annotations", None)
     tool_dict = {
         "name": tool.name,
         "description": getattr(tool, "description", None),
         "parameters": parameters,
+        "tags": sorted(tags) or None,
+        "annotations": annotations.model_dump(exclude_none=True) if annotations else None,
     }
     return {k: v for k, v in tool_dict.items() if v is not None}
 
+
+def is_idempotent_tool(tool_dict: Dict[str, Any]) -> bool:
+    """带 idempotent 标签，或 MCP annotations 声明 idempotentHint/readOnlyHint 的工具可以安全重试"""
+    annotations = tool_dict.get("annotations") or {}
+    return ("idempotent" in (tool_dict.get("tags") or [])
+            or bool(annotations.get("idempotentHint")) or bool(annotations.get("readOnlyHint")))
+
 async def get_mcp_tools(server_url: str) -> List[Dict[str, Any]]:
     """获取MCPserver的所有工具通过SSE协议"""
     client = Client(server_url)
@@ -63,58 +109,617 @@ async def get_mcp_tools(server_url: str) -> List[Dict[str, Any]]:
             print(f"❌ Failed to get tools from {server_url}: {e}")
             return []
 
-async def call_mcp_tool_async(server_url, tool_name: str, arguments: Dict[str, Any]) -> Any:
+
+async def get_mcp_server_tools(server_url: Union[str, List[str]]) -> Dict[str, Any]:
     """
-    通过 fastmcp.Client 调用 MCP 工具（异步版本）。
-    server_or_config: 可为单个 server url / 路径 / FastMCP 实例 / 或包含 "mcpServers" 的 config dict
+    获取 MCP server 的版本和全部工具，失败时直接抛出异常（由调用方决定超时和降级）。
+    server_url 为副本列表时依次尝试，返回第一个成功的副本的结果。
+    返回: {"version": 服务端版本(取不到为空字符串), "tools": [工具定义]}
     """
+    if not isinstance(server_url, str):
+        last_error: Optional[Exception] = None
+        for url in server_url:
+            try:
+                return await get_mcp_server_tools(url)
+            except Exception as e:
+                last_error = e
+        raise last_error or ValueError("empty replica list")
     client = Client(server_url)
     async with client:
-        # fastmcp.Client.call_tool 返回的对象可直接是结果，也可能带 .data 属性
+        tools = await client.list_tools()
+        init = getattr(client, "initialize_result", None)
+        server_info = getattr(init, "serverInfo", None)
+        version = f"{getattr(server_info, 'name', '')}@{getattr(server_info, 'version', '')}" if server_info else ""
+        return {"version": version, "tools": [tool_definition_to_dict(t) for t in tools]}
+
+
+class _PooledSession:
+    """
+    一个 server url 对应的一条长连接。
+    fastmcp.Client 的 async with 上下文必须在同一个 task 中进入和退出，
+    所以由一个后台 task 持有连接，调用方只通过 self.client 并发发送请求（同一会话按请求 id 复用）。
+    """
+    def __init__(self, server_url: str):
+        self.server_url = server_url
+        self.client: Optional[Client] = None
+        self.error: Optional[BaseException] = None
+        self.inflight = 0
+        self.last_used = time.monotonic()
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _hold(self):
         try:
-            result = await client.call_tool(tool_name, arguments or {})
-            # 1. 有些返回是 dataclass / Pydantic 模型，尝试转成 dict
-            if hasattr(result, "content"):
-                # . 如果是 list of Root()
-                if isinstance(result.content, list):
-                    result = result.content[0].text
+            client = Client(self.server_url)
+            async with client:
+                self.client = client
+                self._ready.set()
+                await self._closing.wait()
         except Exception as e:
-            print(f"❌ Failed to call tool {tool_name} from {server_url}: {e}")
-            return str(e)
-
-        return result
-
-
-# def call_mcp_tool_sync(server_url, tool_name: str, arguments: Dict[str, Any]) -> str:
-#     loop = None
-#     try:
-#         loop = asyncio.get_running_loop()
-#     except RuntimeError:
-#         pass
-#
-#     if loop and loop.is_running():
-#         # 已经有 loop，直接 run_until_complete
-#         return loop.run_until_complete(call_mcp_tool_async(server_url, tool_name, arguments))
-#     else:
-#         # 没有 loop，用 asyncio.run
-#         return asyncio.run(call_mcp_tool_async(server_url, tool_name, arguments))
-
-def call_mcp_tool_sync(server_url, tool_name: str, arguments: Dict[str, Any]) -> Any:
+            self.error = e
+        finally:
+            self.client = None
+            self._ready.set()
+
+    async def start(self, timeout: float = MCP_CONNECT_TIMEOUT):
+        self._task = asyncio.create_task(self._hold())
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise RequestNotSentError(f"connect to {self.server_url} timed out after {timeout}s")
+        if self.client is None:
+            raise RequestNotSentError(f"connect to {self.server_url} failed: {self.error}")
+
+    @property
+    def alive(self) -> bool:
+        return self.client is not None and self._task is not None and not self._task.done()
+
+    async def close(self):
+        self._closing.set()
+        if self._task and not self._task.done():
+            done, _ = await asyncio.wait([self._task], timeout=5)
+            if not done:
+                self._task.cancel()
+
+
+class MCPSessionPool:
+    """
+    每个 server url 一条长连接的连接池（属于某一个事件循环）：
+    - 首次调用时建立连接，后续调用直接复用，同一连接上的并发调用由 MCP 会话按请求 id 复用；
+    - 请求写出之前发现连接已断开时，丢弃旧连接、重连后重发一次；
+      请求已经发出后的连接层异常只丢弃连接并向上抛，是否重试由调用方按幂等性和重试预算决定；
+    - 后台任务定期关闭空闲超过 idle_timeout 的连接。
+    """
+    def __init__(self, idle_timeout: float = MCP_SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, _PooledSession] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def _acquire(self, server_url: str) -> _PooledSession:
+        session = self._sessions.get(server_url)
+        if session and session.alive:
+            return session
+        lock = self._locks.setdefault(server_url, asyncio.Lock())
+        async with lock:
+            session = self._sessions.get(server_url)
+            if session and session.alive:
+                return session
+            if session:
+                await session.close()
+            session = _PooledSession(server_url)
+            await session.start()
+            self._sessions[server_url] = session
+            if self._reaper is None or self._reaper.done():
+                self._reaper = asyncio.create_task(self._reap_idle())
+            return session
+
+    async def _discard(self, server_url: str, session: _PooledSession):
+        if self._sessions.get(server_url) is session:
+            del self._sessions[server_url]
+        await session.close()
+
+    async def _run(self, server_url: str, method: str, *args, **kwargs):
+        for attempt in range(2):
+            session = await self._acquire(server_url)
+            client = session.client
+            if client is None or not client.is_connected():
+                await self._discard(server_url, session)
+                if attempt:
+                    raise RequestNotSentError(f"MCP session to {server_url} closed before sending")
+                continue
+            session.inflight += 1
+            try:
+                return await getattr(client, method)(*args, **kwargs)
+            except _NON_TRANSPORT_ERRORS:
+                raise
+            except _WRITE_CLOSED_ERRORS as e:
+                await self._discard(server_url, session)
+                if attempt:
+                    raise RequestNotSentError(f"MCP session to {server_url} closed before sending: {e!r}") from e
+                print(f"⚠️ MCP session to {server_url} broken ({e!r}), reconnecting...")
+            except Exception:
+                # 请求可能已经到达 server，不能在这里重发
+                await self._discard(server_url, session)
+                raise
+            finally:
+                session.inflight -= 1
+                session.last_used = time.monotonic()
+
+    async def call_tool(self, server_url: str, tool_name: str, arguments: Dict[str, Any], **kwargs) -> Any:
+        return await self._run(server_url, "call_tool", tool_name, arguments, **kwargs)
+
+    async def list_tools(self, server_url: str) -> Any:
+        return await self._run(server_url, "list_tools")
+
+    async def _reap_idle(self):
+        while self._sessions:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 2))
+            now = time.monotonic()
+            for url, session in list(self._sessions.items()):
+                if session.inflight == 0 and now - session.last_used > self.idle_timeout:
+                    await self._discard(url, session)
+
+    async def close(self):
+        for url, session in list(self._sessions.items()):
+            await self._discard(url, session)
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+
+
+# 连接只能在创建它的事件循环中使用，所以每个事件循环一个连接池
+_POOLS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, MCPSessionPool]" = weakref.WeakKeyDictionary()
+
+def get_session_pool() -> MCPSessionPool:
+    loop = asyncio.get_running_loop()
+    pool = _POOLS.get(loop)
+    if pool is None:
+        pool = MCPSessionPool()
+        _POOLS[loop] = pool
+    return pool
+
+class _ReplicaStats:
+    def __init__(self):
+        self.inflight = 0
+        self.ewma_latency = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+
+class ReplicaSet:
+    """
+    同一个逻辑 server 的多个副本 url：
+    - 按 (在途请求数 + 1) × 延迟 EWMA 选择副本，即延迟加权的最少在途请求；
+    - 连续失败 MCP_REPLICA_MAX_FAILURES 次的副本摘除 MCP_REPLICA_EJECT_SECONDS 秒，到期后重新参与选择；
+    - 全部副本都被摘除时，选最早到期的那个，避免无副本可用。
+    只统计连接/超时等传输层失败，工具自身返回的错误不影响副本健康度。
+    """
+    def __init__(self, urls: List[str]):
+        self.urls = list(dict.fromkeys(urls))
+        self.stats = {url: _ReplicaStats() for url in self.urls}
+        self._lock = threading.Lock()
+
+    def pick(self, exclude: Optional[List[str]] = None) -> str:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [u for u in self.urls if u not in (exclude or [])] or self.urls
+            healthy = [u for u in candidates if self.stats[u].ejected_until <= now]
+            if not healthy:
+                return min(candidates, key=lambda u: self.stats[u].ejected_until)
+            # 没有延迟数据的副本按 0 计，保证新副本能先被试到
+            return min(healthy, key=lambda u: ((self.stats[u].inflight + 1) * self.stats[u].ewma_latency,
+                                               self.stats[u].inflight))
+
+    def begin(self, url: str):
+        with self._lock:
+            self.stats[url].inflight += 1
+
+    def end(self, url: str, ok: bool, latency: float):
+        with self._lock:
+            st = self.stats[url]
+            st.inflight -= 1
+            if ok:
+                st.consecutive_failures = 0
+                st.ejected_until = 0.0
+                st.ewma_latency = latency if st.ewma_latency == 0 else (
+                    MCP_REPLICA_EWMA_ALPHA * latency + (1 - MCP_REPLICA_EWMA_ALPHA) * st.ewma_latency)
+            else:
+                st.consecutive_failures += 1
+                if st.consecutive_failures >= MCP_REPLICA_MAX_FAILURES:
+                    st.ejected_until = time.monotonic() + MCP_REPLICA_EJECT_SECONDS
+                    print(f"⚠️ MCP replica {url} ejected for {MCP_REPLICA_EJECT_SECONDS}s after {st.consecutive_failures} failures")
+
+    def release(self, url: str):
+        """调用被取消时只归还在途计数，不影响副本健康度"""
+        with self._lock:
+            self.stats[url].inflight -= 1
+
+
+_REPLICA_SETS: Dict[Tuple[str, ...], ReplicaSet] = {}
+_REPLICA_SETS_LOCK = threading.Lock()
+
+def get_replica_set(server_url: Union[str, List[str]]) -> ReplicaSet:
+    """server_url 可以是单个 url，也可以是同一个 server 的多个副本 url 列表"""
+    urls = (server_url,) if isinstance(server_url, str) else tuple(server_url)
+    with _REPLICA_SETS_LOCK:
+        replicas = _REPLICA_SETS.get(urls)
+        if replicas is None:
+            replicas = _REPLICA_SETS[urls] = ReplicaSet(list(urls))
+        return replicas
+
+
+class CircuitBreaker:
+    """
+    每个逻辑 server 一个熔断器：
+    closed 正常放行；连续失败 MCP_BREAKER_FAILURES 次后 open，直接快速失败；
+    open 持续 MCP_BREAKER_RESET_SECONDS 秒后进入 half_open，只放行一个试探请求，成功则恢复 closed，失败重新 open。
+    """
+    def __init__(self, failures: int = MCP_BREAKER_FAILURES, reset_seconds: float = MCP_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failures:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release_probe(self):
+        """试探请求被取消时没有结果，不计成功也不计失败，让下一个请求重新试探"""
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+
+class RetryBudget:
+    """
+    重试预算（令牌桶）：每次调用存入 ratio 个令牌，每次重试消耗 1 个，上限 max_tokens。
+    server 整体出问题时重试量被限制在调用量的 ratio 倍以内，不会因为重试把故障放大。
+    """
+    def __init__(self, ratio: float = MCP_RETRY_BUDGET_RATIO, max_tokens: float = MCP_RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def record_call(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+_BREAKERS: Dict[Tuple[str, ...], CircuitBreaker] = {}
+_RETRY_BUDGETS: Dict[Tuple[str, ...], RetryBudget] = {}
+
+def _server_key(server_url: Union[str, List[str]]) -> Tuple[str, ...]:
+    return (server_url,) if isinstance(server_url, str) else tuple(server_url)
+
+def get_circuit_breaker(server_url: Union[str, List[str]]) -> CircuitBreaker:
+    key = _server_key(server_url)
+    with _REPLICA_SETS_LOCK:
+        return _BREAKERS.setdefault(key, CircuitBreaker())
+
+def get_retry_budget(server_url: Union[str, List[str]]) -> RetryBudget:
+    key = _server_key(server_url)
+    with _REPLICA_SETS_LOCK:
+        return _RETRY_BUDGETS.setdefault(key, RetryBudget())
+
+
+def tool_error(tool_name: str, error_type: str, message: str, retryable: bool = False, **extra) -> Dict[str, Any]:
+    """
+    工具调用失败时返回给 Agent 的结构化错误，不再把异常字符串当结果返回。
+    error_type: tool_error | timeout | deadline_exceeded | circuit_open | transport
+    """
+    return {"status": "error", "tool": tool_name, "error_type": error_type,
+            "message": message, "retryable": retryable, **extra}
+
+
+def _content_part_to_dict(part) -> Dict[str, Any]:
+    if isinstance(part, dict):
+        return part
+    if hasattr(part, "model_dump"):
+        return part.model_dump(exclude_none=True)
+    return {"type": "text", "text": str(part)}
+
+
+def iter_result_parts(result) -> List[Dict[str, Any]]:
+    """取出调用结果中的全部内容块(新版 fastmcp 的 .content，或旧版直接返回的列表)"""
+    parts = getattr(result, "content", result)
+    if not isinstance(parts, list):
+        parts = [parts]
+    return [_content_part_to_dict(p) for p in parts]
+
+
+def normalize_tool_result(result, max_chars: int = MCP_RESULT_MAX_CHARS) -> Dict[str, Any]:
+    """
+    把 fastmcp 的调用结果转成结构化 dict: {"status", "text", ...server 返回的结构化字段}
+    - 新版 fastmcp 直接使用 structured_content；旧版只有内容块时，单个 JSON 文本块解析为结构化字段；
+    - 兼容 server 端直接返回 mcp CallToolResult 被序列化成 JSON 的情况；
+    - 多个内容块的文本依次拼接，超过 max_chars 截断并标记 truncated；
+      图片/资源等非文本块只保留类型、mimeType 和大小，不把二进制内容交给 LLM；
+    - server 没有给出 status 时，按文本前缀 ❌ 推断为 error，否则为 success。
+    """
+    structured = getattr(result, "structured_content", None)
+    parts = iter_result_parts(result)
+    if structured is None and len(parts) == 1 and parts[0].get("type") == "text":
+        try:
+            loaded = json.loads(parts[0].get("text") or "")
+            if isinstance(loaded, dict):
+                structured, parts = loaded, []
+        except ValueError:
+            pass
+    structured = dict(structured or {})
+    if isinstance(structured.get("content"), list) and ("structuredContent" in structured or "isError" in structured):
+        # server 返回的是被整体序列化的 CallToolResult
+        inner = structured
+        parts = [_content_part_to_dict(p) for p in inner["content"]]
+        structured = dict(inner.get("structuredContent") or {})
+        if inner.get("meta"):
+            structured.setdefault("meta", inner["meta"])
+
+    texts, attachments, size = [], [], 0
+    truncated = False
+    text = structured.pop("text", None)
+    if text:
+        texts.append(text)
+        size = len(text)
+    for part in parts:
+        if part.get("type") == "text":
+            piece = part.get("text") or ""
+            if size + len(piece) > max_chars:
+                piece = piece[:max(0, max_chars - size)]
+                truncated = True
+            if piece:
+                texts.append(piece)
+                size += len(piece)
+        else:
+            data = part.get("data") or (part.get("resource") or {}).get("blob") or ""
+            attachments.append({"type": part.get("type"),
+                                "mimeType": part.get("mimeType") or (part.get("resource") or {}).get("mimeType"),
+                                "uri": (part.get("resource") or {}).get("uri"),
+                                "size": len(data)})
+    text = "\n".join(texts)
+    status = structured.pop("status", None) or ("error" if text.lstrip().startswith("❌") else "success")
+    normalized = {"status": status, "text": text, **structured}
+    if attachments:
+        normalized["attachments"] = attachments
+    if truncated:
+        normalized["truncated"] = True
+    return normalized
+
+
+async def call_mcp_tool_async(server_url: Union[str, List[str]], tool_name: str, arguments: Dict[str, Any],
+                              timeout: Optional[float] = None, deadline: Optional[float] = None,
+                              idempotent: bool = False,
+                              on_progress: Optional[Callable[[float, Optional[float], Optional[str]], Awaitable[None]]] = None) -> Dict[str, Any]:
+    """
+    通过 fastmcp.Client 调用 MCP 工具（异步版本），复用连接池中该 server 的长连接。
+    server_url: 单个 server url，或同一个 server 的多个副本 url 列表（按负载选择副本）
+    timeout: 单次调用超时（秒），默认 MCP_CALL_TIMEOUT
+    deadline: 整个 Agent 运行的截止时间(time.time() 时间戳)，单次超时不会超过剩余时间
+    idempotent: 幂等工具在超时/传输失败时按带抖动的指数退避重试，受 MCP_MAX_RETRIES 和重试预算限制；
+                非幂等工具只在连接都没建立起来时换副本重试
+    on_progress: 可选的 async 回调 (progress, total, message)，收到 server 的进度通知时调用
+    成功时返回 normalize_tool_result(...) 的结构化结果 {"status", "text", ...}；
+    失败时返回 tool_error(...) 结构化错误；server 熔断期间直接返回 circuit_open，不再发请求。
+    """
+    replicas = get_replica_set(server_url)
+    breaker = get_circuit_breaker(server_url)
+    budget = get_retry_budget(server_url)
+    budget.record_call()
+    tried: List[str] = []
+    retries = 0
+    while True:
+        call_timeout = timeout or MCP_CALL_TIMEOUT
+        if deadline is not None:
+            call_timeout = min(call_timeout, deadline - time.time())
+            if call_timeout <= 0:
+                return tool_error(tool_name, "deadline_exceeded", "agent run deadline exceeded before calling tool")
+        if not breaker.allow():
+            return tool_error(tool_name, "circuit_open",
+                              f"server {replicas.urls} is failing, retry after {breaker.retry_after():.0f}s",
+                              retryable=True)
+        url = replicas.pick(exclude=tried)
+        tried.append(url)
+        replicas.begin(url)
+        start = time.monotonic()
+        # 旧版 fastmcp 的 call_tool 不支持 progress_handler，只在需要时传
+        kwargs = {"progress_handler": on_progress} if on_progress else {}
+        try:
+            result = await asyncio.wait_for(
+                get_session_pool().call_tool(url, tool_name, arguments or {}, **kwargs), call_timeout)
+            replicas.end(url, ok=True, latency=time.monotonic() - start)
+            breaker.record_success()
+            normalized = normalize_tool_result(result)
+            normalized.setdefault("client_elapsed_sec", round(time.monotonic() - start, 3))
+            return normalized
+        except _NON_TRANSPORT_ERRORS as e:
+            # server 正常处理了请求，只是工具本身报错：不算 server 故障，也不重试
+            replicas.end(url, ok=True, latency=time.monotonic() - start)
+            breaker.record_success()
+            print(f"❌ Failed to call tool {tool_name} from {url}: {e}")
+            return tool_error(tool_name, "tool_error", str(e))
+        except asyncio.TimeoutError:
+            error = tool_error(tool_name, "timeout", f"no response from {url} within {call_timeout:.1f}s", retryable=True)
+            sent = True
+        except Exception as e:
+            error = tool_error(tool_name, "transport", f"{type(e).__name__}: {e}", retryable=True)
+            # 只有确定请求还没发出时，非幂等工具才可以安全地换副本
+            sent = not isinstance(e, RequestNotSentError)
+        except BaseException:
+            # 被取消(如推测执行中落选的调用)：归还副本和熔断试探名额后继续向上抛
+            replicas.release(url)
+            breaker.release_probe()
+            raise
+        replicas.end(url, ok=False, latency=time.monotonic() - start)
+        breaker.record_failure()
+        print(f"❌ Failed to call tool {tool_name} from {url}: {error['message']}")
+
+        if not sent and len(tried) < len(replicas.urls):
+            continue
+        if not idempotent or retries >= MCP_MAX_RETRIES or not budget.try_spend():
+            return error
+        retries += 1
+        # full jitter 退避，且不超过截止时间
+        delay = random.uniform(0, MCP_RETRY_BACKOFF * (2 ** retries))
+        if deadline is not None and time.time() + delay >= deadline:
+            return error
+        await asyncio.sleep(delay)
+        if len(tried) >= len(replicas.urls):
+            tried = []
+
+
+async def call_mcp_tool_stream(server_url: Union[str, List[str]], tool_name: str, arguments: Dict[str, Any],
+                               **kwargs) -> AsyncIterator[Dict[str, Any]]:
+    """
+    流式调用工具：一边等待结果一边产出 server 的进度通知，最后产出结构化结果。
+    MCP 的工具结果只能整体返回，耗时长的工具通过进度通知增量地报告进展。
+    产出: {"type": "progress", "progress", "total", "message"} ... {"type": "result", "result": {...}}
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def _on_progress(progress, total=None, message=None):
+        queue.put_nowait({"type": "progress", "progress": progress, "total": total, "message": message})
+
+    task = asyncio.create_task(call_mcp_tool_async(server_url, tool_name, arguments,
+                                                   on_progress=_on_progress, **kwargs))
     try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = None
-
-    if loop and loop.is_running():
-        # 如果当前在运行的事件循环中，在线程中执行异步任务
-        future = asyncio.run_coroutine_threadsafe(
-            call_mcp_tool_async(server_url, tool_name, arguments),
-            loop
-        )
-        return future.result()
-    else:
-        # 如果没有正在运行的 loop，直接新建一个
-        return asyncio.run(call_mcp_tool_async(server_url, tool_name, arguments))
+        while not task.done() or not queue.empty():
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait([getter, task], return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+            else:
+                getter.cancel()
+        yield {"type": "result", "result": task.result()}
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+class BackgroundLoop:
+    """
+    同步调用方使用的专用后台事件循环：一个守护线程运行事件循环，持有该循环下的 MCP 连接池。
+    同步代码把协程提交到这个循环并阻塞等待结果，不再在调用方自己的循环上嵌套运行(不需要 nest_asyncio)。
+    """
+    def __init__(self, name: str = "mcp-client-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True, name=self.name)
+                self._thread.start()
+                ready.wait()
+            return self._loop
+
+    def _run(self, ready: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """提交协程到后台循环，返回 concurrent.futures.Future"""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("cannot block on the MCP background loop from inside it, await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """阻塞等待协程在后台循环中执行完成；超时会取消后台任务"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = 5):
+        """关闭后台循环中的连接池并停止线程"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._thread = None
+        if loop is None or thread is None or not thread.is_alive():
+            return
+
+        async def _shutdown():
+            pool = _POOLS.get(loop)
+            if pool is not None:
+                await pool.close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_shutdown(), loop).result(timeout)
+        except Exception as e:
+            print(f"⚠️ Failed to close MCP sessions: {e!r}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+
+_BACKGROUND_LOOP = BackgroundLoop()
+atexit.register(_BACKGROUND_LOOP.stop)
+
+def get_background_loop() -> BackgroundLoop:
+    return _BACKGROUND_LOOP
+
+def run_sync(coro, timeout: Optional[float] = None) -> Any:
+    """
+    在同步代码中运行协程(加载工具、后台线程刷新等)，统一交给后台循环执行。
+    当前线程即使有正在运行的事件循环也不会死锁，但会阻塞该循环，异步代码中请直接 await。
+    """
+    return _BACKGROUND_LOOP.run(coro, timeout)
+
+
+def call_mcp_tool_sync(server_url, tool_name: str, arguments: Dict[str, Any], **kwargs) -> Any:
+    """call_mcp_tool_async 的同步版本，在后台循环中执行，复用后台循环持有的长连接"""
+    return run_sync(call_mcp_tool_async(server_url, tool_name, arguments, **kwargs))
 
 
 async def main():
@@ -10,6 +10,30 @@ AnalyzerAgent_PROMPT = """你是工具调度分析器。请阅读用户问题与
 {{"candidates": ["<tool_name_1>", "<tool_name_2>"]}}
 """
 
+AnalyzerAgent_SPECULATIVE_PROMPT = """你是工具调度分析器。请阅读用户问题与已失败的工具，
+从下面的工具中选择**最有可能解决问题**的至多 {try_num} 个工具名，按优先级从高到低返回，
+并从问题中一次性抽取这些工具需要的参数（同名参数各工具共用，带 ? 的为可选参数）。
+工具清单：
+{tool_desc}
+
+工具参数：
+{tool_params}
+
+用户问题：{question}
+已失败的工具：{tried}
+
+请仅输出 JSON（不要输出其它内容）：
+{{"candidates": ["<tool_name_1>", "<tool_name_2>"], "arguments": {{"<参数名>": "<参数值>"}}}}
+"""
+
+PlanExecuteAgent_PROMPT = """你是问题求解助手。可用工具已按与问题的相关程度筛选好，
+请直接选择最合适的工具并调用，不需要先输出计划。
+工具返回 {{'status':'success', ...}} 即为成功；返回 {{'status':'error', ...}} 时换用其他可用工具继续尝试。
+成功后用简洁的文字给出最终答案；所有工具都失败时说明失败原因。
+
+用户问题：{question}
+"""
+
 ExecutorAgent_PROMPT = """你是问题求解助手。你必须尽可能调用可用的工具；
 当工具返回 {{'status':'success', ...}} 时即可视为成功。
 若工具返回 {{'status':'error', ...}}，你应换用其他工具继续尝试（如果还有）。
@@ -0,0 +1,808 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/10/23 10:20
+# @File  : tool_cache.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 工具命中缓存（本地 sqlite）：问题 -> 成功的工具，支持按字符 n-gram MinHash LSH 查找相似问题；
+#          按 (域名, 问题簇, 工具) 统计成败和耗时，用 Thompson 采样给候选工具排序；
+#          缓存条目有 TTL 和数量上限，连续失败自动失效，在某个域名上连续失败的工具会被暂时排除；
+#          条目同时保存成功调用的参数模板，命中后可以不经过 LLM 直接重放
+
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import random
+import struct
+import sqlite3
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+CACHE_DB_PATH = os.getenv("SOLVER_TOOL_CACHE_DB", "tool_cache.db")
+# 相似问题命中的 Jaccard 阈值，低于该值视为未命中。
+# 按字符二元组计算时，同一模板只换了 URL、项目名、目录的问题在 0.5~0.7 之间，不同任务的问题一般低于 0.3
+SIMILARITY_THRESHOLD = float(os.getenv("SOLVER_CACHE_SIMILARITY", "0.5"))
+# MinHash 的签名长度 = LSH_BANDS * LSH_ROWS；band 越多召回越高，row 越多越严格。
+# 32 x 2 时相似度 0.5 的问题至少落入同一个 bucket 的概率 1-(1-0.5^2)^32 > 99.9%
+LSH_BANDS = 32
+LSH_ROWS = 2
+SHINGLE_SIZE = 2
+# 分词或 LSH 参数变化后旧的 lsh 表不再可用，版本号记在 PRAGMA user_version 中，不一致时重建
+LSH_SCHEME_VERSION = 2
+# 每个 bucket 最多取出的候选数、按碰撞次数排序后精确计算相似度的候选数，避免高频模板问题拖慢查询。
+# 模板类问题会挤满同一批 bucket，每个 bucket 按 qid 从新到旧取候选，优先比较最近入库的问题
+MAX_BUCKET_CANDIDATES = 50
+MAX_RERANK_CANDIDATES = 20
+
+# 缓存条目的有效期（秒，从最近一次成功算起）和条目数上限，超出后按最近使用时间淘汰
+CACHE_TTL = float(os.getenv("SOLVER_CACHE_TTL", str(30 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("SOLVER_CACHE_MAX_ENTRIES", "50000"))
+# 缓存的工具连续失败多少次后删除该条目
+CACHE_MAX_FAILURES = int(os.getenv("SOLVER_CACHE_MAX_FAILURES", "2"))
+# 工具在同一域名上连续失败多少次后记为负缓存，以及负缓存的有效期（秒）
+NEGATIVE_AFTER_FAILURES = int(os.getenv("SOLVER_NEGATIVE_AFTER_FAILURES", "3"))
+NEGATIVE_TTL = float(os.getenv("SOLVER_NEGATIVE_TTL", str(24 * 3600)))
+# 没有缓存条目(未解决或条目已淘汰)的问题最多保留多少条，超过 CACHE_TTL 未再出现的也删除
+QUESTIONS_MAX_UNSOLVED = int(os.getenv("SOLVER_CACHE_MAX_UNSOLVED", "50000"))
+# 工具统计多久没有更新就删除（秒），以及统计行数上限，超出后删除最久没更新的
+TOOL_STATS_TTL = float(os.getenv("SOLVER_TOOL_STATS_TTL", str(90 * 24 * 3600)))
+TOOL_STATS_MAX_ROWS = int(os.getenv("SOLVER_TOOL_STATS_MAX_ROWS", "200000"))
+# 每写入多少次(缓存条目或调用结果)做一次淘汰
+EVICT_EVERY_WRITES = 100
+
+# 写入线程的批量提交：攒够 WRITE_BATCH_SIZE 条或等待 WRITE_BATCH_WINDOW 秒后一次提交
+WRITE_BATCH_SIZE = 256
+WRITE_BATCH_WINDOW = float(os.getenv("SOLVER_CACHE_WRITE_WINDOW", "0.05"))
+# 进程内查询结果 LRU 的条目数
+LOOKUP_LRU_SIZE = int(os.getenv("SOLVER_CACHE_LRU_SIZE", "4096"))
+# 没有耗时数据时假设的单次工具耗时（秒），以及这个先验相当于几次观测
+DEFAULT_TOOL_LATENCY = float(os.getenv("SOLVER_DEFAULT_TOOL_LATENCY", "60"))
+LATENCY_PRIOR_WEIGHT = 1.0
+# 排序时各统计层级的权重：(域名, 问题簇) 最具体，其次是同域名、同问题簇，最后是工具的全局统计
+STATS_LEVEL_WEIGHTS = {"domain_cluster": 1.0, "domain": 0.5, "cluster": 0.5, "global": 0.1}
+
+# 参数模板中记录参数值前后各多少个字符作为定位上下文，以及可以填入的值的最大长度
+TEMPLATE_CONTEXT_CHARS = 3
+TEMPLATE_MAX_SPAN = 200
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# URL 只由 ASCII 可见字符组成，遇到中文或空白即结束
+_URL_RE = re.compile(r"https?://[!-~]+|www\.[!-~]+", re.IGNORECASE)
+_DIGIT_RE = re.compile(r"\d+")
+# 问题中的实体：引号/书名号中的名称、文件路径、带下划线或连字符的英文标识(目录名、项目名)
+_QUOTED_RE = re.compile(r"“[^”]{1,50}”|‘[^’]{1,50}’|\"[^\"]{1,50}\"|'[^']{1,50}'|「[^」]{1,50}」|『[^』]{1,50}』|《[^》]{1,50}》")
+_PATH_RE = re.compile(r"[\w.~-]*[/\\][\w./\\~-]*")
+_IDENT_RE = re.compile(r"\b[a-z][a-z0-9]*(?:[_-][a-z0-9]+)+\b")
+# 用于参数模板的 URL：不包含中文标点和引号，避免把问题中紧跟在 URL 后的标点当成 URL 的一部分
+_TEMPLATE_URL_RE = re.compile(r"https?://[^\s，。；！？、）)】」》\"'<>]+", re.IGNORECASE)
+
+
+def _permutations(n: int):
+    """固定种子生成 MinHash 的 (a, b) 参数，保证不同进程、重启前后签名一致"""
+    params = []
+    for i in range(n):
+        digest = hashlib.blake2b(f"minhash-{i}".encode("utf-8"), digest_size=16).digest()
+        a, b = struct.unpack("<QQ", digest)
+        params.append((a % (_MERSENNE_PRIME - 1) + 1, b % _MERSENNE_PRIME))
+    return params
+
+_PERMUTATIONS = _permutations(LSH_BANDS * LSH_ROWS)
+
+
+def normalize_question(q: str) -> str:
+    return " ".join((q or "").strip().lower().split())
+
+
+def question_shingles(q: str, size: int = SHINGLE_SIZE) -> set:
+    """
+    问题的字符 n-gram 集合。URL、数字和实体(引号中的名称、路径、英文标识)替换成占位符，
+    "把 A 站点的年报下载到 X" 和 "把 B 站点的年报下载到 Y" 这类同一模式的问题会非常接近。
+    """
+    text = _URL_RE.sub(" ⓤ ", normalize_question(q))
+    text = _QUOTED_RE.sub(" ⓔ ", text)
+    text = _PATH_RE.sub(" ⓟ ", text)
+    text = _IDENT_RE.sub(" ⓔ ", text)
+    text = _DIGIT_RE.sub("0", text)
+    text = " ".join(text.split())
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def question_domain(q: str) -> str:
+    """问题中第一个 URL 的域名(去掉 www.)，没有 URL 时为空字符串"""
+    match = _URL_RE.search(q or "")
+    if not match:
+        return ""
+    url = match.group(0)
+    host = (urlparse(url if "://" in url else "http://" + url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def minhash_signature(shingles: set) -> List[int]:
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+              for s in shingles]
+    if not hashes:
+        return [0] * len(_PERMUTATIONS)
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def lsh_buckets(signature: List[int]) -> List[int]:
+    """把签名切成 LSH_BANDS 段，每段哈希成一个 bucket（sqlite INTEGER 范围内的有符号 64 位整数）"""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(struct.pack(f"<{LSH_ROWS}Q", *[r & 0xFFFFFFFFFFFFFFFF for r in rows]),
+                                 digest_size=8).digest()
+        buckets.append(struct.unpack("<q", digest)[0])
+    return buckets
+
+
+def build_args_template(question: str, arguments: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    由成功调用的参数生成参数模板，每个参数一个槽位：
+    - {"url": i}: 问题中第 i 个 URL；
+    - {"question": true}: 整个问题；
+    - {"left": .., "right": ..}: 问题中的一段文字，用它前后的几个字符定位；
+    - {"const": v}: 问题中找不到的值(数字、布尔值、模型生成的文字)，原样重放。
+    """
+    question = (question or "").strip()
+    urls = _TEMPLATE_URL_RE.findall(question)
+    template = {}
+    for name, value in (arguments or {}).items():
+        if not isinstance(value, str) or not value.strip():
+            template[name] = {"const": value}
+        elif value in urls:
+            template[name] = {"url": urls.index(value)}
+        elif value == question:
+            template[name] = {"question": True}
+        elif value in question and len(value) <= TEMPLATE_MAX_SPAN and "\n" not in value:
+            start = question.find(value)
+            end = start + len(value)
+            template[name] = {"left": question[max(0, start - TEMPLATE_CONTEXT_CHARS):start],
+                              "right": question[end:end + TEMPLATE_CONTEXT_CHARS]}
+        else:
+            template[name] = {"const": value}
+    return template
+
+
+def fill_args_template(template: Dict[str, Dict[str, Any]], question: str) -> Optional[Dict[str, Any]]:
+    """用新问题填充参数模板，任何一个槽位在新问题中找不到时返回 None"""
+    question = (question or "").strip()
+    urls = _TEMPLATE_URL_RE.findall(question)
+    arguments = {}
+    for name, slot in template.items():
+        if "const" in slot:
+            arguments[name] = slot["const"]
+        elif "url" in slot:
+            if slot["url"] >= len(urls):
+                return None
+            arguments[name] = urls[slot["url"]]
+        elif slot.get("question"):
+            arguments[name] = question
+        else:
+            left, right = slot.get("left", ""), slot.get("right", "")
+            start = question.find(left) + len(left) if left else 0
+            if left and start < len(left):
+                return None
+            end = question.find(right, start + 1) if right else len(question)
+            value = question[start:end].strip() if end > start else ""
+            if not value or len(value) > TEMPLATE_MAX_SPAN or "\n" in value:
+                return None
+            arguments[name] = value
+    return arguments
+
+
+def template_is_portable(template: Dict[str, Dict[str, Any]]) -> bool:
+    """模板中的文字参数都来自问题本身时，才能套用到相似(而非完全相同)的问题上"""
+    return all(not isinstance(slot.get("const"), str) for slot in template.values())
+
+
+class ToolCache:
+    """
+    工具命中缓存：
+    - cache: 归一化问题的哈希 -> 工具名，完全相同的问题直接命中；
+    - questions + lsh: 保存问题原文和 MinHash LSH 分桶，问题不完全相同时，
+      在同桶的候选中按字符 n-gram 的 Jaccard 相似度选出最相近的历史问题，超过阈值即命中。
+      每个 band 一次索引查询，每个桶只取最新的 MAX_BUCKET_CANDIDATES 个候选；
+      约 90 万条问题时命中查询 15~30ms，未命中约 1ms。
+      相似的问题归为同一个问题簇(cluster，取簇中第一个问题的 id)；
+    - tool_stats: 按 (域名, 问题簇, 工具) 记录成功/失败次数和累计耗时，rank_tools 据此排序；
+    - negative_tools: 在某个域名上连续失败的工具，有效期内不再作为该域名问题的候选。
+    缓存条目的生命周期：
+    - 记录写入/更新时间、命中次数和最近命中时间，超过 CACHE_TTL 未再成功的条目过期；
+    - 条目数超过 CACHE_MAX_ENTRIES 时按最近使用时间淘汰；
+    - 命中的工具连续失败 CACHE_MAX_FAILURES 次后删除条目，下次重新选工具；
+    - 没有缓存条目的问题(连同 LSH 分桶)最多保留 QUESTIONS_MAX_UNSOLVED 条，
+      工具统计超过 TOOL_STATS_TTL 没更新或行数超过 TOOL_STATS_MAX_ROWS 时删除，数据库大小有上限。
+    条目保存成功调用的参数模板(args_template)，replay_arguments 据此为新问题生成参数。
+    并发与性能：
+    - WAL 模式，每个线程一个连接，读不阻塞写；
+    - put / record_outcome 只把写操作放进队列，由后台写入线程批量执行、一次提交，不在事件循环里等 fsync；
+    - lookup 的结果放在进程内 LRU 中，写入新的问题->工具映射后清空并递增代数，
+      查库前后代数不同的结果不再放进 LRU，避免写入线程清空之后又缓存回旧结果；
+    - 负缓存在进程内保留一份 {域名: {工具: 到期时间}}，启动时从库中加载、由写入线程更新，
+      blocked_tools 不查库。
+    """
+    def __init__(self, db_path: str = CACHE_DB_PATH, threshold: float = SIMILARITY_THRESHOLD):
+        self.db_path = db_path
+        self.threshold = threshold
+        self._local = threading.local()
+        self._lru: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._lru_generation = 0
+        self._negative: Dict[str, Dict[str, float]] = {}
+        self._negative_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache(
+                key TEXT PRIMARY KEY,
+                tool_name TEXT NOT NULL,
+                created_at REAL,
+                updated_at REAL,
+                last_hit_at REAL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                args_template TEXT
+            );
+            CREATE TABLE IF NOT EXISTS questions(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT UNIQUE NOT NULL,
+                question TEXT NOT NULL,
+                tool_name TEXT NOT NULL DEFAULT '',
+                cluster INTEGER,
+                last_seen_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS lsh(
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                qid INTEGER NOT NULL,
+                PRIMARY KEY(band, bucket, qid)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS tool_stats(
+                domain TEXT NOT NULL,
+                cluster INTEGER NOT NULL,
+                tool_name TEXT NOT NULL,
+                successes INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                total_latency REAL NOT NULL DEFAULT 0,
+                updated_at REAL,
+                PRIMARY KEY(domain, cluster, tool_name)
+            );
+            CREATE TABLE IF NOT EXISTS negative_tools(
+                domain TEXT NOT NULL,
+                tool_name TEXT NOT NULL,
+                failures INTEGER NOT NULL DEFAULT 0,
+                last_failure_at REAL,
+                expires_at REAL,
+                PRIMARY KEY(domain, tool_name)
+            );
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(questions)")}
+        if "cluster" not in columns:
+            self.conn.execute("ALTER TABLE questions ADD COLUMN cluster INTEGER")
+        if "last_seen_at" not in columns:
+            self.conn.execute("ALTER TABLE questions ADD COLUMN last_seen_at REAL")
+        self._migrate_question_ids()
+        self.conn.executescript("""
+            CREATE INDEX IF NOT EXISTS lsh_qid ON lsh(qid);
+            CREATE INDEX IF NOT EXISTS questions_last_seen ON questions(last_seen_at);
+            CREATE INDEX IF NOT EXISTS tool_stats_updated ON tool_stats(updated_at);
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(cache)")}
+        for column, ddl in [("created_at", "REAL"), ("updated_at", "REAL"), ("last_hit_at", "REAL"),
+                            ("hits", "INTEGER NOT NULL DEFAULT 0"), ("failures", "INTEGER NOT NULL DEFAULT 0"),
+                            ("args_template", "TEXT")]:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE cache ADD COLUMN {column} {ddl}")
+        # 旧版本的条目没有时间，从现在开始计算有效期
+        now = time.time()
+        self.conn.execute("UPDATE cache SET created_at=?, updated_at=? WHERE updated_at IS NULL", (now, now))
+        self.conn.commit()
+        for domain, tool_name, expires_at in self.conn.execute(
+                "SELECT domain, tool_name, expires_at FROM negative_tools WHERE expires_at>?", (now,)):
+            self._negative.setdefault(domain, {})[tool_name] = expires_at
+        self._writes_since_evict = 0
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name="tool-cache-writer")
+        self._writer.start()
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != LSH_SCHEME_VERSION:
+            self._submit(self._rebuild_lsh_now, invalidate=True)
+        self._submit(self._evict_now, invalidate=True)
+
+    def _migrate_question_ids(self):
+        """
+        旧版本的 questions.id 没有 AUTOINCREMENT，问题被淘汰后 id 会被新问题复用；
+        id 同时是 tool_stats 的簇 id，复用会让新问题继承被淘汰问题的成败统计。
+        重建为 AUTOINCREMENT 表，序号从用过的最大 id(包括统计中出现过的簇)之后开始。
+        """
+        self.conn.commit()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            ddl = self.conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='questions'").fetchone()[0]
+            if "AUTOINCREMENT" in ddl.upper():
+                self.conn.rollback()
+                return
+            self.conn.execute("ALTER TABLE questions RENAME TO questions_legacy")
+            self.conn.execute("""
+                CREATE TABLE questions(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT UNIQUE NOT NULL,
+                    question TEXT NOT NULL,
+                    tool_name TEXT NOT NULL DEFAULT '',
+                    cluster INTEGER,
+                    last_seen_at REAL
+                )""")
+            self.conn.execute("INSERT INTO questions(id, key, question, tool_name, cluster, last_seen_at) "
+                              "SELECT id, key, question, tool_name, cluster, last_seen_at FROM questions_legacy")
+            self.conn.execute("DROP TABLE questions_legacy")
+            used = self.conn.execute("SELECT MAX(COALESCE((SELECT MAX(id) FROM questions), 0), "
+                                     "COALESCE((SELECT MAX(cluster) FROM tool_stats), 0))").fetchone()[0]
+            self.conn.execute("DELETE FROM sqlite_sequence WHERE name='questions'")
+            self.conn.execute("INSERT INTO sqlite_sequence(name, seq) VALUES('questions', ?)", (used,))
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """当前线程的连接，sqlite 连接不能跨线程使用"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- 后台批量写入 ----------
+
+    def _submit(self, func, *args, invalidate: bool = False):
+        self._queue.put((func, args, invalidate))
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            window_end = time.monotonic() + WRITE_BATCH_WINDOW
+            while len(batch) < WRITE_BATCH_SIZE and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, window_end - time.monotonic())))
+                except queue.Empty:
+                    break
+            invalidate = False
+            waiters = []
+            for item in batch:
+                if item is None:
+                    continue
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    continue
+                func, args, item_invalidate = item
+                try:
+                    func(*args)
+                    invalidate = invalidate or item_invalidate
+                except Exception as e:
+                    print(f"❌ ToolCache write failed: {e!r}")
+            try:
+                self.conn.commit()
+            except sqlite3.Error as e:
+                print(f"❌ ToolCache commit failed: {e!r}")
+            if invalidate:
+                with self._lru_lock:
+                    self._lru.clear()
+                    self._lru_generation += 1
+            for waiter in waiters:
+                waiter.set()
+            if batch[-1] is None:
+                self.conn.close()
+                return
+
+    def flush(self, timeout: Optional[float] = 10) -> bool:
+        """等待此前提交的写操作全部落库"""
+        if not self._writer.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(10)
+
+    @staticmethod
+    def _key_from_query(q: str) -> str:
+        norm = normalize_question(q)
+        return hashlib.sha256(norm.encode("utf-8")).hexdigest()
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        查找问题对应的工具：先精确匹配，再查相似问题。
+        返回 {"tool_name", "score", "question", "key", "args_template"}，score 为 1.0 表示完全相同的问题，
+        key 为命中的缓存条目，args_template 为成功调用的参数模板(没有记录参数时为 None)；
+        未命中、条目已过期或该工具在问题的域名上处于负缓存中时返回 None。
+        """
+        k = self._key_from_query(query)
+        with self._lru_lock:
+            cached = k in self._lru
+            if cached:
+                self._lru.move_to_end(k)
+                hit = self._lru[k]
+            generation = self._lru_generation
+        if not cached:
+            hit = self._lookup_db(k, query)
+            with self._lru_lock:
+                # 查库期间写入线程清空过 LRU 时，这次读到的可能是旧结果，不缓存
+                if self._lru_generation == generation:
+                    self._lru[k] = hit
+                    while len(self._lru) > LOOKUP_LRU_SIZE:
+                        self._lru.popitem(last=False)
+        if not hit or hit["tool_name"] in self.blocked_tools(query):
+            return None
+        self._submit(self._touch_now, hit["key"])
+        return dict(hit)
+
+    def _lookup_db(self, k: str, query: str) -> Optional[Dict[str, Any]]:
+        cutoff = time.time() - CACHE_TTL
+        row = self.conn.execute("SELECT tool_name, args_template FROM cache WHERE key=? AND updated_at>=?",
+                                (k, cutoff)).fetchone()
+        if row:
+            return {"tool_name": row[0], "score": 1.0, "question": query, "key": k,
+                    "args_template": json.loads(row[1]) if row[1] else None}
+        return self.lookup_similar(query)
+
+    def lookup_similar(self, query: str) -> Optional[Dict[str, Any]]:
+        best = self._nearest(question_shingles(query), solved_only=True)
+        if best is None:
+            return None
+        row = self.conn.execute("SELECT args_template FROM cache WHERE key=? AND updated_at>=?",
+                                (best["key"], time.time() - CACHE_TTL)).fetchone()
+        if not row:
+            return None
+        return {"tool_name": best["tool_name"], "score": best["score"], "question": best["question"],
+                "key": best["key"], "args_template": json.loads(row[0]) if row[0] else None}
+
+    @staticmethod
+    def replay_arguments(hit: Dict[str, Any], query: str) -> Optional[Dict[str, Any]]:
+        """
+        命中结果可以直接重放时，返回为 query 填好的参数，否则返回 None。
+        完全相同的问题直接套用模板；相似问题只有模板中的文字参数都来自问题本身时才重放，
+        避免把上一个问题的项目名等常量用到新问题上。
+        """
+        template = hit.get("args_template") if hit else None
+        if not template:
+            return None
+        # 相似度按占位后的文本计算，只换了 URL 的问题得分也是 1.0，是否同一问题要比较条目的 key
+        exact = hit.get("key") == ToolCache._key_from_query(query)
+        if not exact and not template_is_portable(template):
+            return None
+        return fill_args_template(template, query)
+
+    def _nearest(self, shingles: set, solved_only: bool = False) -> Optional[Dict[str, Any]]:
+        """相似度超过阈值的最相近历史问题 {id, key, question, tool_name, cluster, score}；solved_only 只看已解决的问题"""
+        if not shingles:
+            return None
+        # 同桶次数越多，估计的相似度越高；只对碰撞最多的少量候选计算精确的 Jaccard
+        # solved_only 时在取候选的查询里就过滤，避免每个 bucket 的名额被大量未解决的问题占满
+        # 按主键 (band, bucket, qid) 倒序扫描，取的是桶里最新的候选，不需要额外排序
+        if solved_only:
+            sql = ("SELECT lsh.qid FROM lsh JOIN questions ON questions.id=lsh.qid "
+                   "WHERE lsh.band=? AND lsh.bucket=? AND questions.tool_name != '' ORDER BY lsh.qid DESC LIMIT ?")
+        else:
+            sql = "SELECT qid FROM lsh WHERE band=? AND bucket=? ORDER BY qid DESC LIMIT ?"
+        collisions = Counter()
+        for band, bucket in enumerate(lsh_buckets(minhash_signature(shingles))):
+            collisions.update(r[0] for r in self.conn.execute(sql, (band, bucket, MAX_BUCKET_CANDIDATES)))
+        if not collisions:
+            return None
+        candidate_ids = [qid for qid, _ in collisions.most_common(MAX_RERANK_CANDIDATES)]
+        placeholders = ",".join("?" * len(candidate_ids))
+        best = None
+        for qid, key, question, tool_name, cluster in self.conn.execute(
+                f"SELECT id, key, question, tool_name, cluster FROM questions WHERE id IN ({placeholders})",
+                candidate_ids):
+            score = jaccard(shingles, question_shingles(question))
+            if score >= self.threshold and (best is None or score > best["score"]):
+                best = {"id": qid, "key": key, "question": question, "tool_name": tool_name,
+                        "cluster": cluster if cluster is not None else qid, "score": round(score, 4)}
+        return best
+
+    def cluster_of(self, query: str) -> Optional[int]:
+        """问题所属的问题簇：完全相同或足够相似的历史问题所在的簇，没有则为 None"""
+        row = self.conn.execute("SELECT id, cluster FROM questions WHERE key=?",
+                                (self._key_from_query(query),)).fetchone()
+        if row:
+            return row[1] if row[1] is not None else row[0]
+        best = self._nearest(question_shingles(query))
+        return best["cluster"] if best else None
+
+    def _ensure_question(self, query: str) -> Dict[str, Any]:
+        """保证问题已入库并分好簇，返回 {id, cluster}；新问题归入最相近问题的簇，没有则自成一簇"""
+        k = self._key_from_query(query)
+        now = time.time()
+        row = self.conn.execute("SELECT id, cluster FROM questions WHERE key=?", (k,)).fetchone()
+        if row:
+            self.conn.execute("UPDATE questions SET last_seen_at=? WHERE id=?", (now, row[0]))
+            return {"id": row[0], "cluster": row[1] if row[1] is not None else row[0]}
+        shingles = question_shingles(query)
+        nearest = self._nearest(shingles)
+        cur = self.conn.execute(
+            "INSERT INTO questions(key, question, tool_name, cluster, last_seen_at) VALUES(?,?,'',?,?)",
+            (k, normalize_question(query), nearest["cluster"] if nearest else None, now))
+        qid = cur.lastrowid
+        cluster = nearest["cluster"] if nearest else qid
+        if not nearest:
+            self.conn.execute("UPDATE questions SET cluster=? WHERE id=?", (qid, qid))
+        buckets = lsh_buckets(minhash_signature(shingles))
+        self.conn.executemany("INSERT OR IGNORE INTO lsh(band, bucket, qid) VALUES(?,?,?)",
+                              [(band, bucket, qid) for band, bucket in enumerate(buckets)])
+        return {"id": qid, "cluster": cluster}
+
+    def _rebuild_lsh_now(self):
+        """按当前的分词和 LSH 参数重建所有问题的分桶"""
+        self.conn.execute("DELETE FROM lsh")
+        rows = self.conn.execute("SELECT id, question FROM questions").fetchall()
+        for qid, question in rows:
+            buckets = lsh_buckets(minhash_signature(question_shingles(question)))
+            self.conn.executemany("INSERT OR IGNORE INTO lsh(band, bucket, qid) VALUES(?,?,?)",
+                                  [(band, bucket, qid) for band, bucket in enumerate(buckets)])
+        self.conn.execute(f"PRAGMA user_version={LSH_SCHEME_VERSION}")
+        if rows:
+            print(f"ToolCache rebuilt LSH index for {len(rows)} questions")
+
+    def get(self, query: str) -> Optional[str]:
+        hit = self.lookup(query)
+        return hit["tool_name"] if hit else None
+
+    def put(self, query: str, tool_name: str, arguments: Optional[Dict[str, Any]] = None):
+        """记录问题 -> 成功的工具（异步写入）；给出成功调用的参数时同时保存参数模板"""
+        self._submit(self._put_now, query, tool_name, arguments, invalidate=True)
+
+    def _put_now(self, query: str, tool_name: str, arguments: Optional[Dict[str, Any]] = None):
+        k = self._key_from_query(query)
+        now = time.time()
+        template = json.dumps(build_args_template(query, arguments), ensure_ascii=False) if arguments else None
+        self.conn.execute(
+            "INSERT INTO cache(key, tool_name, created_at, updated_at, args_template) VALUES(?,?,?,?,?) "
+            "ON CONFLICT(key) DO UPDATE SET tool_name=excluded.tool_name, updated_at=excluded.updated_at, "
+            "failures=0, args_template=excluded.args_template",
+            (k, tool_name, now, now, template),
+        )
+        question = self._ensure_question(query)
+        self.conn.execute("UPDATE questions SET tool_name=? WHERE id=?", (tool_name, question["id"]))
+        self._count_write()
+
+    def _count_write(self):
+        self._writes_since_evict += 1
+        if self._writes_since_evict >= EVICT_EVERY_WRITES:
+            self._evict_now()
+
+    def _touch_now(self, key: str):
+        self.conn.execute("UPDATE cache SET hits=hits+1, last_hit_at=? WHERE key=?", (time.time(), key))
+
+    def _delete_entries(self, keys: List[str]):
+        """删除缓存条目；问题本身保留(用于分簇和统计)，只是不再指向工具"""
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            self.conn.execute(f"DELETE FROM cache WHERE key IN ({placeholders})", chunk)
+            self.conn.execute(f"UPDATE questions SET tool_name='' WHERE key IN ({placeholders})", chunk)
+
+    def _delete_questions(self, ids: List[int]):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            self.conn.execute(f"DELETE FROM lsh WHERE qid IN ({placeholders})", chunk)
+            self.conn.execute(f"DELETE FROM questions WHERE id IN ({placeholders})", chunk)
+
+    def _evict_now(self):
+        """
+        删除过期条目，条目数超过上限时按最近使用时间淘汰最旧的；
+        再清理没有缓存条目的旧问题、过期或超量的工具统计，以及过期的负缓存
+        """
+        self._writes_since_evict = 0
+        now = time.time()
+        keys = [r[0] for r in self.conn.execute("SELECT key FROM cache WHERE updated_at<?", (now - CACHE_TTL,))]
+        self._delete_entries(keys)
+        over = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - CACHE_MAX_ENTRIES
+        if over > 0:
+            oldest = [r[0] for r in self.conn.execute(
+                "SELECT key FROM cache ORDER BY COALESCE(last_hit_at, updated_at) LIMIT ?", (over,))]
+            self._delete_entries(oldest)
+            keys += oldest
+        unsolved = "NOT EXISTS (SELECT 1 FROM cache WHERE cache.key=questions.key)"
+        stale = [r[0] for r in self.conn.execute(
+            f"SELECT id FROM questions WHERE {unsolved} AND COALESCE(last_seen_at, 0)<?", (now - CACHE_TTL,))]
+        over = self.conn.execute(f"SELECT COUNT(*) FROM questions WHERE {unsolved}").fetchone()[0] \
+            - len(stale) - QUESTIONS_MAX_UNSOLVED
+        if over > 0:
+            stale += [r[0] for r in self.conn.execute(
+                f"SELECT id FROM questions WHERE {unsolved} AND COALESCE(last_seen_at, 0)>=? "
+                f"ORDER BY last_seen_at LIMIT ?", (now - CACHE_TTL, over))]
+        self._delete_questions(stale)
+        self.conn.execute("DELETE FROM tool_stats WHERE updated_at<?", (now - TOOL_STATS_TTL,))
+        over = self.conn.execute("SELECT COUNT(*) FROM tool_stats").fetchone()[0] - TOOL_STATS_MAX_ROWS
+        if over > 0:
+            self.conn.execute("DELETE FROM tool_stats WHERE rowid IN "
+                              "(SELECT rowid FROM tool_stats ORDER BY updated_at LIMIT ?)", (over,))
+        self.conn.execute("DELETE FROM negative_tools WHERE expires_at<? OR (expires_at IS NULL AND last_failure_at<?)",
+                          (now, now - NEGATIVE_TTL))
+        with self._negative_lock:
+            self._negative = {domain: live for domain, tools in self._negative.items()
+                              if (live := {t: exp for t, exp in tools.items() if exp >= now})}
+        if keys or stale:
+            print(f"ToolCache evicted {len(keys)} entries, {len(stale)} questions")
+
+    # ---------- 工具成败统计与排序 ----------
+
+    def record_outcome(self, query: str, tool_name: str, success: bool, latency: float):
+        """
+        记录一次工具调用的结果（异步写入），同时累加到 (域名, 簇)、(域名)、(簇)、全局 四个层级；
+        并更新命中条目的连续失败次数和该域名上的负缓存。
+        """
+        self._submit(self._record_outcome_now, query, tool_name, success, latency, invalidate=not success)
+
+    def _record_outcome_now(self, query: str, tool_name: str, success: bool, latency: float):
+        domain = question_domain(query)
+        cluster = self._ensure_question(query)["cluster"]
+        now = time.time()
+        for level_domain, level_cluster in {(domain, cluster), (domain, 0), ("", cluster), ("", 0)}:
+            self.conn.execute(
+                "INSERT INTO tool_stats(domain, cluster, tool_name, successes, failures, total_latency, updated_at) "
+                "VALUES(?,?,?,?,?,?,?) ON CONFLICT(domain, cluster, tool_name) DO UPDATE SET "
+                "successes=successes+excluded.successes, failures=failures+excluded.failures, "
+                "total_latency=total_latency+excluded.total_latency, updated_at=excluded.updated_at",
+                (level_domain, level_cluster, tool_name, int(success), int(not success), max(0.0, latency), now),
+            )
+        self._update_entry_health(query, tool_name, success)
+        if domain:
+            self._update_negative(domain, tool_name, success, now)
+        self._count_write()
+
+    def _update_entry_health(self, query: str, tool_name: str, success: bool):
+        """问题命中的缓存条目指向的正是这个工具时，累计或清零连续失败次数，达到上限删除条目"""
+        hit = self._lookup_db(self._key_from_query(query), query)
+        if not hit or hit["tool_name"] != tool_name:
+            return
+        if success:
+            self.conn.execute("UPDATE cache SET failures=0 WHERE key=?", (hit["key"],))
+            return
+        self.conn.execute("UPDATE cache SET failures=failures+1 WHERE key=?", (hit["key"],))
+        failures = self.conn.execute("SELECT failures FROM cache WHERE key=?", (hit["key"],)).fetchone()[0]
+        if failures >= CACHE_MAX_FAILURES:
+            print(f"ToolCache invalidated {tool_name} for '{hit['question']}' after {failures} consecutive failures")
+            self._delete_entries([hit["key"]])
+
+    def _update_negative(self, domain: str, tool_name: str, success: bool, now: float):
+        if success:
+            self.conn.execute("DELETE FROM negative_tools WHERE domain=? AND tool_name=?", (domain, tool_name))
+            with self._negative_lock:
+                self._negative.get(domain, {}).pop(tool_name, None)
+            return
+        self.conn.execute(
+            "INSERT INTO negative_tools(domain, tool_name, failures, last_failure_at) VALUES(?,?,1,?) "
+            "ON CONFLICT(domain, tool_name) DO UPDATE SET failures=failures+1, last_failure_at=excluded.last_failure_at",
+            (domain, tool_name, now),
+        )
+        self.conn.execute("UPDATE negative_tools SET expires_at=? WHERE domain=? AND tool_name=? AND failures>=?",
+                          (now + NEGATIVE_TTL, domain, tool_name, NEGATIVE_AFTER_FAILURES))
+        expires_at = self.conn.execute("SELECT expires_at FROM negative_tools WHERE domain=? AND tool_name=?",
+                                       (domain, tool_name)).fetchone()[0]
+        if expires_at is not None:
+            with self._negative_lock:
+                self._negative.setdefault(domain, {})[tool_name] = expires_at
+
+    def blocked_tools(self, query: str) -> set:
+        """问题域名上处于负缓存中的工具(读进程内的副本，不查库)"""
+        domain = question_domain(query)
+        if not domain:
+            return set()
+        now = time.time()
+        with self._negative_lock:
+            tools = self._negative.get(domain, {})
+            return {t for t, expires_at in tools.items() if expires_at > now}
+
+    def tool_stats(self, query: str, tool_names: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        """
+        按层级权重合并的统计：{tool: {"successes", "failures", "calls", "latency_sum"}}
+        (域名, 簇) 的数据最可信，同域名或同簇的数据次之，全局数据只作为弱先验。
+        """
+        domain = question_domain(query)
+        cluster = self.cluster_of(query)
+        levels = {"global": ("", 0)}
+        if domain:
+            levels["domain"] = (domain, 0)
+        if cluster is not None:
+            levels["cluster"] = ("", cluster)
+            if domain:
+                levels["domain_cluster"] = (domain, cluster)
+        names = list(tool_names)
+        merged = {name: {"successes": 0.0, "failures": 0.0, "calls": 0.0, "latency_sum": 0.0} for name in names}
+        if not names:
+            return merged
+        placeholders = ",".join("?" * len(names))
+        for level, (level_domain, level_cluster) in levels.items():
+            weight = STATS_LEVEL_WEIGHTS[level]
+            for tool_name, successes, failures, total_latency in self.conn.execute(
+                    f"SELECT tool_name, successes, failures, total_latency FROM tool_stats "
+                    f"WHERE domain=? AND cluster=? AND tool_name IN ({placeholders})",
+                    [level_domain, level_cluster] + names):
+                item = merged[tool_name]
+                item["successes"] += weight * successes
+                item["failures"] += weight * failures
+                item["calls"] += weight * (successes + failures)
+                item["latency_sum"] += weight * total_latency
+        return merged
+
+    def rank_tools(self, query: str, tool_names: Iterable[str], exclude: Optional[Iterable[str]] = None,
+                   sample: bool = True) -> List[str]:
+        """
+        Thompson 采样排序：每个工具的成功率从 Beta(1+成功, 1+失败) 中采样，
+        按 采样成功率 / 期望耗时(即单位时间的成功期望) 从高到低排列。
+        没有历史数据的工具成功率先验为 Beta(1, 1)、耗时先验为 DEFAULT_TOOL_LATENCY，会被适度探索；
+        sample=False 时用后验均值，结果确定。
+        问题域名上处于负缓存中的工具不参与排序；除非其余工具都已排除，这时仍按排序返回它们。
+        """
+        exclude = set(exclude or [])
+        names = [n for n in tool_names if n not in exclude]
+        blocked = self.blocked_tools(query)
+        if any(n not in blocked for n in names):
+            names = [n for n in names if n not in blocked]
+        stats = self.tool_stats(query, names)
+        scored = []
+        for name in names:
+            item = stats[name]
+            alpha, beta = 1 + item["successes"], 1 + item["failures"]
+            p = random.betavariate(alpha, beta) if sample else alpha / (alpha + beta)
+            latency = ((item["latency_sum"] + DEFAULT_TOOL_LATENCY * LATENCY_PRIOR_WEIGHT)
+                       / (item["calls"] + LATENCY_PRIOR_WEIGHT))
+            scored.append((p / max(latency, 1e-3), name))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [name for _, name in scored]
+
+    def confident_tools(self, query: str, tool_names: Iterable[str], exclude: Optional[Iterable[str]] = None,
+                        min_calls: float = 3, min_rate: float = 0.8) -> List[str]:
+        """
+        历史数据足够(加权调用次数 >= min_calls)且后验成功率 >= min_rate 的工具，
+        按后验成功率 / 期望耗时排序；负缓存中的工具不算在内。
+        """
+        exclude = set(exclude or []) | self.blocked_tools(query)
+        names = [n for n in tool_names if n not in exclude]
+        scored = []
+        for name, item in self.tool_stats(query, names).items():
+            rate = (1 + item["successes"]) / (2 + item["calls"])
+            if item["calls"] >= min_calls and rate >= min_rate:
+                latency = ((item["latency_sum"] + DEFAULT_TOOL_LATENCY * LATENCY_PRIOR_WEIGHT)
+                           / (item["calls"] + LATENCY_PRIOR_WEIGHT))
+                scored.append((rate / max(latency, 1e-3), name))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [name for _, name in scored]
+
+
+# 单例获取
+_CACHE_SINGLETON: Optional[ToolCache] = None
+_CACHE_LOCK = threading.Lock()
+def get_cache() -> ToolCache:
+    global _CACHE_SINGLETON
+    if _CACHE_SINGLETON is None:
+        with _CACHE_LOCK:
+            if _CACHE_SINGLETON is None:
+                _CACHE_SINGLETON = ToolCache(CACHE_DB_PATH)
+                # 退出前把队列中的写操作落库
+                atexit.register(_CACHE_SINGLETON.close)
+    return _CACHE_SINGLETON
+
+def get_cache_key(query: str) -> str:
+    return ToolCache._key_from_query(query)
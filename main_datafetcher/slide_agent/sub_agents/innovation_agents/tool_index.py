@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/10/24 15:10
+# @File  : tool_index.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 工具检索：对工具名、描述、参数建 BM25 倒排索引，只把和问题相关的前 N 个工具放进分析Agent的提示词
+
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# 工具名比描述更能说明工具的用途，建索引时重复几次以提高权重
+NAME_WEIGHT = 3
+
+_WORD_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中英文混合分词：英文/数字按单词切分(下划线、驼峰命名都会拆开)，中文按字的二元组切分，单个汉字保留原字。
+    """
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text or "").lower()
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        if "\u4e00" <= word[0] <= "\u9fff":
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def tool_document(name: str, description: str, parameters: Optional[Dict[str, Any]]) -> List[str]:
+    """一个工具的检索文本：工具名、描述、参数名和参数描述"""
+    parts = [name] * NAME_WEIGHT + [description or ""]
+    for param, schema in ((parameters or {}).get("properties") or {}).items():
+        parts.append(param)
+        if isinstance(schema, dict):
+            parts.append(schema.get("description") or "")
+    return tokenize(" ".join(parts))
+
+
+class ToolIndex:
+    """
+    BM25 倒排索引：term -> [(工具序号, 词频)]。
+    查询只遍历问题中出现的词的倒排表，耗时与工具总数基本无关。
+    """
+    def __init__(self, documents: Dict[str, List[str]]):
+        self.names = list(documents)
+        self.lengths = [len(documents[name]) for name in self.names]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.postings: Dict[str, List[tuple]] = defaultdict(list)
+        for doc_id, name in enumerate(self.names):
+            for term, tf in Counter(documents[name]).items():
+                self.postings[term].append((doc_id, tf))
+        n = len(self.names)
+        self.idf = {term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in self.postings.items()}
+
+    @classmethod
+    def from_tools(cls, tools: Dict[str, Any]) -> "ToolIndex":
+        return cls({name: tool_document(name, getattr(tool, "description", "") or "",
+                                        getattr(tool, "parameters", None))
+                    for name, tool in tools.items()})
+
+    def search(self, query: str, top_n: int, exclude: Optional[Iterable[str]] = None) -> List[str]:
+        """按 BM25 得分返回最相关的至多 top_n 个工具名，只包含得分大于 0 的工具"""
+        exclude = set(exclude or [])
+        scores = defaultdict(float)
+        for term, qtf in Counter(tokenize(query)).items():
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return [self.names[doc_id] for doc_id, _ in ranked if self.names[doc_id] not in exclude][:top_n]
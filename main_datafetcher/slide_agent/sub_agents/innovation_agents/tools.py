@@ -6,26 +6,65 @@
 # @Contact : github: johnson7788
 # @Desc  : 动态加载 MCP Server 工具（取代写死定义）
 
+import os
+import time
 import asyncio
 import json
+import hashlib
+import threading
 import dotenv
-from typing import Dict, Any
-from google.adk.tools import FunctionTool
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Union
+from google.adk.tools import FunctionTool, ToolContext
 from google.genai import types
-from .mcp_client import get_mcp_tools, call_mcp_tool_sync, call_mcp_tool_async
+from .mcp_client import get_mcp_tools, get_mcp_server_tools, call_mcp_tool_async, is_idempotent_tool, run_sync
+from .tool_index import ToolIndex
 
 dotenv.load_dotenv()
 
+MCP_CONFIG_PATH = "./mcp_config.json"
+# 工具定义的磁盘缓存（按 server 名称保存 url/版本/工具定义），以及启动时每个 server 的拉取超时（秒）
+TOOLS_CACHE_PATH = os.getenv("MCP_TOOLS_CACHE", "./mcp_tools_cache.json")
+MCP_DISCOVERY_TIMEOUT = float(os.getenv("MCP_DISCOVERY_TIMEOUT", "10"))
+# 配置文件检查间隔、工具列表定期刷新间隔（秒）
+MCP_CONFIG_POLL_INTERVAL = float(os.getenv("MCP_CONFIG_POLL_INTERVAL", "2"))
+MCP_TOOLS_REFRESH_INTERVAL = float(os.getenv("MCP_TOOLS_REFRESH_INTERVAL", "60"))
+# 工具结果缓存的最大条目数；设为 0 关闭缓存
+MCP_RESULT_CACHE_SIZE = int(os.getenv("MCP_RESULT_CACHE_SIZE", "512"))
+# 工具返回 status=success 后不再让模型总结，直接结束本轮（由控制Agent按结构化结果判定）
+MCP_STOP_ON_SUCCESS = os.getenv("MCP_STOP_ON_SUCCESS", "1") != "0"
+# 同一轮模型回复中多个工具调用并发执行时，整轮的超时（秒）
+MCP_TURN_TIMEOUT = float(os.getenv("MCP_TURN_TIMEOUT", "600"))
+# 从缓存启动后等待后台刷新的 server 配置
+_PENDING_REFRESH: List[Dict[str, Dict[str, Any]]] = []
+
 class MYFunctionTool(FunctionTool):
     """
     继承 FunctionTool，添加自定义功能。
     """
-    def __init__(self, func, name, description, parameters):
+    def __init__(self, func, name, description, parameters, invoke=None):
         super().__init__(func)
         self.name = name
         self.description = description
         self.parameters = parameters
         self.func = func
+        # invoke(arguments, deadline): 不经过 ADK 直接调用 MCP 工具，供并发预取使用
+        self.invoke = invoke
+
+    def signature(self) -> str:
+        """简短的调用签名，例如 download_pdf(url, project_name, limit?)，可选参数带 ?"""
+        properties = (self.parameters or {}).get("properties") or {}
+        required = set((self.parameters or {}).get("required") or [])
+        args = [name if name in required else f"{name}?" for name in properties]
+        return f"{self.name}({', '.join(args)})"
+
+    def bind_arguments(self, arguments: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """从一组共享参数中取出本工具声明的参数，缺少必填参数时返回 None"""
+        properties = (self.parameters or {}).get("properties") or {}
+        required = (self.parameters or {}).get("required") or []
+        if any(arguments.get(name) in (None, "") for name in required):
+            return None
+        return {name: arguments[name] for name in properties if arguments.get(name) not in (None, "")}
 
     def _get_declaration(self):
         """基于自定义参数生成 FunctionDeclaration"""
@@ -35,22 +74,205 @@ class MYFunctionTool(FunctionTool):
             parameters=self.parameters
         )
 
-# ========== 动态加载 MCP 工具 ==========
+# ========== 工具结果缓存 ==========
+
+def cache_ttl_for(tool: Dict[str, Any]) -> Optional[float]:
+    """工具通过标签 cache_ttl:<秒> 声明结果可以缓存多久，没有声明的工具不缓存"""
+    for tag in tool.get("tags") or []:
+        if tag.startswith("cache_ttl:"):
+            try:
+                return float(tag.split(":", 1)[1]) or None
+            except ValueError:
+                return None
+    return None
+
+
+def _normalize_arguments(value: Any) -> Any:
+    """参数归一化：去掉 None、字符串首尾空白，dict 按 key 排序，保证等价的参数得到相同的 key"""
+    if isinstance(value, dict):
+        return {k: _normalize_arguments(v) for k, v in sorted(value.items()) if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_arguments(v) for v in value]
+    if isinstance(value, str):
+        return value.strip()
+    return value
 
-def load_mcp_tools(server_url: str) -> Dict[str, FunctionTool]:
+
+class ToolResultCache:
     """
-    动态从 MCP server 拉取所有工具，并包装为 FunctionTool。
+    MCP 工具结果缓存（进程内，跨会话共享）：
+    - key 为 (工具名, 归一化后的参数, server 版本)，server 升级后旧结果自然失效；
+    - 每条结果按工具声明的 TTL 过期，总条目数超过 max_entries 时淘汰最久未使用的；
+    - single-flight：同一个 key 正在调用时，后来的调用等待同一个结果，不会重复打到 server；
+    - 只缓存 status 为 success 的结果，失败的调用下次仍会真正执行。
     """
-    async def _load():
-        tools = await get_mcp_tools(server_url)
-        return tools
+    def __init__(self, max_entries: int = MCP_RESULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
 
-    try:
-        tools_meta = asyncio.run(_load())
-    except Exception as e:
-        print(f"❌ Failed to load tools from MCP server {server_url}: {e}")
-        return {}
+    @staticmethod
+    def make_key(tool_name: str, arguments: Dict[str, Any], version: str = "") -> str:
+        payload = json.dumps([tool_name, _normalize_arguments(arguments or {}), version],
+                             ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, result = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key: str, result: Any, ttl: float):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _cached_copy(result: Any, started: float) -> Any:
+        """命中的结果带 cached=True，client_elapsed_sec 换成本次实际等待的时间，不沿用第一次调用的耗时"""
+        if not isinstance(result, dict):
+            return result
+        return {**result, "cached": True, "client_elapsed_sec": round(time.monotonic() - started, 3)}
+
+    async def get_or_call(self, key: str, ttl: float, call):
+        """命中直接返回(带 cached=True)；否则执行 call()，同一事件循环内的相同请求共享一次调用"""
+        started = time.monotonic()
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return self._cached_copy(result, started)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            inflight = self._inflight.get(key)
+            owner = inflight is None or inflight[0] is not loop
+            if owner:
+                future = loop.create_future()
+                self._inflight[key] = (loop, future)
+            else:
+                future = inflight[1]
+        if not owner:
+            self.hits += 1
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # 发起方被取消或出错，自己重新调用一次
+                return await call()
+            return self._cached_copy(result, started)
+        self.misses += 1
+        try:
+            result = await call()
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            if not isinstance(result, dict) or result.get("status") == "success":
+                self.put(key, result, ttl)
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                if self._inflight.get(key, (None, None))[1] is future:
+                    del self._inflight[key]
+
+
+RESULT_CACHE = ToolResultCache()
+
+# ========== 同一轮多个工具调用并发执行 ==========
+
+class TurnPrefetcher:
+    """
+    ADK 逐个顺序执行一轮模型回复中的函数调用。模型一次给出多个调用时，
+    在 after_model_callback 中把这些 MCP 调用同时发出(共用连接池里的长连接)，
+    之后 ADK 逐个执行工具时直接等待对应的任务，一轮的耗时约等于最慢的那个调用。
+    此时函数调用还没有 id，所以按 (invocation_id, 工具名, 归一化参数) 对应，相同调用出现多次时按顺序各取一个。
+    只预取本轮暴露给模型的工具(expose 记录)：模型编造的其他工具调用会被 ADK 拒绝，不能提前执行产生副作用。
+    """
+    # 最多记录多少次运行的暴露工具，discard 没有被调用(运行异常结束)时也不会无限增长
+    MAX_EXPOSED = 1024
 
+    def __init__(self, turn_timeout: float = MCP_TURN_TIMEOUT):
+        self.turn_timeout = turn_timeout
+        self._tasks: Dict[str, List[asyncio.Task]] = {}
+        self._exposed: "OrderedDict[str, set]" = OrderedDict()
+
+    @staticmethod
+    def _key(invocation_id: str, tool_name: str, arguments: Dict[str, Any]) -> str:
+        return f"{invocation_id}:{ToolResultCache.make_key(tool_name, arguments)}"
+
+    def expose(self, invocation_id: str, tool_names: List[str]):
+        """记录本次运行当前暴露给模型的工具(CandidateToolset 每次给出工具时调用)"""
+        self._exposed[invocation_id] = set(tool_names)
+        self._exposed.move_to_end(invocation_id)
+        while len(self._exposed) > self.MAX_EXPOSED:
+            self._exposed.popitem(last=False)
+
+    def prefetch(self, invocation_id: str, function_calls: List[Any], state: Dict[str, Any]) -> int:
+        """并发发出本轮的全部 MCP 调用，整轮共用一个截止时间；返回发出的调用数"""
+        turn_deadline = time.time() + self.turn_timeout
+        deadline = min(state.get("deadline") or turn_deadline, turn_deadline)
+        tools = REGISTRY.tools
+        exposed = self._exposed.get(invocation_id) or set()
+        count = 0
+        for call in function_calls:
+            if call.name not in exposed:
+                continue
+            tool = tools.get(call.name)
+            if not isinstance(tool, MYFunctionTool) or tool.invoke is None:
+                continue
+            arguments = dict(call.args or {})
+            task = asyncio.ensure_future(tool.invoke(arguments, deadline))
+            self._tasks.setdefault(self._key(invocation_id, call.name, arguments), []).append(task)
+            count += 1
+        return count
+
+    def take(self, invocation_id: str, tool_name: str, arguments: Dict[str, Any]) -> Optional[asyncio.Task]:
+        key = self._key(invocation_id, tool_name, arguments)
+        tasks = self._tasks.get(key)
+        if not tasks:
+            return None
+        task = tasks.pop(0)
+        if not tasks:
+            del self._tasks[key]
+        return task
+
+    def discard(self, invocation_id: str):
+        """取消本次运行中没有被 ADK 取走的预取任务(例如工具被回调拦截)，并清除本轮暴露的工具"""
+        self._exposed.pop(invocation_id, None)
+        for key in [k for k in self._tasks if k.startswith(f"{invocation_id}:")]:
+            for task in self._tasks.pop(key):
+                task.cancel()
+
+
+TURN_PREFETCHER = TurnPrefetcher()
+
+# ========== 动态加载 MCP 工具 ==========
+
+def build_mcp_tools(server_url: Union[str, List[str]], tools_meta: List[Dict[str, Any]],
+                    version: str = "") -> Tuple[Dict[str, FunctionTool], str]:
+    """
+    把 MCP server 返回的工具定义包装为 FunctionTool。
+    声明了 cache_ttl 标签的工具经过 RESULT_CACHE，version 为 server 版本，参与缓存 key。
+    """
     tool_dict = {}
     tool_infos = ""
 
@@ -60,61 +282,322 @@ def load_mcp_tools(server_url: str) -> Dict[str, FunctionTool]:
         params = tool.get("parameters", {})
         tool_infos += f"{name}: {desc}\n"
 
-        def make_tool_func(tool_name):
-            async def _func(**kwargs):
-                result = await call_mcp_tool_async(server_url, tool_name, kwargs)
+        def make_tool_func(tool_name, idempotent, ttl):
+            async def _invoke(arguments: Dict[str, Any], deadline: Optional[float] = None):
+                async def _call():
+                    return await call_mcp_tool_async(server_url, tool_name, arguments,
+                                                     deadline=deadline, idempotent=idempotent)
+
+                if ttl:
+                    key = RESULT_CACHE.make_key(tool_name, arguments, version)
+                    result = await RESULT_CACHE.get_or_call(key, ttl, _call)
+                else:
+                    result = await _call()
                 print(f"调用 MCP 工具 {tool_name} 的结果是: {result}")
                 return result
-            return _func
 
-        func = make_tool_func(name)
+            async def _func(tool_context: ToolContext = None, **kwargs):
+                start = time.monotonic()
+                task = None
+                if tool_context:
+                    # 本轮已经并发发出的调用，直接等待它的结果
+                    task = TURN_PREFETCHER.take(tool_context.invocation_id, tool_name, kwargs)
+                if task is not None:
+                    result = await task
+                else:
+                    # Agent 运行的截止时间由 before_agent_callback 写入 state，逐级传给每次工具调用
+                    deadline = tool_context.state.get("deadline") if tool_context else None
+                    result = await _invoke(kwargs, deadline)
+                if tool_context:
+                    # 记录本轮的调用结果和耗时，ControllerAgent 用来更新工具统计
+                    status = result.get("status") if isinstance(result, dict) else None
+                    elapsed = result.get("client_elapsed_sec") if isinstance(result, dict) else None
+                    tool_context.state["tool_calls"] = (tool_context.state.get("tool_calls") or []) + [{
+                        "tool": tool_name, "args": kwargs, "status": status,
+                        "elapsed": elapsed if elapsed is not None else round(time.monotonic() - start, 3),
+                    }]
+                    if status == "success" and MCP_STOP_ON_SUCCESS:
+                        tool_context.actions.skip_summarization = True
+                return result
+            return _func, _invoke
+
+        func, invoke = make_tool_func(name, is_idempotent_tool(tool), cache_ttl_for(tool))
         wrapped = MYFunctionTool(
             func=func,
             name=name,
             description=desc,
-            parameters=params
+            parameters=params,
+            invoke=invoke
         )
         tool_dict[name] = wrapped
 
+    return tool_dict, tool_infos
+
+
+def load_mcp_tools(server_url: str) -> Tuple[Dict[str, FunctionTool], str]:
+    """
+    动态从 MCP server 拉取所有工具，并包装为 FunctionTool。
+    """
+    async def _load():
+        tools = await get_mcp_tools(server_url)
+        return tools
+
+    try:
+        tools_meta = run_sync(_load())
+    except Exception as e:
+        print(f"❌ Failed to load tools from MCP server {server_url}: {e}")
+        return {}, ""
+
+    tool_dict, tool_infos = build_mcp_tools(server_url, tools_meta)
     print(f"✅ Loaded {len(tool_dict)} tools dynamically from {server_url}")
     return tool_dict, tool_infos
 
 
 # ========== 入口配置 ==========
 
-def get_all_tools() -> Dict[str, FunctionTool]:
+def load_mcp_config(config_path: str = MCP_CONFIG_PATH) -> Dict[str, Dict[str, Any]]:
     """
-    从 ./mcp_config.json 中加载配置，然后动态拉取工具。
+    读取 mcp_config.json，返回启用且配置了 url 的 server: {name: info}。
+    server 可以用 "urls": [...] 配置多个副本，此时 info["url"] 为副本列表，调用时在副本间负载均衡。
     """
     try:
-        with open("./mcp_config.json", "r", encoding="utf-8") as f:
+        with open(config_path, "r", encoding="utf-8") as f:
             config = json.load(f)
     except FileNotFoundError:
         print("❌ Cannot find mcp_config.json. Please make sure it exists.")
         return {}
+    servers = {}
+    for name, info in config.get("mcpServers", {}).items():
+        urls = info.get("urls") or ([info["url"]] if info.get("url") else [])
+        if info.get("disabled") or not urls:
+            continue
+        servers[name] = {**info, "url": urls if len(urls) > 1 else urls[0]}
+    return servers
+
+
+async def discover_servers(servers: Dict[str, Dict[str, Any]],
+                           timeout: float = MCP_DISCOVERY_TIMEOUT) -> Dict[str, Dict[str, Any]]:
+    """
+    并发拉取所有 server 的工具列表，每个 server 单独超时，不可达的 server 不会拖慢其它 server。
+    返回成功的 server: {name: {"url", "version", "tools", "fetched_at"}}
+    """
+    async def _one(name, info):
+        url = info["url"]
+        try:
+            data = await asyncio.wait_for(get_mcp_server_tools(url), timeout)
+        except Exception as e:
+            print(f"❌ Failed to load tools from MCP server {name} ({url}): {e!r}")
+            return name, None
+        return name, {"url": url, "version": data["version"], "tools": data["tools"], "fetched_at": time.time()}
+
+    results = await asyncio.gather(*[_one(name, info) for name, info in servers.items()])
+    return {name: entry for name, entry in results if entry is not None}
+
+
+def read_tools_cache(cache_path: str = TOOLS_CACHE_PATH) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("servers", {})
+    except (FileNotFoundError, ValueError):
+        return {}
+
 
-    mcp_servers = config.get("mcpServers", {})
+def write_tools_cache(entries: Dict[str, Dict[str, Any]], cache_path: str = TOOLS_CACHE_PATH):
+    """先写临时文件再替换，避免并发读到写了一半的缓存"""
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"servers": entries}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, cache_path)
+
+
+def build_registry(entries: Dict[str, Dict[str, Any]]) -> Tuple[Dict[str, FunctionTool], str]:
     all_tools = {}
     tool_info_content = ""
-    for name, info in mcp_servers.items():
-        if info.get("disabled"):
-            continue
-        url = info.get("url")
-        if not url:
-            continue
-        tools, tool_infos = load_mcp_tools(url)
+    for name, entry in entries.items():
+        tools, tool_infos = build_mcp_tools(entry["url"], entry["tools"], entry.get("version", ""))
         tool_info_content += tool_infos
         all_tools.update(tools)
+    return all_tools, tool_info_content
 
 
-    return all_tools, tool_info_content
+def refresh_tools_cache(servers: Dict[str, Dict[str, Any]],
+                        current: Optional[Dict[str, Dict[str, Any]]] = None) -> Tuple[Dict[str, Dict[str, Any]], bool]:
+    """
+    重新拉取工具并更新磁盘缓存；拉取失败的 server 沿用正在使用或磁盘缓存中的旧条目，
+    但 url 与配置不一致的旧条目(配置改了地址)直接丢弃。
+    current: 注册表正在使用的条目。是否有变化与它比较，而不是与磁盘缓存比较：
+    缓存可能已被其他进程或之前一次没有替换成功的刷新写成了新版本。
+    返回 (最新的条目, 与 current 相比工具定义、版本或地址是否有变化)
+    """
+    current = current or {}
+    cached = read_tools_cache()
+    fresh = run_sync(discover_servers(servers))
+    entries = {}
+    for name, info in servers.items():
+        entry = fresh.get(name)
+        if entry is None:
+            entry = next((old for old in (current.get(name), cached.get(name))
+                          if old and old.get("url") == info["url"]), None)
+        if entry:
+            entries[name] = entry
+    changed = set(entries) != set(current) or any(
+        any(current[name].get(field) != entry.get(field) for field in ("url", "version", "tools"))
+        for name, entry in entries.items()
+    )
+    if fresh:
+        write_tools_cache(entries)
+    return entries, changed
+
+
+def load_server_entries(use_cache: bool = True) -> Dict[str, Dict[str, Any]]:
+    """
+    从 ./mcp_config.json 中加载配置，返回各 server 的工具条目。
+    - 磁盘缓存中有已配置 server(url 一致)的条目时，直接用缓存启动，由 RegistryWatcher 在后台线程并发刷新
+      (缓存中缺少的 server 也在后台拉取)；
+    - 否则并发拉取(每个 server 单独超时)后写入缓存。
+    """
+    servers = load_mcp_config()
+    if not servers:
+        return {}
+
+    cached = read_tools_cache()
+    entries = {name: cached[name] for name, info in servers.items() if (cached.get(name) or {}).get("url") == info["url"]}
+    if use_cache and entries:
+        _PENDING_REFRESH.append(servers)
+        print(f"✅ Loaded tools of {len(entries)} MCP servers from cache {TOOLS_CACHE_PATH}")
+    else:
+        entries, _ = refresh_tools_cache(servers)
+    print(f"✅ Loaded tools from {len(entries)}/{len(servers)} MCP servers")
+    return entries
+
+
+def get_all_tools(use_cache: bool = True) -> Tuple[Dict[str, FunctionTool], str]:
+    """从 ./mcp_config.json 中加载配置，然后动态拉取工具，返回 (工具, 工具描述)"""
+    return build_registry(load_server_entries(use_cache))
+
+
+# ========== 热更新注册表 ==========
+
+class ToolRegistry:
+    """
+    工具注册表：(tools, info) 作为一个整体快照，读方一次取到一致的工具集合和描述，
+    写方构建好新快照后整体替换，正在进行中的调用仍然持有旧的工具对象，不受影响。
+    每个快照同时建好工具检索索引，search 按问题取出相关的工具。
+    """
+    def __init__(self, tools: Dict[str, FunctionTool], info: str,
+                 entries: Optional[Dict[str, Dict[str, Any]]] = None):
+        self._snapshot: Tuple[Dict[str, FunctionTool], str] = (tools, info)
+        self._index = ToolIndex.from_tools(tools)
+        self._lock = threading.Lock()
+        # 构建当前快照所用的各 server 条目 {name: {"url", "version", "tools"}}，刷新时据此判断是否有变化
+        self.entries: Dict[str, Dict[str, Any]] = entries or {}
+        self.version = 0
+
+    @property
+    def tools(self) -> Dict[str, FunctionTool]:
+        return self._snapshot[0]
+
+    @property
+    def info(self) -> str:
+        return self._snapshot[1]
+
+    def snapshot(self) -> Tuple[Dict[str, FunctionTool], str]:
+        return self._snapshot
+
+    def search(self, query: str, top_n: int, exclude: Optional[List[str]] = None) -> List[str]:
+        """与问题最相关的至多 top_n 个工具名（BM25），没有相关工具时为空"""
+        tools = self.tools
+        return [name for name in self._index.search(query, top_n, exclude) if name in tools]
+
+    def info_for(self, names: List[str]) -> str:
+        """只包含指定工具的描述，格式与 info 相同"""
+        tools = self.tools
+        return "".join(f"{name}: {tools[name].description}\n" for name in names if name in tools)
+
+    def swap(self, tools: Dict[str, FunctionTool], info: str, entries: Optional[Dict[str, Dict[str, Any]]] = None):
+        index = ToolIndex.from_tools(tools)
+        with self._lock:
+            self._snapshot = (tools, info)
+            self._index = index
+            self.entries = entries or {}
+            self.version += 1
+        print(f"🔄 Tool registry v{self.version}: {len(tools)} tools")
+
+
+class RegistryWatcher(threading.Thread):
+    """
+    后台线程：
+    - 每 MCP_CONFIG_POLL_INTERVAL 秒检查 mcp_config.json 的修改时间，变化后立即重新加载；
+    - 每 MCP_TOOLS_REFRESH_INTERVAL 秒重新拉取各 server 的工具列表，有变化时替换注册表。
+    """
+    def __init__(self, registry: ToolRegistry, config_path: str = MCP_CONFIG_PATH):
+        super().__init__(daemon=True, name="mcp-registry-watcher")
+        self.registry = registry
+        self.config_path = config_path
+        self._config_mtime = self._mtime()
+        self._stop_event = threading.Event()
+
+    def _mtime(self) -> float:
+        try:
+            return os.path.getmtime(self.config_path)
+        except OSError:
+            return 0.0
+
+    def reload(self, force: bool = False):
+        servers = load_mcp_config(self.config_path)
+        entries, changed = refresh_tools_cache(servers, self.registry.entries)
+        if changed or force:
+            self.registry.swap(*build_registry(entries), entries=entries)
+
+    def _safe_reload(self, force: bool = False):
+        try:
+            self.reload(force=force)
+        except Exception as e:
+            print(f"❌ Tool registry reload failed: {e!r}")
+
+    def run(self):
+        # 从缓存启动时，先在后台做一次刷新
+        if _PENDING_REFRESH:
+            _PENDING_REFRESH.clear()
+            self._safe_reload()
+        last_refresh = time.monotonic()
+        while not self._stop_event.wait(MCP_CONFIG_POLL_INTERVAL):
+            mtime = self._mtime()
+            if mtime != self._config_mtime:
+                self._config_mtime = mtime
+                print(f"🔄 {self.config_path} changed, reloading tools")
+                self._safe_reload(force=True)
+                last_refresh = time.monotonic()
+            elif time.monotonic() - last_refresh >= MCP_TOOLS_REFRESH_INTERVAL:
+                self._safe_reload()
+                last_refresh = time.monotonic()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# ========== 全局注册表 ==========
+# 工具和工具的描述信息统一从 REGISTRY.tools / REGISTRY.info 读取，热更新后立即可见。
+# 导入模块时注册表为空，不访问网络；由入口调用 start_registry() 拉取工具并启动后台刷新
+REGISTRY = ToolRegistry({}, "")
+REGISTRY_WATCHER: Optional[RegistryWatcher] = None
+_START_LOCK = threading.Lock()
+
 
+def start_registry() -> ToolRegistry:
+    """加载工具并启动 RegistryWatcher，重复调用只生效一次"""
+    global REGISTRY_WATCHER
+    with _START_LOCK:
+        if REGISTRY_WATCHER is None:
+            entries = load_server_entries()
+            REGISTRY.swap(*build_registry(entries), entries=entries)
+            REGISTRY_WATCHER = RegistryWatcher(REGISTRY)
+            REGISTRY_WATCHER.start()
+    return REGISTRY
 
-# ========== 导出全局注册表 ==========
-# 工具和工具的描述信息
-ALL_TOOLS, TOOLS_INFO = get_all_tools()
 
 if __name__ == "__main__":
     # 仅测试输出
-    for k in ALL_TOOLS:
+    start_registry()
+    for k in REGISTRY.tools:
         print(f"Tool: {k}")
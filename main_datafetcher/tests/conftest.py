@@ -0,0 +1,14 @@
+import os
+import sys
+
+# innovation_agents 没有 __init__.py，而导入 slide_agent 包会加载整个 Agent(需要模型配置)，
+# 所以测试把该目录加入 sys.path，直接按模块名导入 mcp_client / tool_cache / tool_index；
+# test_agent 需要按包导入 Agent，把 main_datafetcher 也加入 sys.path
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "slide_agent", "sub_agents", "innovation_agents"))
+sys.path.append(ROOT)
+
+# 导入 Agent 时 create_model 会检查模型的 API Key，测试不调用模型，给个占位值即可
+for _key in ("GOOGLE_API_KEY", "DEEPSEEK_API_KEY", "OPENAI_API_KEY", "CLAUDE_API_KEY"):
+    os.environ.setdefault(_key, "test")
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
@@ -0,0 +1,248 @@
+import asyncio
+
+import pytest
+
+agent = pytest.importorskip("slide_agent.sub_agents.innovation_agents.agent")
+tools = pytest.importorskip("slide_agent.sub_agents.innovation_agents.tools")
+
+PARAMETERS = {"type": "object", "properties": {"url": {"type": "string"}, "save_dir": {"type": "string"}},
+              "required": ["url"]}
+
+
+def make_tool(name, invoke, parameters=PARAMETERS):
+    def func(**kwargs):
+        return None
+    return tools.MYFunctionTool(func, name, f"{name} tool", parameters, invoke=invoke)
+
+
+def use_tools(monkeypatch, *tool_list):
+    registry = tools.ToolRegistry({t.name: t for t in tool_list}, "")
+    monkeypatch.setattr(agent, "REGISTRY", registry)
+
+
+class FakeInvoke:
+    """按给定的延迟返回结果或抛出异常，记录收到的参数以及是否被取消"""
+    def __init__(self, delay, result):
+        self.delay = delay
+        self.result = result
+        self.args = None
+        self.cancelled = False
+
+    async def __call__(self, arguments, deadline=None):
+        self.args = arguments
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def solver_state(candidates, **extra):
+    st = {"tool_arguments": {"url": "https://a.com/ir", "save_dir": "a", "unused": 1},
+          "tool_candidates": candidates, "try_tool_number": len(candidates)}
+    st.update(extra)
+    return st
+
+
+def test_speculative_first_success_wins_and_cancels_the_rest(monkeypatch):
+    failing = FakeInvoke(0.01, {"status": "error", "text": "404"})
+    fast = FakeInvoke(0.05, {"status": "success", "text": "saved 3 files"})
+    slow = FakeInvoke(10, {"status": "success", "text": "too late"})
+    use_tools(monkeypatch, make_tool("failing", failing), make_tool("fast", fast), make_tool("slow", slow))
+    st = solver_state(["failing", "fast", "slow"])
+    assert asyncio.run(agent.speculative_execute(st)) == (True, "fast", "saved 3 files")
+    assert slow.cancelled
+    assert fast.args == {"url": "https://a.com/ir", "save_dir": "a"}
+    assert [c["tool"] for c in st["tool_calls"]] == ["failing", "fast"]
+    assert st["tried_tools"] == ["failing"]
+
+
+def test_speculative_all_failures_are_summarised(monkeypatch):
+    first = FakeInvoke(0.01, {"status": "error", "text": "timeout"})
+    second = FakeInvoke(0.02, RuntimeError("connection reset"))
+    use_tools(monkeypatch, make_tool("first", first), make_tool("second", second))
+    st = solver_state(["first", "second"], tried_tools=["first"])
+    solved, tool_name, summary = asyncio.run(agent.speculative_execute(st))
+    assert (solved, tool_name) == (False, "second")
+    assert "first: timeout" in summary and "connection reset" in summary
+    assert st["tried_tools"] == ["first", "second"]
+    assert [c["status"] for c in st["tool_calls"]] == ["error", "error"]
+
+
+def test_speculative_needs_two_runnable_candidates(monkeypatch):
+    ready = FakeInvoke(0, {"status": "success", "text": "ok"})
+    needs_query = FakeInvoke(0, {"status": "success", "text": "ok"})
+    query_params = {"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}
+    use_tools(monkeypatch, make_tool("ready", ready), make_tool("needs_query", needs_query, query_params),
+              make_tool("no_invoke", None))
+    st = solver_state(["ready", "needs_query", "no_invoke", "unknown"], try_tool_number=4)
+    assert asyncio.run(agent.speculative_execute(st)) is None
+    assert ready.args is None and needs_query.args is None
+    assert "tool_calls" not in st
+
+
+def test_early_stop_when_every_tool_was_tried(monkeypatch):
+    use_tools(monkeypatch, make_tool("a", None), make_tool("b", None))
+    assert agent.early_stop_reason({"tried_tools": ["a"]}) is None
+    assert agent.early_stop_reason({"tried_tools": ["b", "a"]})
+
+
+def test_early_stop_on_repeated_identical_errors(monkeypatch):
+    use_tools(monkeypatch, make_tool("a", None), make_tool("b", None), make_tool("c", None))
+    monkeypatch.setattr(agent, "REPEATED_FAILURE_LIMIT", 2)
+    same = [{"tool": "a", "error": "Cannot reach https://a.com/ir?page=1 after 3 retries"},
+            {"tool": "b", "error": "cannot reach  https://a.com/ir?page=2 after 5 retries"}]
+    assert agent.early_stop_reason({"failed_attempts": same})
+    different = same[:1] + [{"tool": "b", "error": "404 Not Found"}]
+    assert agent.early_stop_reason({"failed_attempts": different}) is None
+    assert agent.early_stop_reason({"failed_attempts": [{"error": ""}, {"error": None}]}) is None
+    assert agent.early_stop_reason({"failed_attempts": same[:1]}) is None
+    monkeypatch.setattr(agent, "REPEATED_FAILURE_LIMIT", 0)
+    assert agent.early_stop_reason({"failed_attempts": same}) is None
+
+
+class FakeReadonlyContext:
+    def __init__(self, invocation_id, state):
+        self.invocation_id = invocation_id
+        self.state = state
+
+
+def test_prefetch_only_runs_tools_exposed_this_turn(monkeypatch):
+    exposed = FakeInvoke(0, {"status": "success", "text": "ok"})
+    hidden = FakeInvoke(0, {"status": "success", "text": "side effect"})
+    use_tools(monkeypatch, make_tool("exposed", exposed), make_tool("hidden", hidden))
+    prefetcher = tools.TurnPrefetcher()
+    monkeypatch.setattr(agent, "TURN_PREFETCHER", prefetcher)
+    monkeypatch.setattr(tools, "REGISTRY", agent.REGISTRY)
+    calls = [agent.types.FunctionCall(name=name, args={"url": "https://a.com/ir"}) for name in ("exposed", "hidden")]
+
+    async def scenario():
+        # 没有经过 CandidateToolset 暴露工具时不预取
+        assert prefetcher.prefetch("inv", calls, {}) == 0
+        toolset = agent.CandidateToolset()
+        names = [t.name for t in await toolset.get_tools(FakeReadonlyContext("inv", {"tool_candidates": ["exposed"]}))]
+        assert names == ["exposed"]
+        assert prefetcher.prefetch("inv", calls, {}) == 1
+        await prefetcher.take("inv", "exposed", {"url": "https://a.com/ir"})
+        prefetcher.discard("inv")
+        assert prefetcher.prefetch("inv", calls, {}) == 0
+
+    asyncio.run(scenario())
+    assert exposed.args == {"url": "https://a.com/ir"}
+    assert hidden.args is None
+
+
+def tool_result(tool, status, text=""):
+    return {"tool": tool, "status": status, "text": text}
+
+
+def test_any_successful_call_solves_the_round():
+    st = {"final_reply": "", "tried_tools": ["old"]}
+    agent.decide_from_tool_status(st, [tool_result("a", "error", "404"), tool_result("b", "success", "saved"),
+                                       tool_result("c", "error", "timeout")])
+    assert (st["solved"], st["used_tool"], st["final_answer"]) == (True, "b", "saved")
+    assert st["tried_tools"] == ["old", "a", "c"]
+    st = {"final_reply": "已下载 3 个文件"}
+    agent.decide_from_tool_status(st, [tool_result("b", "success", "saved")])
+    assert st["final_answer"] == "已下载 3 个文件"
+
+
+def test_structured_round_without_success_records_the_last_error():
+    st = {"final_reply": ""}
+    agent.decide_from_tool_status(st, [tool_result("a", "error", "404"), tool_result("b", "error", "timeout")])
+    assert (st["solved"], st["used_tool"]) == (False, "b")
+    assert st["failed_attempts"] == [{"tool": "b", "error": "timeout", "raw": ""}]
+
+
+def test_staged_model_claim_is_overridden_when_every_call_errored():
+    st = {"solved": True, "final_reply": "已下载全部年报", "final_answer": "已下载全部年报", "used_tool": "a"}
+    agent.decide_from_tool_status(st, [tool_result("a", "error", "403 Forbidden")], record_failure=False)
+    assert (st["solved"], st["used_tool"], st["final_answer"]) == (False, "a", "")
+    assert st["failed_attempts"] == [{"tool": "a", "error": "403 Forbidden", "raw": "已下载全部年报"}]
+    assert st["tried_tools"] == ["a"]
+
+
+def test_staged_keeps_executor_verdict_unless_all_calls_errored():
+    # 有没有结构化 status 的调用(非 MCP 工具)时，无法确定全部失败，沿用模型的结论
+    st = {"solved": True, "final_reply": "42", "final_answer": "42", "used_tool": "calc"}
+    agent.decide_from_tool_status(st, [tool_result("a", "error", "404"), tool_result("calc", None, "42")],
+                                  record_failure=False)
+    assert (st["solved"], st["final_answer"]) == (True, "42")
+    # 执行Agent已经判定失败并记录了轨迹，不重复记录
+    st = {"solved": False, "failed_attempts": [{"tool": "a", "error": "页面没有 PDF", "raw": ""}]}
+    agent.decide_from_tool_status(st, [tool_result("a", "error", "404")], record_failure=False)
+    assert st["solved"] is False and len(st["failed_attempts"]) == 1
+
+
+def test_analyzer_tools_come_from_bm25_then_local_ranking(monkeypatch):
+    use_tools(monkeypatch, make_tool("search_downloaded", None), make_tool("download_pdf", None),
+              make_tool("get_weather", None))
+    monkeypatch.setattr(agent, "rank_tools_for_query", lambda q, exclude=None: [
+        n for n in ["get_weather", "download_pdf", "search_downloaded"] if n not in (exclude or [])])
+    assert agent.analyzer_tool_names("search downloaded files", top_n=1) == ["search_downloaded"]
+    assert agent.analyzer_tool_names("search downloaded files", top_n=2) == ["search_downloaded", "get_weather"]
+    # 检索不到相关工具(或注册表为空时的索引)时全部由本地排序给出
+    assert agent.analyzer_tool_names("完全无关", top_n=2) == ["get_weather", "download_pdf"]
+    assert agent.analyzer_tool_names("search downloaded files", exclude=["search_downloaded"],
+                                     top_n=1) == ["get_weather"]
+
+
+class FakeCallbackContext:
+    def __init__(self, state, invocation_id="inv"):
+        self.state = state
+        self.invocation_id = invocation_id
+
+
+@pytest.fixture
+def local_cache(tmp_path, monkeypatch):
+    cache = agent.ToolCache(str(tmp_path / "tool_cache.db"))
+    monkeypatch.setattr(agent, "get_cache", lambda: cache)
+    yield cache
+    cache.close()
+
+
+def test_merged_pipeline_exposes_retrieved_untried_tools(monkeypatch, local_cache):
+    use_tools(monkeypatch, *[make_tool(name, None) for name in
+                             ("search_downloaded", "download_pdf", "get_weather", "save_markdown")])
+    monkeypatch.setattr(agent, "MERGED_TOOL_TOP_N", 2)
+    plan = agent.PlanExecuteAgent()
+    st = {"question": "search downloaded files", "tried_tools": ["download_pdf"], "final_reply": "old"}
+    plan._before_agent_cb(FakeCallbackContext(st))
+    assert st["tool_candidates"][0] == "search_downloaded"
+    assert len(st["tool_candidates"]) == 2 and "download_pdf" not in st["tool_candidates"]
+    assert st["final_reply"] is None
+    # 缓存命中的工具没试过时只暴露它
+    st = {"question": "search downloaded files", "cached_tool": "save_markdown"}
+    plan._before_agent_cb(FakeCallbackContext(st))
+    assert st["tool_candidates"] == ["save_markdown"]
+
+
+def test_merged_pipeline_keeps_text_reply_for_the_controller():
+    plan = agent.PlanExecuteAgent()
+    st = {}
+    response = agent.LlmResponse(content=agent.types.Content(role="model", parts=[agent.types.Part(text="找不到 PDF")]))
+    assert plan._after_model_cb(FakeCallbackContext(st), response) is response
+    assert st["final_reply"] == "找不到 PDF"
+
+
+class FakeLoop:
+    def __init__(self, name):
+        self.name = name
+
+    async def run_async(self, ctx):
+        yield self.name
+
+
+@pytest.mark.parametrize("pipeline, expected", [("merged", "merged"), ("staged", "staged"), (None, "staged")])
+def test_router_picks_pipeline_from_state(monkeypatch, pipeline, expected):
+    monkeypatch.setattr(agent, "merged_loop_agent", FakeLoop("merged"))
+    monkeypatch.setattr(agent, "staged_loop_agent", FakeLoop("staged"))
+    ctx = type("Ctx", (), {"session": type("Session", (), {"state": {"pipeline": pipeline}})()})()
+
+    async def scenario():
+        return [event async for event in agent.solver_loop_agent._run_async_impl(ctx)]
+
+    assert asyncio.run(scenario()) == [expected]
@@ -0,0 +1,210 @@
+import asyncio
+import time
+
+import pytest
+
+import mcp_client
+
+
+@pytest.fixture(autouse=True)
+def fresh_registries(monkeypatch):
+    monkeypatch.setattr(mcp_client, "_REPLICA_SETS", {})
+    monkeypatch.setattr(mcp_client, "_BREAKERS", {})
+    monkeypatch.setattr(mcp_client, "_RETRY_BUDGETS", {})
+
+
+class HangingPool:
+    """call_tool 一直挂起，直到被取消"""
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def call_tool(self, server_url, tool_name, arguments, **kwargs):
+        self.started.set()
+        await asyncio.sleep(3600)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = mcp_client.CircuitBreaker(failures=3, reset_seconds=60)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = mcp_client.CircuitBreaker(failures=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = mcp_client.CircuitBreaker(failures=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.reset_seconds = 60
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_released_probe_lets_next_request_probe():
+    breaker = mcp_client.CircuitBreaker(failures=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == "half_open"
+    assert breaker.consecutive_failures == 1
+    assert breaker.allow()
+
+
+def test_retry_budget_limits_retries_to_ratio_of_calls():
+    budget = mcp_client.RetryBudget(ratio=0.5, max_tokens=2)
+    assert budget.try_spend()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    budget.record_call()
+    assert not budget.try_spend()
+    budget.record_call()
+    assert budget.try_spend()
+    for _ in range(10):
+        budget.record_call()
+    assert budget.tokens == 2
+
+
+def test_cancelled_half_open_probe_releases_replica_and_breaker(monkeypatch):
+    url = "http://probe.test/mcp"
+    pool = HangingPool()
+    monkeypatch.setattr(mcp_client, "get_session_pool", lambda: pool)
+    breaker = mcp_client.get_circuit_breaker(url)
+    breaker.state = "open"
+    breaker.consecutive_failures = breaker.failures
+    breaker.opened_at = time.monotonic() - breaker.reset_seconds
+
+    async def scenario():
+        task = asyncio.create_task(mcp_client.call_mcp_tool_async(url, "download", {}))
+        await pool.started.wait()
+        assert breaker.state == "half_open"
+        assert not breaker.allow()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    stats = mcp_client.get_replica_set(url).stats[url]
+    assert stats.inflight == 0
+    assert stats.consecutive_failures == 0
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+class FakeClient:
+    def __init__(self, error=None, connected=True):
+        self.error = error
+        self.connected = connected
+        self.calls = 0
+
+    def is_connected(self):
+        return self.connected
+
+    async def call_tool(self, tool_name, arguments, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return "ok"
+
+
+class FakeSession:
+    def __init__(self, client):
+        self.client = client
+        self.inflight = 0
+        self.last_used = 0.0
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def pool_with_sessions(monkeypatch, *clients):
+    pool = mcp_client.MCPSessionPool()
+    sessions = [FakeSession(c) for c in clients]
+    queue = list(sessions)
+
+    async def acquire(server_url):
+        if not queue:
+            raise mcp_client.RequestNotSentError("connect failed")
+        return queue.pop(0)
+
+    monkeypatch.setattr(pool, "_acquire", acquire)
+    return pool, sessions
+
+
+def test_session_error_after_send_is_not_resent(monkeypatch):
+    first, second = FakeClient(error=ConnectionResetError("reset")), FakeClient()
+    pool, sessions = pool_with_sessions(monkeypatch, first, second)
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(pool.call_tool("http://a.test/mcp", "download", {}))
+    assert first.calls == 1
+    assert second.calls == 0
+    assert sessions[0].closed
+
+
+def test_closed_session_before_send_reconnects_once(monkeypatch):
+    first, second = FakeClient(error=mcp_client.anyio.ClosedResourceError()), FakeClient()
+    pool, sessions = pool_with_sessions(monkeypatch, first, second)
+    assert asyncio.run(pool.call_tool("http://a.test/mcp", "download", {})) == "ok"
+    assert (first.calls, second.calls) == (1, 1)
+    assert sessions[0].closed
+
+
+def test_disconnected_session_is_replaced_without_sending(monkeypatch):
+    stale, fresh = FakeClient(connected=False), FakeClient()
+    pool, _ = pool_with_sessions(monkeypatch, stale, fresh)
+    assert asyncio.run(pool.call_tool("http://a.test/mcp", "download", {})) == "ok"
+    assert (stale.calls, fresh.calls) == (0, 1)
+
+
+def test_failed_reconnect_is_reported_as_not_sent(monkeypatch):
+    pool, _ = pool_with_sessions(monkeypatch, FakeClient(error=mcp_client.anyio.BrokenResourceError()))
+    with pytest.raises(mcp_client.RequestNotSentError):
+        asyncio.run(pool.call_tool("http://a.test/mcp", "download", {}))
+
+
+class ScriptedPool:
+    """按副本 url 返回预设的异常或结果，并记录调用次数"""
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.calls = {url: 0 for url in outcomes}
+
+    async def call_tool(self, server_url, tool_name, arguments, **kwargs):
+        self.calls[server_url] += 1
+        outcome = self.outcomes[server_url]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def test_non_idempotent_call_is_not_repeated_after_send(monkeypatch):
+    urls = ["http://a.test/mcp", "http://b.test/mcp"]
+    pool = ScriptedPool({urls[0]: ConnectionResetError("reset"), urls[1]: ConnectionResetError("reset")})
+    monkeypatch.setattr(mcp_client, "get_session_pool", lambda: pool)
+    result = asyncio.run(mcp_client.call_mcp_tool_async(urls, "download", {}))
+    assert result["status"] == "error"
+    assert result["error_type"] == "transport"
+    assert sum(pool.calls.values()) == 1
+
+
+def test_not_sent_call_fails_over_to_next_replica(monkeypatch):
+    urls = ["http://a.test/mcp", "http://b.test/mcp"]
+    pool = ScriptedPool({urls[0]: mcp_client.RequestNotSentError("connect failed"),
+                         urls[1]: mcp_client.RequestNotSentError("connect failed")})
+    monkeypatch.setattr(mcp_client, "get_session_pool", lambda: pool)
+    result = asyncio.run(mcp_client.call_mcp_tool_async(urls, "download", {}))
+    assert result["error_type"] == "transport"
+    assert pool.calls == {urls[0]: 1, urls[1]: 1}
@@ -0,0 +1,387 @@
+import sqlite3
+import time
+
+import pytest
+
+import tool_cache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = tool_cache.ToolCache(str(tmp_path / "tool_cache.db"))
+    yield c
+    c.close()
+
+
+def table_sizes(c):
+    c.flush()
+    return {table: c.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("cache", "questions", "lsh", "tool_stats")}
+
+
+def test_all_tables_stay_bounded(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "CACHE_MAX_ENTRIES", 20)
+    monkeypatch.setattr(tool_cache, "QUESTIONS_MAX_UNSOLVED", 30)
+    monkeypatch.setattr(tool_cache, "TOOL_STATS_MAX_ROWS", 40)
+    monkeypatch.setattr(tool_cache, "EVICT_EVERY_WRITES", 10)
+    for i in range(300):
+        query = f"问题 {i}：统计第 {i} 号仓库 repo{i}x{i * 7} 的提交者 alpha{i} beta{i * 3}"
+        if i % 3 == 0:
+            cache.put(query, f"tool_{i % 5}", {"q": query})
+        cache.record_outcome(query, f"tool_{i % 7}", success=i % 2 == 0, latency=1.0)
+    cache._submit(cache._evict_now)
+    sizes = table_sizes(cache)
+    assert sizes["cache"] <= 20
+    assert sizes["questions"] <= 20 + 30
+    assert sizes["lsh"] <= tool_cache.LSH_BANDS * sizes["questions"]
+    assert sizes["tool_stats"] <= 40
+
+
+def test_evicted_questions_take_their_lsh_rows(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "QUESTIONS_MAX_UNSOLVED", 0)
+    cache.put("下载 https://a.com/report 的年报", "download_pdf")
+    cache.record_outcome("完全不同的另一个问题，没有成功过", "search", success=False, latency=1.0)
+    cache._submit(cache._evict_now)
+    sizes = table_sizes(cache)
+    assert sizes["questions"] == 1
+    assert sizes["lsh"] == tool_cache.LSH_BANDS
+    assert cache.lookup("下载 https://a.com/report 的年报")["tool_name"] == "download_pdf"
+
+
+def test_stale_tool_stats_are_pruned(cache, monkeypatch):
+    cache.record_outcome("下载 https://a.com/report 的年报", "download_pdf", success=True, latency=1.0)
+    cache.flush()
+    cache.conn.execute("UPDATE tool_stats SET updated_at=0")
+    cache.conn.commit()
+    cache._submit(cache._evict_now)
+    assert table_sizes(cache)["tool_stats"] == 0
+
+
+CRAWL_CRLAND = "爬取这个网站中所有pdf文件，保存到华润置地目录下中： https://crland-umb.azurewebsites.net/zh-cn/investors/financial-results-and-presentations/"
+CRAWL_VANKE = "爬取这个网站中所有pdf文件，保存到万科地产目录下中： https://www.vanke.com/investor/reports/"
+
+
+@pytest.mark.parametrize("cached, query", [
+    (CRAWL_CRLAND, CRAWL_VANKE),
+    ("下载 https://www.sse.com.cn/disclosure/123 上贵州茅台的2023年年报PDF",
+     "下载 https://www.szse.cn/report/9 上五粮液的2022年年报PDF"),
+    ("download the PDFs from https://x.com/ir into folder crland",
+     "download the PDFs from https://y.org/reports into folder vanke_reports"),
+])
+def test_same_template_with_different_url_and_name_hits(cache, cached, query):
+    cache.put(cached, "crawl_pdfs")
+    cache.flush()
+    hit = cache.lookup(query)
+    assert hit is not None and hit["tool_name"] == "crawl_pdfs"
+    assert hit["score"] < 1.0
+
+
+@pytest.mark.parametrize("query", [
+    "帮我查一下今天北京的天气怎么样",
+    "在已下载的华润置地文档中搜索营业收入",
+    "统计华润置地目录下有多少个pdf文件",
+])
+def test_different_task_misses(cache, query):
+    cache.put(CRAWL_CRLAND, "crawl_pdfs")
+    cache.flush()
+    assert cache.lookup(query) is None
+
+
+def test_text_after_url_is_not_part_of_url():
+    a = tool_cache.question_shingles("把https://a.com/ir的年报都下载到华润置地目录")
+    b = tool_cache.question_shingles("把https://a.com/ir的新闻都截图发给我")
+    assert tool_cache.jaccard(a, b) < tool_cache.SIMILARITY_THRESHOLD
+    assert tool_cache.question_domain("把https://www.a.com/ir的年报") == "a.com"
+
+
+def test_unsolved_neighbours_do_not_crowd_out_solved_question(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "MAX_BUCKET_CANDIDATES", 5)
+    monkeypatch.setattr(tool_cache, "MAX_RERANK_CANDIDATES", 5)
+    query = "爬取这个网站中所有pdf文件，保存到招商蛇口目录下中： https://www.cmsk1979.com/ir/"
+    # 先写入的未解决问题 id 更小，且和 query 只差目录名里的一个字，比已解决的问题更相似
+    for i in range(30):
+        cache.record_outcome(query.replace("招商蛇口", f"招商蛇{chr(0x4e00 + i)}"), "search_web",
+                             success=False, latency=1.0)
+    cache.put(CRAWL_VANKE, "crawl_pdfs")
+    cache.flush()
+    hit = cache.lookup(query)
+    assert hit is not None and hit["key"] == tool_cache.get_cache_key(CRAWL_VANKE)
+
+
+def test_lsh_is_rebuilt_when_scheme_changes(tmp_path):
+    path = str(tmp_path / "old.db")
+    c = tool_cache.ToolCache(path)
+    c.put(CRAWL_CRLAND, "crawl_pdfs")
+    c.flush()
+    c.conn.execute("DELETE FROM lsh")
+    c.conn.execute("PRAGMA user_version=1")
+    c.conn.commit()
+    c.close()
+    c = tool_cache.ToolCache(path)
+    c.flush()
+    try:
+        assert c.conn.execute("PRAGMA user_version").fetchone()[0] == tool_cache.LSH_SCHEME_VERSION
+        assert c.lookup(CRAWL_VANKE)["tool_name"] == "crawl_pdfs"
+    finally:
+        c.close()
+
+
+def test_minhash_signature_is_deterministic_and_estimates_jaccard():
+    a = tool_cache.question_shingles(CRAWL_CRLAND)
+    b = tool_cache.question_shingles(CRAWL_VANKE)
+    sig_a, sig_b = tool_cache.minhash_signature(a), tool_cache.minhash_signature(b)
+    assert sig_a == tool_cache.minhash_signature(set(a))
+    assert len(sig_a) == tool_cache.LSH_BANDS * tool_cache.LSH_ROWS
+    agreement = sum(x == y for x, y in zip(sig_a, sig_b)) / len(sig_a)
+    assert abs(agreement - tool_cache.jaccard(a, b)) < 0.2
+
+
+def test_similar_questions_share_buckets_and_unrelated_ones_do_not():
+    buckets = lambda q: set(tool_cache.lsh_buckets(tool_cache.minhash_signature(tool_cache.question_shingles(q))))
+    crland, vanke = buckets(CRAWL_CRLAND), buckets(CRAWL_VANKE)
+    weather = buckets("帮我查一下今天北京的天气怎么样")
+    assert len(crland) == tool_cache.LSH_BANDS
+    assert crland & vanke
+    assert not crland & weather
+
+
+def record(cache, query, tool_name, successes, failures, latency=1.0):
+    for ok in [True] * successes + [False] * failures:
+        cache.record_outcome(query, tool_name, success=ok, latency=latency)
+    cache.flush()
+
+
+def test_rank_tools_prefers_success_rate_per_second(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "NEGATIVE_AFTER_FAILURES", 100)
+    query = "下载 https://www.sse.com.cn/disclosure/1 上的年报"
+    record(cache, query, "reliable", 8, 0, latency=10.0)
+    record(cache, query, "flaky", 2, 6, latency=10.0)
+    record(cache, query, "slow", 8, 0, latency=100.0)
+    # 期望耗时相同时按成功率排，成功率相同时快的在前；没有历史的工具先验耗时 DEFAULT_TOOL_LATENCY 排在最后
+    ranked = cache.rank_tools(query, ["slow", "flaky", "reliable", "unknown"], sample=False)
+    assert ranked == ["reliable", "flaky", "slow", "unknown"]
+    assert cache.rank_tools(query, ["slow", "reliable"], exclude=["reliable"], sample=False) == ["slow"]
+
+
+def test_rank_tools_sampling_still_explores_tools_without_history(cache):
+    query = "下载 https://www.sse.com.cn/disclosure/1 上的年报"
+    record(cache, query, "known", 1, 1, latency=60.0)
+    firsts = {cache.rank_tools(query, ["known", "unknown"])[0] for _ in range(200)}
+    assert firsts == {"known", "unknown"}
+
+
+def test_rank_tools_drops_blocked_tools_unless_nothing_else_is_left(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "NEGATIVE_AFTER_FAILURES", 2)
+    query = "下载 https://www.sse.com.cn/disclosure/1 上的年报"
+    record(cache, query, "blocked", 0, 2)
+    assert cache.blocked_tools(query) == {"blocked"}
+    assert cache.rank_tools(query, ["blocked", "other"], sample=False) == ["other"]
+    assert cache.rank_tools(query, ["blocked", "other"], exclude=["other"], sample=False) == ["blocked"]
+    assert cache.confident_tools(query, ["blocked"], min_calls=0, min_rate=0) == []
+
+
+def test_confident_tools_need_enough_successful_history(cache):
+    query = "下载 https://www.sse.com.cn/disclosure/1 上的年报"
+    record(cache, query, "proven", 6, 0)
+    record(cache, query, "lucky", 1, 0)
+    record(cache, query, "mixed", 4, 4)
+    assert cache.confident_tools(query, ["proven", "lucky", "mixed", "unknown"]) == ["proven"]
+    assert cache.confident_tools(query, ["proven"], exclude=["proven"]) == []
+
+
+def test_batched_writes_are_all_applied_after_flush(cache):
+    query = "下载 https://www.sse.com.cn/disclosure/1 上的年报"
+    for i in range(1000):
+        cache.record_outcome(query, "download_pdf", success=i % 4 != 0, latency=0.5)
+    assert cache.flush()
+    successes, failures, total_latency = cache.conn.execute(
+        "SELECT successes, failures, total_latency FROM tool_stats WHERE domain='' AND cluster=0 "
+        "AND tool_name='download_pdf'").fetchone()
+    assert (successes, failures) == (750, 250)
+    assert total_latency == pytest.approx(500.0)
+
+
+def test_put_invalidates_cached_lookup_miss(cache):
+    assert cache.lookup(CRAWL_CRLAND) is None
+    cache.put(CRAWL_CRLAND, "crawl_pdfs")
+    cache.flush()
+    assert cache.lookup(CRAWL_CRLAND)["tool_name"] == "crawl_pdfs"
+    assert cache.lookup(CRAWL_VANKE)["tool_name"] == "crawl_pdfs"
+
+
+def test_failed_write_does_not_stop_the_writer(cache):
+    def broken():
+        raise RuntimeError("boom")
+    cache._submit(broken)
+    cache.put(CRAWL_CRLAND, "crawl_pdfs")
+    assert cache.flush()
+    assert cache.get(CRAWL_CRLAND) == "crawl_pdfs"
+
+
+def test_close_drains_pending_writes(tmp_path):
+    path = str(tmp_path / "drain.db")
+    c = tool_cache.ToolCache(path)
+    for i in range(50):
+        c.put(f"第 {i} 个问题：下载 https://a{i}.com/report 的年报", f"tool_{i}")
+    c.close()
+    assert not c._writer.is_alive()
+    c = tool_cache.ToolCache(path)
+    try:
+        assert c.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 50
+    finally:
+        c.close()
+
+
+def test_args_template_round_trip_on_new_question():
+    args = {"url": "https://crland-umb.azurewebsites.net/zh-cn/investors/financial-results-and-presentations/",
+            "save_dir": "华润置地", "max_files": 20}
+    template = tool_cache.build_args_template(CRAWL_CRLAND, args)
+    assert template["url"] == {"url": 0}
+    assert template["max_files"] == {"const": 20}
+    assert "left" in template["save_dir"]
+    assert tool_cache.template_is_portable(template)
+    assert tool_cache.fill_args_template(template, CRAWL_CRLAND) == args
+    assert tool_cache.fill_args_template(template, CRAWL_VANKE) == {
+        "url": "https://www.vanke.com/investor/reports/", "save_dir": "万科地产", "max_files": 20}
+
+
+def test_fill_args_template_returns_none_when_a_slot_is_missing():
+    template = tool_cache.build_args_template(CRAWL_CRLAND, {"url": "https://crland-umb.azurewebsites.net/"
+                                                                     "zh-cn/investors/financial-results-and-presentations/"})
+    assert tool_cache.fill_args_template(template, "爬取这个网站中所有pdf文件，保存到万科地产目录下中") is None
+
+
+def test_replay_arguments_keeps_model_written_text_to_the_exact_question(cache):
+    args = {"url": "https://crland-umb.azurewebsites.net/zh-cn/investors/financial-results-and-presentations/",
+            "keywords": "annual report"}
+    cache.put(CRAWL_CRLAND, "crawl_pdfs", args)
+    cache.flush()
+    exact = cache.lookup(CRAWL_CRLAND)
+    assert exact["score"] == 1.0
+    assert cache.replay_arguments(exact, CRAWL_CRLAND) == args
+    similar = cache.lookup(CRAWL_VANKE)
+    assert similar["tool_name"] == "crawl_pdfs"
+    assert cache.replay_arguments(similar, CRAWL_VANKE) is None
+
+
+def test_replay_arguments_fills_portable_template_for_similar_question(cache):
+    cache.put(CRAWL_CRLAND, "crawl_pdfs",
+              {"url": "https://crland-umb.azurewebsites.net/zh-cn/investors/financial-results-and-presentations/"})
+    cache.flush()
+    hit = cache.lookup(CRAWL_VANKE)
+    assert cache.replay_arguments(hit, CRAWL_VANKE) == {"url": "https://www.vanke.com/investor/reports/"}
+    assert cache.replay_arguments({"tool_name": "crawl_pdfs", "args_template": None}, CRAWL_VANKE) is None
+
+
+def test_full_buckets_keep_the_newest_candidates(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "MAX_BUCKET_CANDIDATES", 3)
+    # 只有数字不同的问题 n-gram 完全相同，每个桶里都是这 40 个问题
+    for i in range(40):
+        cache.put(f"下载 https://www.sse.com.cn/disclosure/ 上第 {i} 期的年报", f"tool_{i}")
+    cache.flush()
+    hit = cache.lookup("下载 https://www.sse.com.cn/disclosure/ 上第 99 期的年报")
+    assert hit is not None and hit["tool_name"] in {"tool_37", "tool_38", "tool_39"}
+
+
+def test_evicted_question_ids_are_not_reused(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "QUESTIONS_MAX_UNSOLVED", 0)
+    cache.record_outcome("完全不同的另一个问题，没有成功过", "search", success=False, latency=1.0)
+    cache.flush()
+    evicted = cache.conn.execute("SELECT MAX(id) FROM questions").fetchone()[0]
+    cache._submit(cache._evict_now)
+    cache.record_outcome("帮我查一下今天北京的天气怎么样", "weather", success=True, latency=1.0)
+    cache.flush()
+    assert [r[0] for r in cache.conn.execute("SELECT id FROM questions")] == [evicted + 1]
+
+
+def test_legacy_question_ids_are_migrated_past_used_clusters(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    now = time.time()
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE questions(
+            id INTEGER PRIMARY KEY,
+            key TEXT UNIQUE NOT NULL,
+            question TEXT NOT NULL,
+            tool_name TEXT NOT NULL DEFAULT '',
+            cluster INTEGER,
+            last_seen_at REAL
+        );
+        CREATE TABLE tool_stats(
+            domain TEXT NOT NULL,
+            cluster INTEGER NOT NULL,
+            tool_name TEXT NOT NULL,
+            successes INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0,
+            total_latency REAL NOT NULL DEFAULT 0,
+            updated_at REAL,
+            PRIMARY KEY(domain, cluster, tool_name)
+        );
+    """)
+    conn.execute("INSERT INTO questions(id, key, question, cluster, last_seen_at) VALUES(3, ?, ?, 3, ?)",
+                 (tool_cache.get_cache_key(CRAWL_CRLAND), CRAWL_CRLAND, now))
+    conn.execute("INSERT INTO tool_stats(domain, cluster, tool_name, successes, updated_at) VALUES('', 7, 'search', 1, ?)",
+                 (now,))
+    conn.commit()
+    conn.close()
+    c = tool_cache.ToolCache(path)
+    try:
+        c.record_outcome("帮我查一下今天北京的天气怎么样", "weather", success=True, latency=1.0)
+        c.flush()
+        ddl = c.conn.execute("SELECT sql FROM sqlite_master WHERE name='questions'").fetchone()[0]
+        assert "AUTOINCREMENT" in ddl
+        ids = dict(c.conn.execute("SELECT question, id FROM questions"))
+        assert ids[CRAWL_CRLAND] == 3
+        assert ids["帮我查一下今天北京的天气怎么样"] == 8
+    finally:
+        c.close()
+
+
+def test_repeated_lookup_runs_no_sql(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "NEGATIVE_AFTER_FAILURES", 1)
+    query = "下载 https://www.sse.com.cn/disclosure/1 上的年报"
+    cache.put(query, "download_pdf")
+    cache.record_outcome(query, "crawl_pdfs", success=False, latency=1.0)
+    cache.flush()
+    assert cache.lookup(query)["tool_name"] == "download_pdf"
+    statements = []
+    cache.conn.set_trace_callback(statements.append)
+    try:
+        assert cache.lookup(query)["tool_name"] == "download_pdf"
+        assert cache.blocked_tools(query) == {"crawl_pdfs"}
+    finally:
+        cache.conn.set_trace_callback(None)
+    assert statements == []
+
+
+def test_lookup_racing_a_write_does_not_cache_the_stale_miss(cache, monkeypatch):
+    lookup_db = cache._lookup_db
+
+    def racing_lookup_db(k, query):
+        # 查库之后、放进 LRU 之前，写入线程写入了新映射并清空 LRU
+        hit = lookup_db(k, query)
+        monkeypatch.setattr(cache, "_lookup_db", lookup_db)
+        cache.put(query, "crawl_pdfs")
+        cache.flush()
+        return hit
+
+    monkeypatch.setattr(cache, "_lookup_db", racing_lookup_db)
+    assert cache.lookup(CRAWL_CRLAND) is None
+    assert cache.lookup(CRAWL_CRLAND)["tool_name"] == "crawl_pdfs"
+
+
+def test_blocked_tools_survive_a_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(tool_cache, "NEGATIVE_AFTER_FAILURES", 2)
+    path = str(tmp_path / "negative.db")
+    query = "下载 https://www.sse.com.cn/disclosure/1 上的年报"
+    c = tool_cache.ToolCache(path)
+    record(c, query, "blocked", 0, 2)
+    c.close()
+    c = tool_cache.ToolCache(path)
+    try:
+        assert c.blocked_tools(query) == {"blocked"}
+        c.record_outcome(query, "blocked", success=True, latency=1.0)
+        c.flush()
+        assert c.blocked_tools(query) == set()
+    finally:
+        c.close()
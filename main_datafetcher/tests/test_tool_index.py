@@ -0,0 +1,40 @@
+import tool_index
+
+
+class FakeTool:
+    def __init__(self, description, parameters=None):
+        self.description = description
+        self.parameters = parameters
+
+
+TOOLS = {
+    "download_pdf_via_sitemap": FakeTool("通过站点的 sitemap、RSS 发现文档并直接下载 PDF",
+                                         {"properties": {"url": {"description": "目标网页 URL"}}}),
+    "search_downloaded": FakeTool("在本地已下载的 PDF 和 Markdown 中做全文检索",
+                                  {"properties": {"query": {"description": "检索关键词"}}}),
+    "save_webpage_as_markdown": FakeTool("把网页保存为 Markdown 文件"),
+    "getWeather": FakeTool("查询城市天气"),
+}
+
+
+def test_tokenize_splits_identifiers_and_chinese_bigrams():
+    assert tool_index.tokenize("getWeather download_pdf") == ["get", "weather", "download", "pdf"]
+    assert tool_index.tokenize("全文检索 年") == ["全文", "文检", "检索", "年"]
+
+
+def test_search_ranks_relevant_tools_first():
+    index = tool_index.ToolIndex.from_tools(TOOLS)
+    assert index.search("在已下载的文档中检索营业收入", 2)[0] == "search_downloaded"
+    assert index.search("通过 sitemap 下载年报 PDF", 1) == ["download_pdf_via_sitemap"]
+    assert index.search("北京天气怎么样", 5) == ["getWeather"]
+
+
+def test_search_excludes_tools_and_drops_zero_scores():
+    index = tool_index.ToolIndex.from_tools(TOOLS)
+    assert "search_downloaded" not in index.search("检索已下载的文档", 5, exclude=["search_downloaded"])
+    assert index.search("完全无关的问题 xyz", 5) == []
+
+
+def test_empty_index_returns_nothing():
+    index = tool_index.ToolIndex.from_tools({})
+    assert index.search("下载 PDF", 5) == []
@@ -0,0 +1,180 @@
+import asyncio
+import json
+
+import pytest
+
+tools = pytest.importorskip("slide_agent.sub_agents.innovation_agents.tools")
+
+
+def make_tool(name, description=""):
+    def func(**kwargs):
+        return None
+    return tools.MYFunctionTool(func, name, description or f"{name} tool", {"type": "object", "properties": {}})
+
+
+class FakeWatcher:
+    def __init__(self, registry):
+        self.registry = registry
+        self.started = 0
+
+    def start(self):
+        self.started += 1
+
+
+def test_import_does_not_load_tools_or_export_globals():
+    assert not hasattr(tools, "ALL_TOOLS") and not hasattr(tools, "TOOLS_INFO")
+
+
+def server_entry(url, version, *names):
+    return {"url": url, "version": version,
+            "tools": [{"name": name, "description": f"{name} tool", "parameters": {}} for name in names]}
+
+
+def test_start_registry_loads_once(monkeypatch):
+    loads = []
+
+    def fake_load_server_entries():
+        loads.append(1)
+        return {"web": server_entry("http://web:8000/mcp", "1", "search_web")}
+
+    registry = tools.ToolRegistry({}, "")
+    monkeypatch.setattr(tools, "REGISTRY", registry)
+    monkeypatch.setattr(tools, "REGISTRY_WATCHER", None)
+    monkeypatch.setattr(tools, "load_server_entries", fake_load_server_entries)
+    monkeypatch.setattr(tools, "RegistryWatcher", FakeWatcher)
+    assert tools.start_registry() is registry
+    assert tools.start_registry() is registry
+    assert loads == [1]
+    assert list(registry.tools) == ["search_web"]
+    assert list(registry.entries) == ["web"]
+    assert tools.REGISTRY_WATCHER.started == 1
+
+
+def test_swap_replaces_tools_info_and_index_together():
+    registry = tools.ToolRegistry({"download_pdf": make_tool("download_pdf", "download pdf files")}, "old\n")
+    before = registry.tools
+    registry.swap({"search_downloaded": make_tool("search_downloaded", "search downloaded documents")}, "new\n")
+    assert registry.version == 1
+    assert list(before) == ["download_pdf"]
+    assert list(registry.tools) == ["search_downloaded"] and registry.info == "new\n"
+    assert registry.search("search documents", 5) == ["search_downloaded"]
+    assert registry.search("download pdf", 5) == []
+
+
+@pytest.fixture
+def watcher(tmp_path, monkeypatch):
+    """配置文件和磁盘缓存都放在临时目录，discover_servers 返回 fresh 中的条目(其余 server 视为拉取失败)"""
+    monkeypatch.chdir(tmp_path)
+    fresh = {}
+
+    async def fake_discover_servers(servers, timeout=None):
+        return {name: fresh[name] for name in servers if name in fresh}
+
+    monkeypatch.setattr(tools, "discover_servers", fake_discover_servers)
+
+    def configure(**urls):
+        with open("mcp_config.json", "w", encoding="utf-8") as f:
+            json.dump({"mcpServers": {name: {"url": url} for name, url in urls.items()}}, f)
+
+    registry = tools.ToolRegistry({}, "")
+    w = tools.RegistryWatcher(registry, config_path="mcp_config.json")
+    return w, fresh, configure
+
+
+def test_reload_swaps_when_only_the_disk_cache_is_up_to_date(watcher):
+    w, fresh, configure = watcher
+    configure(web="http://web:8000/mcp")
+    fresh["web"] = server_entry("http://web:8000/mcp", "1", "search_web")
+    w.reload()
+    assert list(w.registry.tools) == ["search_web"] and w.registry.version == 1
+    # 另一个进程已经把新版本写进磁盘缓存，本进程的注册表仍是旧版本
+    fresh["web"] = server_entry("http://web:8000/mcp", "2", "search_web", "search_news")
+    tools.write_tools_cache({"web": fresh["web"]})
+    w.reload()
+    assert sorted(w.registry.tools) == ["search_news", "search_web"] and w.registry.version == 2
+    w.reload()
+    assert w.registry.version == 2
+
+
+def test_reload_drops_cached_entry_when_server_url_changed(watcher):
+    w, fresh, configure = watcher
+    configure(web="http://web:8000/mcp", docs="http://docs:8000/mcp")
+    fresh.update(web=server_entry("http://web:8000/mcp", "1", "search_web"),
+                 docs=server_entry("http://docs:8000/mcp", "1", "search_downloaded"))
+    w.reload()
+    assert sorted(w.registry.tools) == ["search_downloaded", "search_web"]
+    # docs 换了地址且新地址拉取失败：不能继续用旧地址的工具；web 拉取失败但地址没变，保留旧条目
+    configure(web="http://web:8000/mcp", docs="http://docs-new:8000/mcp")
+    fresh.clear()
+    w.reload()
+    assert list(w.registry.tools) == ["search_web"]
+    assert w.registry.entries["web"]["url"] == "http://web:8000/mcp"
+
+
+class CountingCall:
+    def __init__(self, result, delay=0.0, elapsed=30.0):
+        self.result = result
+        self.delay = delay
+        self.elapsed = elapsed
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {**self.result, "client_elapsed_sec": self.elapsed}
+
+
+def test_result_cache_hit_reports_its_own_latency():
+    cache = tools.ToolResultCache(max_entries=8)
+    call = CountingCall({"status": "success", "text": "ok"})
+
+    async def scenario():
+        first = await cache.get_or_call("k", 60, call)
+        second = await cache.get_or_call("k", 60, call)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert call.calls == 1
+    assert first["client_elapsed_sec"] == 30.0 and "cached" not in first
+    assert second["cached"] is True and second["client_elapsed_sec"] < 1
+
+
+def test_result_cache_entries_expire_after_ttl():
+    cache = tools.ToolResultCache(max_entries=8)
+    call = CountingCall({"status": "success", "text": "ok"})
+
+    async def scenario():
+        await cache.get_or_call("k", 0.05, call)
+        await cache.get_or_call("k", 0.05, call)
+        await asyncio.sleep(0.1)
+        await cache.get_or_call("k", 0.05, call)
+
+    asyncio.run(scenario())
+    assert call.calls == 2
+
+
+def test_result_cache_single_flight_and_failures_are_not_cached():
+    cache = tools.ToolResultCache(max_entries=8)
+    ok = CountingCall({"status": "success", "text": "ok"}, delay=0.05)
+    failing = CountingCall({"status": "error", "text": "boom"})
+
+    async def scenario():
+        results = await asyncio.gather(*[cache.get_or_call("ok", 60, ok) for _ in range(5)])
+        await cache.get_or_call("bad", 60, failing)
+        await cache.get_or_call("bad", 60, failing)
+        return results
+
+    results = asyncio.run(scenario())
+    assert ok.calls == 1
+    assert sum(bool(r.get("cached")) for r in results) == 4
+    assert all(r["client_elapsed_sec"] < 30 for r in results if r.get("cached"))
+    assert failing.calls == 2
+
+
+def test_result_cache_evicts_least_recently_used():
+    cache = tools.ToolResultCache(max_entries=2)
+    cache.put("a", {"status": "success"}, 60)
+    cache.put("b", {"status": "success"}, 60)
+    assert cache.get("a") is not None
+    cache.put("c", {"status": "success"}, 60)
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/10/21 16:05
+# @File  : crawl_state.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 增量爬取：记录每个列表页的指纹、已见链接和时间，只下载新出现的文档
+
+import os
+import time
+import hashlib
+import sqlite3
+import aiohttp
+import async_timeout
+from typing import Any, Dict, List, Optional
+from common.pdf_utils import USER_AGENT, extract_document_links, fetch_page_html, download_urls
+
+CRAWL_STATE_DB_PATH = os.getenv("CRAWL_STATE_DB", "./crawl_state.db")
+
+
+def listing_fingerprint(links: List[str]) -> str:
+    """列表页指纹：只对文档链接集合求哈希，页面上的广告/时间戳变化不会影响结果"""
+    return hashlib.sha256("\n".join(sorted(set(links))).encode("utf-8")).hexdigest()
+
+
+class CrawlState:
+    """
+    每个站点(列表页 URL + 项目)一条状态：
+    - sites: 指纹、ETag/Last-Modified、最后检查时间、最后变化时间；
+    - seen_links: 已成功下载过的文档链接。
+    """
+    def __init__(self, db_path: str = CRAWL_STATE_DB_PATH):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sites(
+                site_key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                project TEXT,
+                fingerprint TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                last_checked REAL,
+                last_changed REAL
+            );
+            CREATE TABLE IF NOT EXISTS seen_links(
+                site_key TEXT NOT NULL,
+                url TEXT NOT NULL,
+                path TEXT,
+                first_seen REAL,
+                PRIMARY KEY(site_key, url)
+            );
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def site_key(url: str, project_name: str) -> str:
+        return hashlib.sha256(f"{project_name}\n{url}".encode("utf-8")).hexdigest()
+
+    def get_site(self, site_key: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT * FROM sites WHERE site_key=?", (site_key,)).fetchone()
+        return dict(row) if row else None
+
+    def seen_links(self, site_key: str) -> set:
+        return {row["url"] for row in self.conn.execute("SELECT url FROM seen_links WHERE site_key=?", (site_key,))}
+
+    def saved_paths(self) -> set:
+        """所有站点已下载文件的保存路径(绝对路径)"""
+        return {os.path.abspath(row["path"]) for row in self.conn.execute("SELECT path FROM seen_links WHERE path IS NOT NULL")}
+
+    def touch(self, site_key: str):
+        self.conn.execute("UPDATE sites SET last_checked=? WHERE site_key=?", (time.time(), site_key))
+        self.conn.commit()
+
+    def save_site(self, site_key: str, url: str, project_name: str, fingerprint: Optional[str],
+                  etag: str = "", last_modified: str = "", changed: bool = False):
+        now = time.time()
+        old = self.get_site(site_key) or {}
+        self.conn.execute(
+            "REPLACE INTO sites(site_key, url, project, fingerprint, etag, last_modified, last_checked, last_changed) "
+            "VALUES(?,?,?,?,?,?,?,?)",
+            (site_key, url, project_name, fingerprint, etag, last_modified, now,
+             now if changed else old.get("last_changed")),
+        )
+        self.conn.commit()
+
+    def mark_seen(self, site_key: str, items: List[tuple]):
+        """items: [(url, 保存路径)]"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO seen_links(site_key, url, path, first_seen) VALUES(?,?,?,?)",
+            [(site_key, url, path, now) for url, path in items],
+        )
+        self.conn.commit()
+
+
+def taken_filenames(state: CrawlState, save_dir: str) -> set:
+    """
+    save_dir 中不能被新链接覆盖的文件名：目录里已有的文件，以及之前记录过的下载路径(文件可能已被移走)。
+    新链接都是没见过的链接，与这些文件重名(如 .../2024/q4/report.pdf 和 .../2025/q1/report.pdf)时另起文件名，
+    避免覆盖旧文档、让 seen_links 里的路径指向别的内容
+    """
+    directory = os.path.abspath(save_dir)
+    names = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+    names.update(os.path.basename(path) for path in state.saved_paths() if os.path.dirname(path) == directory)
+    return names
+
+
+async def _conditional_get(url: str, etag: str, last_modified: str):
+    """带 If-None-Match/If-Modified-Since 的请求，返回 (status, html, final_url, etag, last_modified)"""
+    headers = {"User-Agent": USER_AGENT}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        async with aiohttp.ClientSession(headers=headers) as session:
+            async with async_timeout.timeout(30):
+                async with session.get(url, ssl=False) as resp:
+                    html = await resp.text(errors="ignore") if resp.status == 200 else ""
+                    return (resp.status, html, str(resp.url),
+                            resp.headers.get("ETag", ""), resp.headers.get("Last-Modified", ""))
+    except Exception as e:
+        print(f"条件请求失败: {url}, {e}")
+        return 0, "", url, "", ""
+
+
+async def fetch_new_documents(url: str, project_name: str, save_dir: str, limit: int = 50,
+                              db_path: str = CRAWL_STATE_DB_PATH, on_progress=None) -> Dict[str, Any]:
+    """
+    增量下载：
+    1) 条件请求列表页，304 直接返回未变化；
+    2) 提取文档链接并计算指纹，与上次一致直接返回；
+    3) 否则只下载未见过的链接(最多 limit 个)，下载成功的记为已见。
+       所有新链接都处理完后才更新指纹，失败/超出 limit 的下次会继续下载。
+    返回: {status: unchanged|updated|failed, new_links, downloaded, failed, total_links}
+    """
+    state = CrawlState(db_path)
+    try:
+        key = CrawlState.site_key(url, project_name)
+        site = state.get_site(key) or {}
+        status, html, final_url, etag, last_modified = await _conditional_get(
+            url, site.get("etag") or "", site.get("last_modified") or "")
+        if status == 304:
+            state.touch(key)
+            return {"status": "unchanged", "new_links": [], "downloaded": [], "failed": [], "total_links": None}
+
+        links = [it["url"] for it in extract_document_links(html, final_url) if it["doc_type"]]
+        if not links:
+            # 直接请求拿不到链接(JS 渲染的页面)，改用浏览器渲染
+            html, final_url = await fetch_page_html(url)
+            links = [it["url"] for it in extract_document_links(html, final_url) if it["doc_type"]]
+        if not links:
+            state.touch(key)
+            return {"status": "failed", "new_links": [], "downloaded": [], "failed": [], "total_links": 0}
+
+        fingerprint = listing_fingerprint(links)
+        if site.get("fingerprint") == fingerprint:
+            state.save_site(key, url, project_name, fingerprint, etag, last_modified, changed=False)
+            return {"status": "unchanged", "new_links": [], "downloaded": [], "failed": [], "total_links": len(links)}
+
+        seen = state.seen_links(key)
+        new_links = [link for link in links if link not in seen]
+        results = await download_urls(new_links[:limit], save_dir, on_progress=on_progress,
+                                      taken=taken_filenames(state, save_dir)) if new_links else []
+        downloaded = [(link, path) for link, path in results if path]
+        failed = [link for link, path in results if not path]
+        state.mark_seen(key, downloaded)
+        complete = not failed and len(new_links) <= limit
+        state.save_site(key, url, project_name, fingerprint if complete else site.get("fingerprint"),
+                        etag if complete else "", last_modified if complete else "", changed=True)
+        return {
+            "status": "updated",
+            "new_links": new_links,
+            "downloaded": [path for _, path in downloaded],
+            "failed": failed,
+            "total_links": len(links),
+        }
+    finally:
+        state.close()
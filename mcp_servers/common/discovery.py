@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/10/21 09:40
+# @File  : discovery.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 不渲染页面的文档发现：robots.txt 中的 sitemap、常见 sitemap/RSS/Atom/JSON 地址，流式解析
+
+import json
+import zlib
+import asyncio
+import contextlib
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import aiohttp
+import async_timeout
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin, urlparse, unquote
+from common.pdf_utils import USER_AGENT, _doc_type_from_url, recency_score
+
+COMMON_SITEMAP_PATHS = ["/sitemap.xml", "/sitemap_index.xml", "/sitemap-index.xml", "/sitemap.xml.gz"]
+COMMON_FEED_PATHS = ["/feed", "/rss", "/rss.xml", "/feed.xml", "/atom.xml", "/index.xml", "/feed.json"]
+MAX_SITEMAPS = 50
+# 扫描的候选文档上限（排序后再取前 limit 个），限制内存占用
+MAX_CANDIDATES = 5000
+STREAM_CHUNK = 64 * 1024
+REQUEST_TIMEOUT = 30
+# 整个发现过程的时间上限，超时后用已经找到的文档排序返回，不超过客户端调用工具的超时
+DISCOVERY_TIMEOUT = 90
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1].lower()
+
+
+def _same_site(url, base_url):
+    host = urlparse(url).hostname or ""
+    base = urlparse(base_url).hostname or ""
+    strip = lambda h: h[4:] if h.startswith("www.") else h
+    return strip(host) == strip(base) or host.endswith("." + strip(base))
+
+
+async def _iter_body_chunks(resp):
+    """
+    逐块读取响应体，内容是 gzip 数据(.gz 的 sitemap)时边读边解压。
+    按开头的 gzip 魔数判断，不看后缀和响应头：带 Content-Encoding: gzip 的响应 aiohttp 已经解压过了。
+    """
+    head = b""
+    decompressor = None
+    async for chunk in resp.content.iter_chunked(STREAM_CHUNK):
+        if head is not None:
+            head += chunk
+            if len(head) < len(GZIP_MAGIC):
+                continue
+            chunk, head = head, None
+            if chunk.startswith(GZIP_MAGIC):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        yield decompressor.decompress(chunk) if decompressor else chunk
+    if head:
+        yield head
+    if decompressor:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+async def iter_xml_entries(session, url):
+    """
+    流式解析 sitemap / RSS / Atom，不把整个文件读进内存。
+    产出 (kind, link, lastmod)，kind 为 "sitemap"(子 sitemap) 或 "url"(页面/文档地址)。
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    async with async_timeout.timeout(REQUEST_TIMEOUT * 4):
+        async with session.get(url, ssl=False) as resp:
+            if resp.status != 200:
+                return
+            async for chunk in _iter_body_chunks(resp):
+                try:
+                    parser.feed(chunk)
+                    events = list(parser.read_events())
+                except ET.ParseError as e:
+                    print(f"解析 XML 失败: {url}, {e}")
+                    return
+                for event, elem in events:
+                    if event == "start":
+                        if root is None:
+                            root = elem
+                        continue
+                    name = _local_name(elem.tag)
+                    if name in ("url", "sitemap"):
+                        # sitemap: <url><loc/><lastmod/></url>、sitemap index: <sitemap><loc/></sitemap>
+                        loc, lastmod = "", ""
+                        for child in elem:
+                            child_name = _local_name(child.tag)
+                            if child_name == "loc":
+                                loc = (child.text or "").strip()
+                            elif child_name == "lastmod":
+                                lastmod = (child.text or "").strip()
+                        if loc:
+                            yield ("sitemap" if name == "sitemap" else "url"), loc, lastmod
+                        root.clear()
+                    elif name in ("item", "entry"):
+                        # RSS: <item><link/><enclosure url=""/></item>、Atom: <entry><link href=""/></entry>
+                        lastmod = ""
+                        for child in elem:
+                            child_name = _local_name(child.tag)
+                            if child_name in ("pubdate", "updated", "published"):
+                                lastmod = (child.text or "").strip()
+                        for child in elem:
+                            child_name = _local_name(child.tag)
+                            link = ""
+                            if child_name == "link":
+                                link = child.get("href") or (child.text or "").strip()
+                            elif child_name == "enclosure":
+                                link = child.get("url") or ""
+                            if link:
+                                yield "url", urljoin(url, link), lastmod
+                        elem.clear()
+
+
+def parse_lastmod(text):
+    """
+    解析 sitemap 的 lastmod(ISO 8601，如 2024-03-01、2024-03-01T08:00:00Z)
+    和 RSS 的 pubDate(RFC 822，如 Wed, 01 Jan 2024 08:00:00 GMT)，返回 UTC 时间，无法解析时返回 None
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            dt = parsedate_to_datetime(text)
+        except (TypeError, ValueError, IndexError):
+            return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def _recency_key(item):
+    """
+    排序键：有日期的按日期折算成小数年份(2024-07-01 约为 2024.5)，
+    没有日期的用链接中的年份/季度线索(recency_score 同样是年份加季度的小数)，两者可以直接比较
+    """
+    dt = parse_lastmod(item["lastmod"])
+    if dt is None:
+        return item["score"], item["score"]
+    return dt.year + (dt.timetuple().tm_yday - 1) / 366, item["score"]
+
+
+def _iter_json_links(data, base_url):
+    """递归遍历 JSON，找出所有看起来是文档地址的字符串"""
+    if isinstance(data, dict):
+        for value in data.values():
+            yield from _iter_json_links(value, base_url)
+    elif isinstance(data, list):
+        for value in data:
+            yield from _iter_json_links(value, base_url)
+    elif isinstance(data, str) and _doc_type_from_url(data):
+        yield urljoin(base_url, data)
+
+
+async def find_sitemaps(session, base_url):
+    """从 robots.txt 的 Sitemap: 行读取 sitemap 地址，读不到时用常见地址兜底"""
+    origin = f"{urlparse(base_url).scheme}://{urlparse(base_url).netloc}"
+    sitemaps = []
+    try:
+        async with async_timeout.timeout(REQUEST_TIMEOUT):
+            async with session.get(origin + "/robots.txt", ssl=False) as resp:
+                if resp.status == 200:
+                    for line in (await resp.text(errors="ignore")).splitlines():
+                        if line.lower().startswith("sitemap:"):
+                            sitemaps.append(urljoin(origin, line.split(":", 1)[1].strip()))
+    except Exception as e:
+        print(f"读取 robots.txt 失败: {origin}, {e}")
+    if not sitemaps:
+        sitemaps = [origin + p for p in COMMON_SITEMAP_PATHS]
+    return list(dict.fromkeys(sitemaps))
+
+
+async def _probe_feeds(session, base_url):
+    """探测常见的 RSS/Atom/JSON 地址，返回 [(url, kind)]，kind 为 xml 或 json"""
+    origin = f"{urlparse(base_url).scheme}://{urlparse(base_url).netloc}"
+
+    async def _probe(path):
+        url = origin + path
+        try:
+            async with async_timeout.timeout(REQUEST_TIMEOUT):
+                async with session.head(url, allow_redirects=True, ssl=False) as resp:
+                    if resp.status != 200:
+                        return None
+                    content_type = resp.headers.get("Content-Type", "").lower()
+        except Exception:
+            return None
+        if "json" in content_type:
+            return url, "json"
+        if "xml" in content_type or "rss" in content_type or "atom" in content_type:
+            return url, "xml"
+        return None
+
+    found = await asyncio.gather(*[_probe(p) for p in COMMON_FEED_PATHS])
+    return [f for f in found if f]
+
+
+async def discover_document_urls(url, keyword="", limit=200, max_sitemaps=MAX_SITEMAPS, timeout=DISCOVERY_TIMEOUT):
+    """
+    通过 sitemap 与 feed 发现站点的文档地址（不启动浏览器）。
+    keyword 非空时只保留地址中包含该关键词的文档(不区分大小写，URL 解码后匹配)。
+    timeout: 整个发现过程的时间上限(秒)，超时后返回已经发现的文档。
+    返回: [{url, doc_type, lastmod, source, score}]，按 lastmod/时间线索从新到旧排序，取前 limit 个。
+    """
+    keyword = (keyword or "").lower()
+    found = {}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    def _add(link, lastmod, source):
+        doc_type = _doc_type_from_url(link)
+        if not doc_type or link in found or not _same_site(link, url):
+            return
+        if keyword and keyword not in unquote(link).lower():
+            return
+        found[link] = {"url": link, "doc_type": doc_type, "lastmod": lastmod, "source": source}
+
+    async with aiohttp.ClientSession(headers={"User-Agent": USER_AGENT}) as session:
+        try:
+            async with async_timeout.timeout_at(deadline):
+                queue = await find_sitemaps(session, url)
+        except asyncio.TimeoutError:
+            queue = []
+        seen = set()
+        while queue and len(seen) < max_sitemaps and len(found) < MAX_CANDIDATES and loop.time() < deadline:
+            sitemap_url = queue.pop(0)
+            if sitemap_url in seen:
+                continue
+            seen.add(sitemap_url)
+            try:
+                # 提前 break 时由 aclosing 关闭生成器，立即释放响应和连接
+                async with async_timeout.timeout_at(deadline), \
+                        contextlib.aclosing(iter_xml_entries(session, sitemap_url)) as entries:
+                    async for kind, link, lastmod in entries:
+                        if kind == "sitemap":
+                            # 子 sitemap 名称里带关键词的优先处理
+                            if keyword and keyword in unquote(link).lower():
+                                queue.insert(0, link)
+                            else:
+                                queue.append(link)
+                        else:
+                            _add(link, lastmod, sitemap_url)
+                        if len(found) >= MAX_CANDIDATES:
+                            break
+            except Exception as e:
+                print(f"读取 sitemap 失败: {sitemap_url}, {e!r}")
+
+        feeds = []
+        if len(found) < MAX_CANDIDATES and loop.time() < deadline:
+            try:
+                async with async_timeout.timeout_at(deadline):
+                    feeds = await _probe_feeds(session, url)
+            except asyncio.TimeoutError:
+                pass
+        for feed_url, kind in feeds:
+            if loop.time() >= deadline:
+                break
+            try:
+                async with async_timeout.timeout_at(deadline):
+                    if kind == "json":
+                        async with async_timeout.timeout(REQUEST_TIMEOUT):
+                            async with session.get(feed_url, ssl=False) as resp:
+                                data = json.loads(await resp.text(errors="ignore"))
+                        for link in _iter_json_links(data, feed_url):
+                            _add(link, "", feed_url)
+                    else:
+                        async with contextlib.aclosing(iter_xml_entries(session, feed_url)) as entries:
+                            async for _, link, lastmod in entries:
+                                _add(link, lastmod, feed_url)
+            except Exception as e:
+                print(f"读取 feed 失败: {feed_url}, {e!r}")
+
+    items = list(found.values())
+    for item in items:
+        item["score"] = recency_score(unquote(item["url"]))
+    items.sort(key=_recency_key, reverse=True)
+    return items[:limit]
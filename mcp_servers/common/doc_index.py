@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/10/20 10:12
+# @File  : doc_index.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 已下载文档(pdf/markdown)的本地全文索引，基于 SQLite FTS5
+
+import os
+import re
+import sqlite3
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+from common.pdf_process import iter_pdf_pages, read_pdf_info, text_path_for
+
+PDF_ROOT = "./downloaded_pdfs"
+MARKDOWN_ROOT = "./downloaded_markdowns"
+INDEX_DB_PATH = os.getenv("DOC_INDEX_DB", "./downloaded_index.db")
+INGEST_WORKERS = int(os.getenv("DOC_INDEX_WORKERS", "4"))
+
+DOC_EXTENSIONS = {".pdf": "pdf", ".md": "markdown"}
+
+# 同一进程内的索引任务串行执行；进程池用 spawn 启动，索引常在 server 的工作线程中运行，fork 会复制其它线程持有的锁
+_INGEST_LOCK = threading.Lock()
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# 中文等 CJK 字符逐字切分，让 unicode61 分词器可以做中文短语匹配
+_CJK_RE = re.compile(r"([\u3400-\u9fff\uf900-\ufaff])")
+_CJK_SPACE_RE = re.compile(r"(?<=[\u3400-\u9fff\uf900-\ufaff，。；：、]) | (?=[\u3400-\u9fff\uf900-\ufaff，。；：、])")
+_QUERY_TOKEN_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+|[0-9A-Za-z_]+")
+
+_PAGE_MARKER_RE = re.compile(r"\f<!-- page \d+ -->\n")
+
+_QUARTER_NUM = {"一": "1", "二": "2", "三": "3", "四": "4"}
+
+# 报告期识别：年度/中期/季度报告，英文 Q1 2025 / FY2024 等
+_PERIOD_PATTERNS = [
+    (re.compile(r"(20\d{2})\s*年?\s*第?([一二三四1-4])\s*季度"), lambda m: f"{m.group(1)}Q{_QUARTER_NUM.get(m.group(2), m.group(2))}"),
+    (re.compile(r"(20\d{2})\s*年?\s*(中期|半年度)"), lambda m: f"{m.group(1)}H1"),
+    (re.compile(r"(20\d{2})\s*年?\s*(年度|年报|全年)"), lambda m: f"{m.group(1)}FY"),
+    (re.compile(r"\bQ([1-4])\s*[-_ ]?\s*(20\d{2})\b", re.IGNORECASE), lambda m: f"{m.group(2)}Q{m.group(1)}"),
+    (re.compile(r"\b(20\d{2})\s*[-_ ]?\s*Q([1-4])\b", re.IGNORECASE), lambda m: f"{m.group(1)}Q{m.group(2)}"),
+    (re.compile(r"\b(?:interim|half[- ]year)\D{0,20}(20\d{2})\b", re.IGNORECASE), lambda m: f"{m.group(1)}H1"),
+    (re.compile(r"\b(?:FY|annual\D{0,20})(20\d{2})\b", re.IGNORECASE), lambda m: f"{m.group(1)}FY"),
+]
+
+
+def segment_text(text: str) -> str:
+    """把 CJK 字符用空格隔开，其它文本保持不变"""
+    return _CJK_RE.sub(r" \1 ", text or "")
+
+
+def unsegment_text(text: str) -> str:
+    """segment_text 的逆操作，用于还原 snippet"""
+    return _CJK_SPACE_RE.sub("", re.sub(r" {2,}", " ", text or "")).strip()
+
+
+def detect_report_period(*texts: str) -> str:
+    """从标题/文件名/正文开头中识别报告期，例如 2024FY、2025H1、2025Q1，识别不到返回空字符串"""
+    for text in texts:
+        if not text:
+            continue
+        for pattern, fmt in _PERIOD_PATTERNS:
+            m = pattern.search(text)
+            if m:
+                return fmt(m)
+    return ""
+
+
+def _extract_pdf(path: str) -> Dict[str, Any]:
+    info = read_pdf_info(path)
+    text_path = text_path_for(path)
+    if os.path.exists(text_path) and os.path.getmtime(text_path) >= os.path.getmtime(path):
+        # 下载后处理阶段已经抽取过文本，直接复用
+        with open(text_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = _PAGE_MARKER_RE.sub("", f.read())
+    else:
+        content = "\n".join(text for _, text in iter_pdf_pages(path))
+    title = info["title"]
+    if not title:
+        title = next((line.strip() for line in content.splitlines() if line.strip()), "")
+    return {"title": title.strip()[:200], "pages": info["pages"], "content": content}
+
+
+def _extract_markdown(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        content = f.read()
+    title = ""
+    for line in content.splitlines():
+        line = line.strip()
+        if line.startswith("#"):
+            title = line.lstrip("#").strip()
+            break
+        if line and not title:
+            title = line
+    return {"title": title[:200], "pages": 0, "content": content}
+
+
+def extract_document(path: str) -> Dict[str, Any]:
+    """
+    抽取单个文件的文本与元数据，运行在进程池中。
+    返回: {path, project, doc_type, title, pages, period, content, mtime, size, error}
+    """
+    doc_type = DOC_EXTENSIONS.get(os.path.splitext(path)[1].lower(), "")
+    stat = os.stat(path)
+    doc = {
+        "path": os.path.abspath(path),
+        "project": os.path.basename(os.path.dirname(path)),
+        "doc_type": doc_type,
+        "title": "",
+        "pages": 0,
+        "period": "",
+        "content": "",
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "error": "",
+    }
+    try:
+        if doc_type == "pdf":
+            doc.update(_extract_pdf(path))
+        elif doc_type == "markdown":
+            doc.update(_extract_markdown(path))
+    except Exception as e:
+        doc["error"] = str(e)
+    doc["period"] = detect_report_period(doc["title"], os.path.basename(path), doc["content"][:2000])
+    if not doc["title"]:
+        doc["title"] = os.path.splitext(os.path.basename(path))[0]
+    return doc
+
+
+def list_documents(roots: Optional[List[str]] = None) -> List[str]:
+    """遍历下载目录，返回所有支持的文档路径"""
+    paths = []
+    for root in roots or [PDF_ROOT, MARKDOWN_ROOT]:
+        if not os.path.isdir(root):
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if os.path.splitext(name)[1].lower() in DOC_EXTENSIONS:
+                    paths.append(os.path.join(dirpath, name))
+    return sorted(paths)
+
+
+class DocIndex:
+    """
+    文档索引：
+    - documents 表保存元数据(路径、项目、标题、页数、报告期、mtime/size)；
+    - documents_fts 为 FTS5 虚表，保存切分后的标题和正文，rowid 与 documents.id 对应。
+    """
+    def __init__(self, db_path: str = INDEX_DB_PATH):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        # WAL 模式下后台建索引不会阻塞检索
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT UNIQUE NOT NULL,
+                project TEXT,
+                doc_type TEXT,
+                title TEXT,
+                pages INTEGER,
+                period TEXT,
+                mtime REAL,
+                size INTEGER,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_project ON documents(project);
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(title, content, tokenize='unicode61');
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def stale_paths(self, paths: List[str]) -> List[str]:
+        """返回新增或 mtime/size 变化过的文件"""
+        known = {
+            row["path"]: (row["mtime"], row["size"])
+            for row in self.conn.execute("SELECT path, mtime, size FROM documents")
+        }
+        stale = []
+        for path in paths:
+            stat = os.stat(path)
+            if known.get(os.path.abspath(path)) != (stat.st_mtime, stat.st_size):
+                stale.append(path)
+        return stale
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def remove_missing(self, paths: List[str]) -> int:
+        """删除磁盘上已经不存在的文件的索引"""
+        alive = {os.path.abspath(p) for p in paths}
+        missing = [
+            (row["id"],) for row in self.conn.execute("SELECT id, path FROM documents")
+            if row["path"] not in alive
+        ]
+        self.conn.executemany("DELETE FROM documents_fts WHERE rowid=?", missing)
+        self.conn.executemany("DELETE FROM documents WHERE id=?", missing)
+        self.conn.commit()
+        return len(missing)
+
+    def upsert(self, doc: Dict[str, Any], commit: bool = True):
+        row = self.conn.execute("SELECT id FROM documents WHERE path=?", (doc["path"],)).fetchone()
+        if row:
+            doc_id = row["id"]
+            self.conn.execute(
+                "UPDATE documents SET project=?, doc_type=?, title=?, pages=?, period=?, mtime=?, size=?, error=? WHERE id=?",
+                (doc["project"], doc["doc_type"], doc["title"], doc["pages"], doc["period"],
+                 doc["mtime"], doc["size"], doc["error"], doc_id),
+            )
+            self.conn.execute("DELETE FROM documents_fts WHERE rowid=?", (doc_id,))
+        else:
+            cur = self.conn.execute(
+                "INSERT INTO documents(path, project, doc_type, title, pages, period, mtime, size, error) VALUES(?,?,?,?,?,?,?,?,?)",
+                (doc["path"], doc["project"], doc["doc_type"], doc["title"], doc["pages"], doc["period"],
+                 doc["mtime"], doc["size"], doc["error"]),
+            )
+            doc_id = cur.lastrowid
+        self.conn.execute(
+            "INSERT INTO documents_fts(rowid, title, content) VALUES(?,?,?)",
+            (doc_id, segment_text(doc["title"]), segment_text(doc["content"])),
+        )
+        if commit:
+            self.conn.commit()
+
+    @staticmethod
+    def build_match_query(query: str) -> str:
+        """把用户查询转成 FTS5 MATCH 语句：每个词/中文片段作为短语，AND 连接"""
+        phrases = []
+        for token in _QUERY_TOKEN_RE.findall(query or ""):
+            phrases.append('"' + segment_text(token).strip().replace('"', "") + '"')
+        return " AND ".join(phrases)
+
+    def search(self, query: str, project_name: str = "", period: str = "", limit: int = 10) -> List[Dict[str, Any]]:
+        match = self.build_match_query(query)
+        if not match:
+            return []
+        sql = """
+            SELECT d.path, d.project, d.doc_type, d.title, d.pages, d.period,
+                   snippet(documents_fts, 1, '[', ']', '…', 24) AS snippet,
+                   bm25(documents_fts, 5.0, 1.0) AS score
+            FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+            WHERE documents_fts MATCH ?
+        """
+        params: List[Any] = [match]
+        if project_name:
+            sql += " AND d.project = ?"
+            params.append(project_name)
+        if period:
+            sql += " AND d.period LIKE ?"
+            params.append(f"{period}%")
+        sql += " ORDER BY score LIMIT ?"
+        params.append(int(limit))
+        results = []
+        for row in self.conn.execute(sql, params):
+            item = dict(row)
+            item["snippet"] = unsegment_text(item["snippet"])
+            results.append(item)
+        return results
+
+
+def _index_stale(index: DocIndex, paths: List[str], max_workers: int) -> Dict[str, int]:
+    """在进程池中抽取新增/变化文件的文本，当前线程写入 SQLite"""
+    stale = index.stale_paths(paths)
+    failed = 0
+    if stale:
+        workers = max(1, min(max_workers, len(stale)))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT) as pool:
+            for doc in pool.map(extract_document, stale, chunksize=4):
+                if doc["error"]:
+                    failed += 1
+                    print(f"索引文件失败：{doc['path']}，{doc['error']}")
+                index.upsert(doc, commit=False)
+        index.conn.commit()
+    return {"indexed": len(stale), "failed": failed}
+
+
+def ingest_documents(roots: Optional[List[str]] = None, db_path: str = INDEX_DB_PATH,
+                     max_workers: int = INGEST_WORKERS) -> Dict[str, int]:
+    """
+    增量建立索引：遍历下载目录，只对新增/变化的文件在进程池中抽取文本，删除已不存在的文件。
+    返回: {"total": 文件数, "indexed": 本次更新数, "removed": 删除数, "failed": 抽取失败数}
+    """
+    with _INGEST_LOCK:
+        paths = list_documents(roots)
+        index = DocIndex(db_path)
+        try:
+            removed = index.remove_missing(paths)
+            stats = _index_stale(index, paths, max_workers)
+            return {"total": len(paths), "removed": removed, **stats}
+        finally:
+            index.close()
+
+
+def index_documents(paths: List[str], db_path: str = INDEX_DB_PATH,
+                    max_workers: int = INGEST_WORKERS) -> Dict[str, int]:
+    """
+    只索引指定的文件(例如刚下载完成的文件)，不遍历整个下载目录；不存在或不支持的文件忽略。
+    返回: {"indexed": 本次更新数, "failed": 抽取失败数}
+    """
+    paths = [p for p in dict.fromkeys(paths)
+             if os.path.splitext(p)[1].lower() in DOC_EXTENSIONS and os.path.isfile(p)]
+    if not paths:
+        return {"indexed": 0, "failed": 0}
+    with _INGEST_LOCK:
+        index = DocIndex(db_path)
+        try:
+            return _index_stale(index, paths, max_workers)
+        finally:
+            index.close()
+
+
+def count_documents(db_path: str = INDEX_DB_PATH) -> int:
+    index = DocIndex(db_path)
+    try:
+        return index.count()
+    finally:
+        index.close()
+
+
+def search_documents(query: str, project_name: str = "", period: str = "", limit: int = 10,
+                     db_path: str = INDEX_DB_PATH) -> List[Dict[str, Any]]:
+    index = DocIndex(db_path)
+    try:
+        return index.search(query, project_name=project_name, period=period, limit=limit)
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    stats = ingest_documents()
+    print(f"索引完成：{stats}")
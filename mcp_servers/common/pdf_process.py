@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/10/20 15:30
+# @File  : pdf_process.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 下载后的 PDF 后处理：页数、逐页文本、校验和。mmap + 按页懒加载，进程池一文件一任务
+
+import os
+import mmap
+import json
+import hashlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PROCESS_WORKERS = int(os.getenv("PDF_PROCESS_WORKERS", "4"))
+CHECKSUM_CHUNK = 8 * 1024 * 1024
+TEXT_DIR_NAME = ".text"
+MANIFEST_NAME = "manifest.json"
+# 后处理在 server 的后台线程中运行：进程池用 spawn 启动，避免 fork 复制其它线程持有的锁；
+# 同一目录的后处理串行执行，避免并发写 manifest.json
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+_DIR_LOCKS: Dict[str, threading.Lock] = {}
+_DIR_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def open_pdf_mmap(path: str):
+    """
+    以只读 mmap 打开 PDF 并返回 PdfReader。
+    直接传路径给 PdfReader 会把整个文件读进 BytesIO，这里交给页缓存，页对象在访问时才解析。
+    """
+    from pypdf import PdfReader
+
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield PdfReader(mm)
+
+
+def iter_pdf_pages(path: str) -> Iterator[Tuple[int, str]]:
+    """逐页产出 (页码, 文本)，页码从 1 开始；单页解析失败时产出空文本"""
+    with open_pdf_mmap(path) as reader:
+        for i in range(len(reader.pages)):
+            try:
+                text = reader.pages[i].extract_text() or ""
+            except Exception:
+                text = ""
+            yield i + 1, text
+
+
+def read_pdf_info(path: str) -> Dict[str, Any]:
+    """只读取页数和元数据标题，不解析页面内容"""
+    with open_pdf_mmap(path) as reader:
+        title = ""
+        try:
+            title = (reader.metadata.title or "") if reader.metadata else ""
+        except Exception:
+            pass
+        return {"pages": len(reader.pages), "title": title.strip()}
+
+
+def file_checksum(path: str) -> str:
+    """基于 mmap 分块计算 sha256"""
+    digest = hashlib.sha256()
+    if os.path.getsize(path) == 0:
+        return digest.hexdigest()
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for start in range(0, len(mm), CHECKSUM_CHUNK):
+                    digest.update(view[start:start + CHECKSUM_CHUNK])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def text_path_for(pdf_path: str) -> str:
+    """PDF 对应的文本文件路径：同目录下 .text/<文件名>.txt"""
+    dirname, filename = os.path.split(pdf_path)
+    return os.path.join(dirname, TEXT_DIR_NAME, os.path.splitext(filename)[0] + ".txt")
+
+
+def process_pdf(path: str) -> Dict[str, Any]:
+    """
+    单个 PDF 的后处理，运行在进程池中。文本按页流式写出，内存中只保留当前页。
+    返回: {path, bytes, pages, sha256, text_path, text_chars, error}
+    """
+    info = {
+        "path": os.path.abspath(path),
+        "bytes": os.path.getsize(path),
+        "pages": 0,
+        "sha256": "",
+        "text_path": "",
+        "text_chars": 0,
+        "error": "",
+    }
+    try:
+        info["sha256"] = file_checksum(path)
+        out_path = text_path_for(path)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = out_path + ".part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for page_no, text in iter_pdf_pages(path):
+                f.write(f"\f<!-- page {page_no} -->\n")
+                f.write(text)
+                f.write("\n")
+                info["pages"] = page_no
+                info["text_chars"] += len(text)
+        os.replace(tmp_path, out_path)
+        info["text_path"] = os.path.abspath(out_path)
+    except Exception as e:
+        info["error"] = str(e)
+    return info
+
+
+def process_pdfs(paths: List[str], max_workers: int = PROCESS_WORKERS) -> List[Dict[str, Any]]:
+    """进程池并行处理，一个文件一个任务，按完成顺序收集结果"""
+    if not paths:
+        return []
+    results = []
+    workers = max(1, min(max_workers, len(paths)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT) as pool:
+        futures = [pool.submit(process_pdf, p) for p in paths]
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
+
+
+def _load_manifest(save_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(save_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _dir_lock(save_dir: str) -> threading.Lock:
+    with _DIR_LOCKS_GUARD:
+        return _DIR_LOCKS.setdefault(os.path.abspath(save_dir), threading.Lock())
+
+
+def pending_pdfs(save_dir: str, manifest: Optional[Dict[str, Any]] = None) -> List[str]:
+    """下载目录中还没处理过、或 size/mtime 变化过的 PDF"""
+    if not os.path.isdir(save_dir):
+        return []
+    if manifest is None:
+        manifest = _load_manifest(save_dir)
+    pending = []
+    for name in sorted(os.listdir(save_dir)):
+        path = os.path.join(save_dir, name)
+        if not name.lower().endswith(".pdf") or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        old = manifest.get(name) or {}
+        if old.get("bytes") == stat.st_size and old.get("mtime") == stat.st_mtime and not old.get("error"):
+            continue
+        pending.append(path)
+    return pending
+
+
+def process_download_dir(save_dir: str, max_workers: int = PROCESS_WORKERS) -> List[Dict[str, Any]]:
+    """
+    处理下载目录中新增或变化的 PDF，并把结果写入目录下的 manifest.json。
+    已处理且 size/mtime 未变化的文件会被跳过。
+    """
+    if not os.path.isdir(save_dir):
+        return []
+    with _dir_lock(save_dir):
+        manifest = _load_manifest(save_dir)
+        results = process_pdfs(pending_pdfs(save_dir, manifest), max_workers=max_workers)
+        for item in results:
+            name = os.path.basename(item["path"])
+            item["mtime"] = os.stat(item["path"]).st_mtime
+            manifest[name] = item
+            if item["error"]:
+                print(f"PDF 后处理失败：{item['path']}，{item['error']}")
+        if results:
+            with open(os.path.join(save_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return results
+
+
+def summarize_results(results: List[Dict[str, Any]]) -> Optional[str]:
+    """生成一行后处理摘要，没有处理文件时返回 None"""
+    if not results:
+        return None
+    ok = [r for r in results if not r["error"]]
+    pages = sum(r["pages"] for r in ok)
+    size = sum(r["bytes"] for r in results)
+    return f"后处理 {len(results)} 个PDF（成功 {len(ok)}，共 {pages} 页，{size / 1024 / 1024:.1f} MB）"
+
+
+if __name__ == "__main__":
+    import sys
+    for d in sys.argv[1:]:
+        print(summarize_results(process_download_dir(d)) or f"{d}: 无需处理")
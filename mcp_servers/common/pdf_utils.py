@@ -9,12 +9,33 @@
 import os
 import re
 import asyncio
+import hashlib
 import aiohttp
 import async_timeout
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse, unquote
 from crawl4ai.async_configs import BrowserConfig, CrawlerRunConfig
 from crawl4ai import AsyncWebCrawler
 
 LIMIT_NUM = 2
+HEAD_CONCURRENCY = 8
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+DOC_EXTENSIONS = {
+    ".pdf": "pdf", ".doc": "doc", ".docx": "docx", ".xls": "xls", ".xlsx": "xlsx",
+    ".ppt": "ppt", ".pptx": "pptx",
+}
+DOC_CONTENT_TYPES = {
+    "application/pdf": "pdf",
+    "application/msword": "doc",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "application/vnd.ms-excel": "xls",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "application/vnd.ms-powerpoint": "ppt",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": "pptx",
+}
+# 后缀不是文档、但看起来像下载入口的链接，需要 HEAD 嗅探确认
+DOWNLOAD_HINT_RE = re.compile(r"download|attachment|getfile|file\?|下载|附件", re.IGNORECASE)
 
 def get_run_configs(name):
     if name == "href_pdf":
@@ -81,27 +102,266 @@ async def download_with_crawler(url, download_path, run_config):
         result = await crawler.arun(url=url, config=run_config)
         return bool(result.downloaded_files)
 
+class _AnchorParser(HTMLParser):
+    """收集页面中所有 <a> 标签的 href/type/title 和锚文本"""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.anchors = []
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        attrs = dict(attrs)
+        if not attrs.get("href"):
+            return
+        self._current = {
+            "href": attrs.get("href", "").strip(),
+            "type": (attrs.get("type") or "").lower(),
+            "title": attrs.get("title") or "",
+            "text": "",
+        }
+        self.anchors.append(self._current)
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._current["text"] += data
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self._current = None
+
+
+def _doc_type_from_url(link):
+    ext = os.path.splitext(unquote(urlparse(link).path))[1].lower()
+    return DOC_EXTENSIONS.get(ext, "")
+
+
+def recency_score(text):
+    """
+    根据锚文本/链接中的时间线索打分，越新分越高：
+    年份为主，季度/半年/月份作为细分，"最新/latest" 额外加分。
+    """
+    text = text or ""
+    years = [int(y) for y in re.findall(r"(?<!\d)(20\d{2})(?!\d)", text)]
+    score = float(max(years)) if years else 0.0
+    # Q1 前后可能直接连着年份或下划线，如 2024Q1、Q1_2024，不能用 \b
+    m = re.search(r"(?<![a-z])Q([1-4])(?!\d)|第?([一二三四])季度", text, re.IGNORECASE)
+    if m:
+        score += {"1": 0.25, "2": 0.5, "3": 0.75, "4": 0.9, "一": 0.25, "二": 0.5, "三": 0.75, "四": 0.9}[m.group(1) or m.group(2)]
+    elif re.search(r"中期|半年|interim|half[- ]year", text, re.IGNORECASE):
+        score += 0.5
+    elif re.search(r"年度|年报|annual", text, re.IGNORECASE):
+        score += 0.95
+    if re.search(r"最新|latest|newest", text, re.IGNORECASE):
+        score += 0.05
+    return score
+
+
+def extract_document_links(html, base_url):
+    """
+    从 HTML 中提取文档链接：相对地址按页面地址补全，去重后按时间线索从新到旧排序。
+    返回: [{url, text, doc_type, declared_type, score}]，doc_type 为空表示后缀未知、需要 HEAD 判断。
+    """
+    parser = _AnchorParser()
+    try:
+        parser.feed(html or "")
+    except Exception:
+        pass
+    links = {}
+    for anchor in parser.anchors:
+        href = anchor["href"]
+        if href.startswith(("javascript:", "mailto:", "#", "tel:")):
+            continue
+        link = urljoin(base_url, href).split("#")[0]
+        text = " ".join((anchor["text"] or anchor["title"]).split())
+        doc_type = _doc_type_from_url(link)
+        if not doc_type and anchor["type"] == "application/pdf":
+            doc_type = "pdf"
+        if not doc_type and not DOWNLOAD_HINT_RE.search(link + " " + text):
+            continue
+        if link in links:
+            if len(text) > len(links[link]["text"]):
+                links[link]["text"] = text
+            continue
+        links[link] = {
+            "url": link,
+            "text": text,
+            "doc_type": doc_type,
+            "declared_type": anchor["type"],
+        }
+    items = list(links.values())
+    for item in items:
+        item["score"] = recency_score(item["text"] + " " + unquote(item["url"]))
+    items.sort(key=lambda x: x["score"], reverse=True)
+    return items
+
+
+async def _sniff_one(session, item, semaphore, timeout):
+    """HEAD 请求获取 Content-Type/大小；服务器不支持 HEAD 时用 Range GET 只取首字节"""
+    async with semaphore:
+        try:
+            async with async_timeout.timeout(timeout):
+                async with session.head(item["url"], allow_redirects=True, ssl=False) as resp:
+                    status, headers = resp.status, resp.headers
+                if status in (403, 405, 501):
+                    async with session.get(item["url"], headers={"Range": "bytes=0-0"}, ssl=False) as resp:
+                        status, headers = resp.status, resp.headers
+        except Exception as e:
+            item.update({"status": 0, "content_type": "", "size": None, "error": str(e)})
+            return item
+    size = None
+    content_range = headers.get("Content-Range", "")
+    if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+        size = int(content_range.rsplit("/", 1)[1])
+    elif headers.get("Content-Length", "").isdigit() and status != 206:
+        size = int(headers["Content-Length"])
+    content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+    item.update({"status": status, "content_type": content_type, "size": size})
+    if not item["doc_type"]:
+        item["doc_type"] = DOC_CONTENT_TYPES.get(content_type, "")
+    return item
+
+
+async def sniff_document_links(items, concurrency=HEAD_CONCURRENCY, timeout=10):
+    """并发 HEAD 嗅探，补全 content_type/size，并丢弃确认不是文档的链接"""
+    if not items:
+        return []
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(headers={"User-Agent": USER_AGENT}) as session:
+        items = await asyncio.gather(*[_sniff_one(session, item, semaphore, timeout) for item in items])
+    return [item for item in items if item["doc_type"]]
+
+
+async def fetch_page_html(url, render_fallback=True):
+    """先用 aiohttp 直接取 HTML，失败或拿不到内容时再用浏览器渲染"""
+    try:
+        async with aiohttp.ClientSession(headers={"User-Agent": USER_AGENT}) as session:
+            async with async_timeout.timeout(30):
+                async with session.get(url, ssl=False) as resp:
+                    if resp.status == 200:
+                        html = await resp.text(errors="ignore")
+                        if html and (extract_document_links(html, str(resp.url)) or not render_fallback):
+                            return html, str(resp.url)
+    except Exception as e:
+        print(f"直接获取页面失败，改用浏览器渲染: {url}, {e}")
+    if not render_fallback:
+        return "", url
+    config = BrowserConfig(headless=False)
+    async with AsyncWebCrawler(config=config) as crawler:
+        result = await crawler.arun(url=url, config=CrawlerRunConfig())
+        return result.html or "", result.url or url
+
+
+async def list_document_links(url, limit=30, check_headers=True):
+    """
+    只发现、不下载：返回页面上的文档链接（按时间线索从新到旧），可选并发 HEAD 校验类型和大小。
+    """
+    html, final_url = await fetch_page_html(url)
+    items = extract_document_links(html, final_url)
+    if check_headers:
+        # 后缀已知的链接只取前 limit 个嗅探，后缀未知的需要嗅探才能判断
+        known = [it for it in items if it["doc_type"]][:limit]
+        unknown = [it for it in items if not it["doc_type"]][:limit]
+        items = await sniff_document_links(known + unknown)
+        items.sort(key=lambda x: x["score"], reverse=True)
+    else:
+        items = [it for it in items if it["doc_type"]]
+    return items[:limit]
+
+
+def _short_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:8]
+
+
+def filename_from_url(link):
+    """
+    链接的保存文件名：取路径最后一段；带查询参数时在后缀前加上参数的短哈希，
+    避免 .../download.pdf?id=1 和 ?id=2 这类链接保存成同一个文件
+    """
+    parsed = urlparse(link)
+    name = os.path.basename(unquote(parsed.path)) or "download"
+    if parsed.query:
+        stem, ext = os.path.splitext(name)
+        name = f"{stem}_{_short_hash(parsed.query)}{ext}"
+    return re.sub(r'[\\/:*?"<>|]', "_", name)
+
+
+def unique_filenames(urls, taken=()):
+    """
+    为一批链接分配互不相同的文件名：文件名冲突时(如不同目录下的 report.pdf)再加上整个链接的短哈希。
+    taken: 已被其他链接占用的文件名(例如之前增量下载保存的文件)，与其冲突时同样加哈希
+    """
+    names = {}
+    used = set(taken)
+    for link in urls:
+        if link in names:
+            continue
+        name = filename_from_url(link)
+        if name in used:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}_{_short_hash(link)}{ext}"
+        used.add(name)
+        names[link] = name
+    return names
+
+
+async def download_urls(urls, download_dir, concurrency=LIMIT_NUM, timeout=60, on_progress=None, taken=()):
+    """
+    用同一个 aiohttp 会话并发下载一批链接，返回 [(url, 保存路径或 None)]。
+    on_progress: 可选的 async 回调 (已完成数, 总数)，每完成一个链接调用一次
+    taken: 不能覆盖的文件名，见 unique_filenames
+    """
+    os.makedirs(download_dir, exist_ok=True)
+    # 重复的链接只下载一次，避免并发写同一个文件
+    urls = list(dict.fromkeys(urls))
+    names = unique_filenames(urls, taken)
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def _tracked(session, link):
+        nonlocal done
+        result = await _one(session, link)
+        done += 1
+        if on_progress:
+            await on_progress(done, len(urls))
+        return result
+
+    async def _one(session, link):
+        path = os.path.join(download_dir, names[link])
+        # 先写到 .part，下载完整后再改名，中途超时/断开不会留下被当作文档处理的半个文件
+        part = path + ".part"
+        async with semaphore:
+            try:
+                async with async_timeout.timeout(timeout):
+                    async with session.get(link, ssl=False) as resp:
+                        if resp.status != 200:
+                            return link, None
+                        with open(part, "wb") as f:
+                            async for chunk in resp.content.iter_chunked(1024 * 64):
+                                f.write(chunk)
+                os.replace(part, path)
+                return link, path
+            except BaseException as e:
+                if os.path.exists(part):
+                    os.remove(part)
+                if not isinstance(e, Exception):
+                    raise
+                print(f"下载失败: {link}, {e}")
+                return link, None
+
+    async with aiohttp.ClientSession(headers={"User-Agent": USER_AGENT}) as session:
+        return await asyncio.gather(*[_tracked(session, link) for link in urls])
+
+
 async def fetch_pdfs_from_page(url, download_dir):
     os.makedirs(download_dir, exist_ok=True)
     config = BrowserConfig(headless=False)
     run_config = CrawlerRunConfig(wait_for="css:a[href*='.pdf']")
-    statuses = []
     async with AsyncWebCrawler(config=config) as crawler:
         result = await crawler.arun(url=url, config=run_config)
         html = result.html
-        pdf_urls = re.findall(r'href="(https?://[^"]+\.pdf)"', html, re.IGNORECASE)
-        pdf_urls = list(set(pdf_urls))
-        for link in pdf_urls[:LIMIT_NUM]:
-            filename = os.path.basename(link)
-            path = os.path.join(download_dir, filename)
-            async with aiohttp.ClientSession() as session:
-                try:
-                    async with async_timeout.timeout(60):
-                        async with session.get(link, ssl=False) as resp:
-                            if resp.status == 200:
-                                with open(path, "wb") as f:
-                                    f.write(await resp.read())
-                                statuses.append(True)
-                except Exception:
-                    statuses.append(False)
+    links = [it["url"] for it in extract_document_links(html, result.url or url) if it["doc_type"] == "pdf"]
+    statuses = [path is not None for _, path in await download_urls(links[:LIMIT_NUM], download_dir)]
+    # 与原实现一致：页面上没有 PDF 链接时也返回 True
     return all(statuses)
@@ -8,20 +8,105 @@
 
 import datetime
 import os
+import time
 import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 from fastmcp import FastMCP, Context
-from mcp.types import CallToolResult
-from common.pdf_utils import get_run_configs, download_with_crawler, fetch_pdfs_from_page
+from mcp.types import TextContent
+try:
+    from fastmcp.tools.tool import ToolResult
+except ImportError:  # fastmcp < 2.10 没有 ToolResult，直接返回 dict，客户端从 JSON 文本中解析
+    ToolResult = None
+from common.pdf_utils import get_run_configs, download_with_crawler, fetch_pdfs_from_page, download_urls, list_document_links as discover_document_links
+from common.discovery import discover_document_urls
+from common.crawl_state import fetch_new_documents
 from common.markdown_utils import save_markdown
+from common.doc_index import ingest_documents, index_documents, search_documents, count_documents
+from common.pdf_process import pending_pdfs, process_download_dir, summarize_results
 
 mcp = FastMCP("PDFDownloader")
 
+# 后台任务需要保留引用，否则可能在完成前被垃圾回收
+_BACKGROUND_TASKS = set()
+
+
+def run_in_background(func, *args):
+    """在线程中执行耗时的同步任务(文本抽取、建索引)，不等待结果，工具可以先返回"""
+    async def _run():
+        try:
+            await asyncio.to_thread(func, *args)
+        except Exception as e:
+            print(f"后台任务 {func.__name__} 异常：{e}")
+    task = asyncio.create_task(_run())
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+
+def tool_result(text: str, status: str, started: float, **data) -> Any:
+    """
+    统一的工具返回值：
+    - content: 给 LLM 阅读的一行结果文本；
+    - structured_content: 给程序读取的 {status, elapsed_sec, server_timestamp, files, bytes, ...}，
+      客户端可以直接根据 status 判断成功与否，不需要再解析文本。
+    status: success | error
+    """
+    structured = {
+        "status": status,
+        "elapsed_sec": round(time.monotonic() - started, 3),
+        "server_timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        **data,
+    }
+    if ToolResult is None:
+        return {"text": text, **structured}
+    return ToolResult(content=[TextContent(type="text", text=text)], structured_content=structured)
+
+
+def process_and_index(save_dir: str, paths: List[str]):
+    """PDF 后处理（页数、逐页文本、校验和，进程池并行），完成后把文件加入全文索引(复用抽取好的文本)"""
+    summary = summarize_results(process_download_dir(save_dir))
+    if summary:
+        print(f"{save_dir}：{summary}")
+    index_documents(paths)
+
+
+async def post_process_downloads(save_dir: str, paths: Optional[List[str]] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    下载完成后立即返回本次的文件列表，PDF 后处理和建索引放到后台执行，不占用工具的响应时间；
+    页数、文本等结果写入目录下的 manifest.json 和 .text/。
+    返回 (摘要文本, {"files": [{path, bytes}], "bytes": 总字节数})；
+    paths 为本次下载的文件，为空时使用目录中新增或变化的 PDF。
+    """
+    if paths is None:
+        paths = await asyncio.to_thread(pending_pdfs, save_dir)
+    files = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.exists(path):
+            files.append({"path": path, "bytes": os.path.getsize(path)})
+    if not files:
+        return "", {"files": [], "bytes": 0}
+    run_in_background(process_and_index, save_dir, [f["path"] for f in files])
+    return f"；{len(files)} 个文件已在后台做文本抽取和索引", {"files": files, "bytes": sum(f["bytes"] for f in files)}
+
+
+def progress_reporter(ctx: Optional[Context], message: str):
+    """把下载进度转成 MCP 进度通知，客户端可以在工具返回前逐步收到"""
+    async def _report(done: int, total: int):
+        if ctx is not None:
+            try:
+                await ctx.report_progress(done, total)
+            except Exception as e:
+                print(f"进度通知失败：{message}，{e}")
+    return _report
+
 
 # ======================================================
 # 1️⃣ HREF 链接抓取下载：查找页面中所有以 .pdf 结尾的 href 并下载
 # ======================================================
 @mcp.tool()
-async def download_pdf_via_href_links(url: str, project_name: str) -> CallToolResult:
+async def download_pdf_via_href_links(url: str, project_name: str) -> dict:
     """
     从网页中提取所有直接以 `.pdf` 结尾的超链接 (href)，并通过浏览器自动触发下载。
     默认使用这个即可下做所有pdf文件了，优先使用。
@@ -35,26 +120,25 @@ async def download_pdf_via_href_links(url: str, project_name: str) -> CallToolRe
     :param project_name: 下载项目名称 (用于保存目录)
     :return: 下载结果
     """
+    started = time.monotonic()
     save_dir = os.path.join("./downloaded_pdfs", project_name)
     # meta_in = ctx.request_meta or {}
     run_config = get_run_configs("href_pdf")
     status = await download_with_crawler(url, save_dir, run_config)
     result = f"✅ [HREF下载成功]: {url}" if status else f"❌ [HREF下载失败]: {url}"
+    payload = {"files": [], "bytes": 0}
+    if status:
+        summary, payload = await post_process_downloads(save_dir)
+        result += summary
 
-    return CallToolResult(
-        content=[{"type": "text", "text": result}],
-        meta={
-            # "user_id": meta_in.get("user_id", "unknown"),
-            "server_timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        },
-    )
+    return tool_result(result, "success" if status else "error", started, url=url, save_dir=save_dir, **payload)
 
 
 # ======================================================
 # 2️⃣ MIME类型识别下载：检测 <a type="application/pdf"> 标签
 # ======================================================
 @mcp.tool()
-async def download_pdf_via_mime_type(url: str, project_name: str) -> CallToolResult:
+async def download_pdf_via_mime_type(url: str, project_name: str) -> dict:
     """
     通过识别页面中声明 MIME 类型为 `application/pdf` 的链接下载 PDF。
 
@@ -68,58 +152,56 @@ async def download_pdf_via_mime_type(url: str, project_name: str) -> CallToolRes
     :param project_name: 下载项目名称
     :return: 下载结果
     """
+    started = time.monotonic()
     save_dir = os.path.join("./downloaded_pdfs", project_name)
     # meta_in = ctx.request_meta or {}
     run_config = get_run_configs("application_pdf")
     status = await download_with_crawler(url, save_dir, run_config)
     result = f"✅ [MIME下载成功]: {url}" if status else f"❌ [MIME下载失败]: {url}"
+    payload = {"files": [], "bytes": 0}
+    if status:
+        summary, payload = await post_process_downloads(save_dir)
+        result += summary
 
-    return CallToolResult(
-        content=[{"type": "text", "text": result}],
-        meta={
-            # "user_id": meta_in.get("user_id", "unknown"),
-            "server_timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        },
-    )
+    return tool_result(result, "success" if status else "error", started, url=url, save_dir=save_dir, **payload)
 
 
 # ======================================================
-# 3️⃣ 页面正则提取下载：解析 HTML 并用 aiohttp 下载 PDF
+# 3️⃣ 页面解析下载：解析 HTML 中的链接并用 aiohttp 下载 PDF
 # ======================================================
 @mcp.tool()
-async def download_pdf_via_html_parse(url: str, project_name: str) -> CallToolResult:
+async def download_pdf_via_html_parse(url: str, project_name: str) -> dict:
     """
-    直接抓取网页 HTML 内容，通过正则表达式提取所有 PDF 链接并下载。
+    抓取网页 HTML 内容，用 HTML 解析器提取所有 PDF 链接(包括相对链接)并下载。
 
     📘 特点:
-    - 不依赖 JS 执行；
-    - 使用 aiohttp 逐个请求 PDF；
-    - 适合静态页面；
-    - 无法处理异步加载的 PDF 链接。
+    - 只解析渲染后的 <a> 链接，不点击页面上的按钮；
+    - 使用 aiohttp 并发下载 PDF；
+    - 适合链接直接写在页面上的列表页；
+    - 无法处理点击后才异步加载的 PDF 链接。
 
     :param url: 目标网页 URL
     :param project_name: 下载项目名称
     :return: 下载结果
     """
+    started = time.monotonic()
     save_dir = os.path.join("./downloaded_pdfs", project_name)
     # meta_in = ctx.request_meta or {}
     status = await fetch_pdfs_from_page(url, save_dir)
     result = f"✅ [HTML解析下载成功]: {url}" if status else f"❌ [HTML解析下载失败]: {url}"
+    payload = {"files": [], "bytes": 0}
+    if status:
+        summary, payload = await post_process_downloads(save_dir)
+        result += summary
 
-    return CallToolResult(
-        content=[{"type": "text", "text": result}],
-        meta={
-            # "user_id": meta_in.get("user_id", "unknown"),
-            "server_timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        },
-    )
+    return tool_result(result, "success" if status else "error", started, url=url, save_dir=save_dir, **payload)
 
 
 # ======================================================
 # 4️⃣ 网页内容保存为 Markdown
 # ======================================================
 @mcp.tool()
-async def save_webpage_as_markdown(url: str, project_name: str) -> CallToolResult:
+async def save_webpage_as_markdown(url: str, project_name: str) -> dict:
     """
     抓取指定 URL 的网页内容，并将其保存为 Markdown 格式的文件。
 
@@ -132,6 +214,7 @@ async def save_webpage_as_markdown(url: str, project_name: str) -> CallToolResul
     :param project_name: 项目名称 (用于保存目录)
     :return: 保存结果
     """
+    started = time.monotonic()
     save_dir = os.path.join("./downloaded_markdowns", project_name)
     os.makedirs(save_dir, exist_ok=True)
 
@@ -141,14 +224,170 @@ async def save_webpage_as_markdown(url: str, project_name: str) -> CallToolResul
 
     status = await save_markdown(url, save_path)
     result = f"✅ [Markdown 保存成功]: {save_path}" if status else f"❌ [Markdown 保存失败]: {url}"
+    files = [{"path": os.path.abspath(save_path), "bytes": os.path.getsize(save_path)}] if status and os.path.exists(save_path) else []
+    if files:
+        run_in_background(index_documents, [f["path"] for f in files])
+
+    return tool_result(result, "success" if status else "error", started, url=url, save_dir=save_dir,
+                       files=files, bytes=sum(f["bytes"] for f in files))
+
+
+# ======================================================
+# 5️⃣ 检索本地已下载的文档（全文索引）
+# ======================================================
+@mcp.tool(tags={"idempotent", "cache_ttl:30"})
+async def search_downloaded(query: str, project_name: str = "", period: str = "", limit: int = 10) -> dict:
+    """
+    在本地已下载的 PDF 和 Markdown 中做全文检索，先查本地再决定是否需要重新爬取。
+
+    📘 特点:
+    - 下载工具完成后会在后台把新文件加入索引，server 启动时会增量索引已有文件，检索本身只读索引；
+    - 基于 SQLite FTS5，毫秒级返回；
+    - 返回文件路径、标题、页数、报告期(如 2024FY、2025H1、2025Q1)和命中片段。
+
+    :param query: 检索关键词，例如 "营业收入" 或 "annual results"
+    :param project_name: 只在该项目目录下检索，为空则检索全部
+    :param period: 报告期前缀过滤，例如 "2024" 或 "2024FY"
+    :param limit: 最多返回的结果数
+    :return: 检索结果(结构化结果中的 hits 为命中明细)
+    """
+    started = time.monotonic()
+    hits = await asyncio.to_thread(search_documents, query, project_name, period, limit)
+    indexed = await asyncio.to_thread(count_documents)
+    if hits:
+        # 命中明细放在结构化结果 hits 中，文本只保留摘要，避免同一份数据传两遍
+        result = f"✅ [本地检索命中 {len(hits)} 个文档]: {query}"
+    else:
+        result = f"❌ [本地检索无结果]: {query}（已索引 {indexed} 个文档）"
+
+    return tool_result(result, "success" if hits else "error", started, query=query, hits=hits,
+                       indexed=indexed)
+
+
+# ======================================================
+# 6️⃣ 只发现不下载：列出页面上的文档链接
+# ======================================================
+@mcp.tool(tags={"idempotent", "cache_ttl:300"})
+async def list_document_links(url: str, limit: int = 30, check_headers: bool = True) -> dict:
+    """
+    列出网页中的文档链接(pdf/doc/xls/ppt 等)，不下载任何文件，可用于先挑选再下载。
+
+    📘 特点:
+    - 优先直接请求 HTML，拿不到链接时才用浏览器渲染；
+    - 相对链接会按页面地址补全；
+    - 按锚文本/链接中的年份、季度、中期/年度等时间线索从新到旧排序；
+    - check_headers=True 时并发发送 HEAD 请求，校验 Content-Type 和文件大小，并识别无后缀的下载链接。
+
+    :param url: 目标网页 URL
+    :param limit: 最多返回的链接数
+    :param check_headers: 是否用 HEAD 请求校验类型和大小
+    :return: 文档链接列表(结构化结果中的 links)
+    """
+    started = time.monotonic()
+    links = await discover_document_links(url, limit=limit, check_headers=check_headers)
+    if links:
+        result = f"✅ [发现 {len(links)} 个文档链接]: {url}"
+    else:
+        result = f"❌ [未发现文档链接]: {url}"
+
+    return tool_result(result, "success" if links else "error", started, url=url, links=links)
+
+
+# ======================================================
+# 7️⃣ Sitemap / Feed 发现下载：不启动浏览器
+# ======================================================
+@mcp.tool()
+async def download_pdf_via_sitemap(url: str, project_name: str, keyword: str = "", limit: int = 20,
+                                   ctx: Context = None) -> dict:
+    """
+    通过站点的 sitemap(robots.txt 声明或常见地址)、RSS/Atom、JSON 列表发现文档并直接下载，全程不启动浏览器。
+    投资者关系(IR)类站点通常提供 sitemap，可先尝试这个工具，失败再用基于浏览器的下载工具。
+
+    📘 特点:
+    - 流式解析 sitemap(支持 sitemap index 和 .gz)，大文件也不会整体读入内存；
+    - 只保留与目标网页同站点的文档链接，keyword 可进一步按链接内容过滤，例如 "annual"、"2024"；
+    - 按 lastmod/年份从新到旧取前 limit 个，用 aiohttp 并发下载。
+
+    :param url: 目标网页 URL（用于定位站点）
+    :param project_name: 下载项目名称 (用于保存目录)
+    :param keyword: 链接过滤关键词，可为空
+    :param limit: 最多下载的文件数
+    :return: 下载结果
+    """
+    started = time.monotonic()
+    save_dir = os.path.join("./downloaded_pdfs", project_name)
+    items = await discover_document_urls(url, keyword=keyword, limit=limit)
+    downloaded = []
+    if items:
+        results = await download_urls([it["url"] for it in items], save_dir,
+                                      on_progress=progress_reporter(ctx, url))
+        downloaded = [path for _, path in results if path]
+    payload = {"files": [], "bytes": 0}
+    if downloaded:
+        result = f"✅ [Sitemap下载成功 {len(downloaded)}/{len(items)}]: {url}"
+        summary, payload = await post_process_downloads(save_dir, downloaded)
+        result += summary
+    elif items:
+        result = f"❌ [Sitemap发现 {len(items)} 个文档但下载失败]: {url}"
+    else:
+        result = f"❌ [Sitemap/Feed 中未发现文档]: {url}"
+
+    return tool_result(result, "success" if downloaded else "error", started, url=url, save_dir=save_dir,
+                       discovered=len(items), **payload)
+
+
+# ======================================================
+# 8️⃣ 增量下载：只下载列表页上新出现的文档
+# ======================================================
+@mcp.tool()
+async def download_new_documents(url: str, project_name: str, limit: int = 50, ctx: Context = None) -> dict:
+    """
+    增量爬取同一个列表页，只下载上次之后新出现的文档，适合每天定时刷新同一批网站。
+
+    📘 特点:
+    - 按 (url, project_name) 持久化已下载链接、列表页指纹、ETag/Last-Modified 和时间；
+    - 列表页返回 304 或文档链接集合没有变化时立即返回，不下载任何文件；
+    - 有变化时只下载新链接，下载失败的下次会重试。
+
+    :param url: 列表页 URL
+    :param project_name: 下载项目名称 (用于保存目录)
+    :param limit: 本次最多下载的新文件数
+    :return: 下载结果
+    """
+    started = time.monotonic()
+    save_dir = os.path.join("./downloaded_pdfs", project_name)
+    info = await fetch_new_documents(url, project_name, save_dir, limit=limit,
+                                     on_progress=progress_reporter(ctx, url))
+    payload = {"files": [], "bytes": 0}
+    ok = True
+    if info["status"] == "unchanged":
+        result = f"✅ [列表页无变化，无需下载]: {url}"
+    elif info["status"] == "updated" and (info["downloaded"] or not info["failed"]):
+        result = f"✅ [增量下载成功 新增 {len(info['downloaded'])} 个，失败 {len(info['failed'])} 个]: {url}"
+        if info["downloaded"]:
+            summary, payload = await post_process_downloads(save_dir, info["downloaded"])
+            result += summary
+    elif info["status"] == "updated":
+        result = f"❌ [增量下载失败 {len(info['failed'])} 个]: {url}"
+        ok = False
+    else:
+        result = f"❌ [列表页中未发现文档链接]: {url}"
+        ok = False
+
+    return tool_result(result, "success" if ok else "error", started, url=url, save_dir=save_dir,
+                       listing=info["status"], failed=info["failed"], **payload)
+
 
-    return CallToolResult(
-        content=[{"type": "text", "text": result}],
-        meta={
-            "server_timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        },
-    )
+def _ingest_existing_documents():
+    try:
+        stats = ingest_documents()
+        print(f"本地文档索引完成：{stats}")
+    except Exception as e:
+        print(f"本地文档索引异常：{e}")
 
 
 if __name__ == "__main__":
-    mcp.run(transport="sse")
+    # 启动时在后台线程中增量索引已有的下载文件，不阻塞 server 启动
+    threading.Thread(target=_ingest_existing_documents, daemon=True, name="doc-index").start()
+    # 多副本部署时用 MCP_PORT 区分端口，例如 MCP_PORT=8001 python mcp_server.py
+    mcp.run(transport="sse", port=int(os.getenv("MCP_PORT", "8000")))
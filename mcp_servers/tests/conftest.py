@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与 mcp_server.py 一样以 mcp_servers 目录为根导入 common.*
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,42 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip("crawl4ai")
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from common import crawl_state
+
+
+def test_new_link_with_same_basename_does_not_overwrite_earlier_download(tmp_path):
+    listing = ["/2024/q4/report.pdf"]
+
+    async def page(request):
+        links = "".join(f'<a href="{link}">report</a>' for link in listing)
+        return web.Response(text=f"<html><body>{links}</body></html>", content_type="text/html")
+
+    async def document(request):
+        return web.Response(body=f"%PDF {request.path}".encode())
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/ir", page)
+        app.router.add_get("/{year}/{quarter}/report.pdf", document)
+        db_path = str(tmp_path / "crawl_state.db")
+        save_dir = str(tmp_path / "docs")
+        async with TestServer(app) as server:
+            url = str(server.make_url("/ir"))
+            first = await crawl_state.fetch_new_documents(url, "demo", save_dir, db_path=db_path)
+            listing.append("/2025/q1/report.pdf")
+            second = await crawl_state.fetch_new_documents(url, "demo", save_dir, db_path=db_path)
+        return first, second, db_path
+
+    first, second, db_path = asyncio.run(scenario())
+    assert len(first["downloaded"]) == 1 and len(second["downloaded"]) == 1
+    assert first["downloaded"] != second["downloaded"]
+    rows = sqlite3.connect(db_path).execute("SELECT url, path FROM seen_links").fetchall()
+    assert len(rows) == 2
+    for url, path in rows:
+        assert open(path, "rb").read() == f"%PDF {url[url.index('/20'):]}".encode()
@@ -0,0 +1,139 @@
+import asyncio
+import gzip
+
+import pytest
+
+pytest.importorskip("crawl4ai")
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from common import discovery
+
+SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://ir.example.com/reports/2023-annual.pdf</loc><lastmod>2024-03-01</lastmod></url>
+  <url><loc>https://ir.example.com/reports/2024-interim.pdf</loc><lastmod>2024-08-20</lastmod></url>
+</urlset>"""
+
+
+async def read_entries(app, path):
+    async with TestServer(app) as server:
+        async with aiohttp.ClientSession() as session:
+            return [e async for e in discovery.iter_xml_entries(session, str(server.make_url(path)))]
+
+
+@pytest.mark.parametrize("headers", [
+    {"Content-Type": "application/octet-stream"},
+    {"Content-Type": "application/xml", "Content-Encoding": "gzip"},
+    {"Content-Type": "application/x-gzip"},
+])
+def test_gzip_sitemap_is_decompressed_once(headers):
+    async def handler(request):
+        return web.Response(body=gzip.compress(SITEMAP), headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/sitemap.xml.gz", handler)
+    entries = asyncio.run(read_entries(app, "/sitemap.xml.gz"))
+    assert [link for _, link, _ in entries] == ["https://ir.example.com/reports/2023-annual.pdf",
+                                                 "https://ir.example.com/reports/2024-interim.pdf"]
+
+
+def test_plain_sitemap_with_gz_name_is_not_decompressed():
+    async def handler(request):
+        return web.Response(body=SITEMAP, content_type="application/xml")
+
+    app = web.Application()
+    app.router.add_get("/sitemap.xml.gz", handler)
+    assert len(asyncio.run(read_entries(app, "/sitemap.xml.gz"))) == 2
+
+
+def test_early_stop_closes_the_entry_generator(monkeypatch):
+    closed = []
+
+    async def fake_find_sitemaps(session, base_url):
+        return ["https://ir.example.com/sitemap.xml"]
+
+    async def fake_probe_feeds(session, base_url):
+        return []
+
+    async def fake_entries(session, url):
+        try:
+            for i in range(100):
+                yield "url", f"https://ir.example.com/reports/{2000 + i}.pdf", ""
+        finally:
+            closed.append(url)
+
+    monkeypatch.setattr(discovery, "find_sitemaps", fake_find_sitemaps)
+    monkeypatch.setattr(discovery, "_probe_feeds", fake_probe_feeds)
+    monkeypatch.setattr(discovery, "iter_xml_entries", fake_entries)
+    monkeypatch.setattr(discovery, "MAX_CANDIDATES", 3)
+
+    async def scenario():
+        items = await discovery.discover_document_urls("https://ir.example.com/", limit=10)
+        assert closed == ["https://ir.example.com/sitemap.xml"]
+        return items
+
+    assert len(asyncio.run(scenario())) == 3
+
+
+def fake_discovery(monkeypatch, sitemaps, entries):
+    async def fake_find_sitemaps(session, base_url):
+        return list(sitemaps)
+
+    async def fake_probe_feeds(session, base_url):
+        return []
+
+    monkeypatch.setattr(discovery, "find_sitemaps", fake_find_sitemaps)
+    monkeypatch.setattr(discovery, "_probe_feeds", fake_probe_feeds)
+    monkeypatch.setattr(discovery, "iter_xml_entries", entries)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2024-03-01", "2024-03-01T00:00:00+00:00"),
+    ("2024-03-01T08:00:00Z", "2024-03-01T08:00:00+00:00"),
+    ("2024-03-01T16:00:00+08:00", "2024-03-01T08:00:00+00:00"),
+    ("Wed, 01 Jan 2025 08:00:00 GMT", "2025-01-01T08:00:00+00:00"),
+    ("Mon, 02 Dec 2024 08:00:00 +0800", "2024-12-02T00:00:00+00:00"),
+])
+def test_parse_lastmod_handles_iso_and_rfc822(text, expected):
+    assert discovery.parse_lastmod(text).isoformat() == expected
+    assert discovery.parse_lastmod("") is None and discovery.parse_lastmod("yesterday") is None
+
+
+def test_results_are_sorted_by_parsed_date(monkeypatch):
+    entries_by_url = [
+        ("https://ir.example.com/a.pdf", "Wed, 01 Jan 2025 08:00:00 GMT"),
+        ("https://ir.example.com/b.pdf", "Mon, 02 Dec 2024 08:00:00 GMT"),
+        ("https://ir.example.com/c.pdf", "Thu, 15 Aug 2024 08:00:00 GMT"),
+        ("https://ir.example.com/2025-q2-results.pdf", ""),
+        ("https://ir.example.com/undated.pdf", ""),
+    ]
+
+    async def fake_entries(session, url):
+        for link, lastmod in entries_by_url:
+            yield "url", link, lastmod
+
+    fake_discovery(monkeypatch, ["https://ir.example.com/feed"], fake_entries)
+    items = asyncio.run(discovery.discover_document_urls("https://ir.example.com/"))
+    assert [it["url"].rsplit("/", 1)[1] for it in items] == [
+        "2025-q2-results.pdf", "a.pdf", "b.pdf", "c.pdf", "undated.pdf"]
+
+
+def test_discovery_stops_at_overall_deadline(monkeypatch):
+    async def slow_entries(session, url):
+        yield "url", f"{url.rsplit('/', 1)[0]}/{url.rsplit('/', 1)[1]}.pdf", ""
+        await asyncio.sleep(3600)
+
+    sitemaps = [f"https://ir.example.com/sitemap{i}" for i in range(10)]
+    fake_discovery(monkeypatch, sitemaps, slow_entries)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        items = await discovery.discover_document_urls("https://ir.example.com/", timeout=0.2)
+        return items, loop.time() - started
+
+    items, elapsed = asyncio.run(scenario())
+    assert elapsed < 1
+    assert [it["url"] for it in items] == ["https://ir.example.com/sitemap0.pdf"]
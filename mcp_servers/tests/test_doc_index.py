@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from common import doc_index
+
+
+def write_markdown(root, project, name, text):
+    os.makedirs(os.path.join(root, project), exist_ok=True)
+    path = os.path.join(root, project, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "index.db")
+
+
+def test_index_documents_only_indexes_given_files(tmp_path, db_path):
+    root = str(tmp_path / "md")
+    fresh = write_markdown(root, "华润置地", "a.md", "# 2024年年度报告\n营业收入增长")
+    write_markdown(root, "华润置地", "b.md", "# 2023年年度报告\n营业收入下降")
+    stats = doc_index.index_documents([fresh, str(tmp_path / "missing.md")], db_path=db_path, max_workers=1)
+    assert stats == {"indexed": 1, "failed": 0}
+    assert doc_index.count_documents(db_path) == 1
+    hits = doc_index.search_documents("营业收入", db_path=db_path)
+    assert [h["path"] for h in hits] == [os.path.abspath(fresh)]
+    assert hits[0]["period"] == "2024FY"
+    assert doc_index.index_documents([fresh], db_path=db_path, max_workers=1)["indexed"] == 0
+
+
+def test_search_does_not_index_new_files(tmp_path, db_path):
+    write_markdown(str(tmp_path / "md"), "p", "a.md", "# 标题\n营业收入")
+    assert doc_index.search_documents("营业收入", db_path=db_path) == []
+    assert doc_index.count_documents(db_path) == 0
+
+
+def test_ingest_documents_adds_and_removes(tmp_path, db_path):
+    root = str(tmp_path / "md")
+    a = write_markdown(root, "p", "a.md", "# annual results 2024\nrevenue")
+    write_markdown(root, "p", "b.md", "# interim results 2025\nrevenue")
+    stats = doc_index.ingest_documents([root], db_path=db_path, max_workers=2)
+    assert (stats["total"], stats["indexed"], stats["removed"]) == (2, 2, 0)
+    os.remove(a)
+    stats = doc_index.ingest_documents([root], db_path=db_path, max_workers=2)
+    assert (stats["total"], stats["indexed"], stats["removed"]) == (1, 0, 1)
+    assert [h["period"] for h in doc_index.search_documents("revenue", db_path=db_path)] == ["2025H1"]
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("crawl4ai")
+pypdf = pytest.importorskip("pypdf")
+
+import mcp_server
+from common.doc_index import count_documents
+
+
+def tool_fn(tool):
+    """fastmcp 2.x 的 @mcp.tool 返回 FunctionTool，原函数在 fn 上"""
+    return getattr(tool, "fn", tool)
+
+
+def structured(result):
+    return getattr(result, "structured_content", None) or result
+
+
+def write_pdf(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+async def drain_background_tasks():
+    while mcp_server._BACKGROUND_TASKS:
+        await asyncio.gather(*list(mcp_server._BACKGROUND_TASKS))
+
+
+def fail(*args, **kwargs):
+    raise AssertionError("search must not build the index")
+
+
+def test_search_downloaded_does_not_ingest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("downloaded_markdowns/p")
+    with open("downloaded_markdowns/p/a.md", "w", encoding="utf-8") as f:
+        f.write("# 年报\n营业收入")
+    monkeypatch.setattr(mcp_server, "ingest_documents", fail)
+    monkeypatch.setattr(mcp_server, "index_documents", fail)
+    result = structured(asyncio.run(tool_fn(mcp_server.search_downloaded)(query="营业收入")))
+    assert result["status"] == "error"
+    assert result["indexed"] == 0
+
+
+def test_downloaded_files_are_indexed_in_background(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = write_pdf(os.path.join("downloaded_pdfs", "p", "report.pdf"))
+
+    async def scenario():
+        _, payload = await mcp_server.post_process_downloads(os.path.dirname(path))
+        assert [f["path"] for f in payload["files"]] == [os.path.abspath(path)]
+        await drain_background_tasks()
+
+    asyncio.run(scenario())
+    assert count_documents() == 1
+
+
+def test_post_processing_runs_after_the_tool_returns(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = write_pdf(os.path.join("downloaded_pdfs", "p", "report.pdf"))
+    release = threading.Event()
+    processed = []
+
+    def slow_process(save_dir):
+        release.wait(10)
+        processed.append(save_dir)
+        return []
+
+    monkeypatch.setattr(mcp_server, "process_download_dir", slow_process)
+
+    async def scenario():
+        summary, payload = await asyncio.wait_for(mcp_server.post_process_downloads(os.path.dirname(path)), 5)
+        assert payload["bytes"] == os.path.getsize(path)
+        assert processed == []
+        release.set()
+        await drain_background_tasks()
+
+    asyncio.run(scenario())
+    assert processed == [os.path.dirname(path)]
+
+
+def test_tools_that_write_files_are_neither_cached_nor_retried():
+    tools = asyncio.run(mcp_server.mcp.get_tools())
+    writers = [name for name in tools if name.startswith(("download_", "save_"))]
+    assert len(writers) == 6
+    for name in writers:
+        assert not any(tag.startswith("cache_ttl:") for tag in tools[name].tags), name
+        assert "idempotent" not in tools[name].tags, name
@@ -0,0 +1,31 @@
+import json
+import os
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+from common import pdf_process
+
+
+def write_pdf(path, pages=1):
+    writer = pypdf.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def test_process_download_dir_skips_processed_files(tmp_path):
+    save_dir = str(tmp_path)
+    write_pdf(os.path.join(save_dir, "a.pdf"), pages=2)
+    write_pdf(os.path.join(save_dir, "b.pdf"))
+    assert pdf_process.pending_pdfs(save_dir) == [os.path.join(save_dir, "a.pdf"), os.path.join(save_dir, "b.pdf")]
+    results = pdf_process.process_download_dir(save_dir, max_workers=2)
+    assert sorted((os.path.basename(r["path"]), r["pages"], r["error"]) for r in results) == [
+        ("a.pdf", 2, ""), ("b.pdf", 1, "")]
+    with open(os.path.join(save_dir, pdf_process.MANIFEST_NAME), encoding="utf-8") as f:
+        assert set(json.load(f)) == {"a.pdf", "b.pdf"}
+    assert os.path.exists(pdf_process.text_path_for(os.path.join(save_dir, "a.pdf")))
+    assert pdf_process.pending_pdfs(save_dir) == []
+    assert pdf_process.process_download_dir(save_dir) == []
@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("crawl4ai")
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from common import pdf_utils
+
+
+def test_query_string_makes_filenames_distinct():
+    a = pdf_utils.filename_from_url("https://ir.example.com/download.pdf?id=1")
+    b = pdf_utils.filename_from_url("https://ir.example.com/download.pdf?id=2")
+    assert a != b
+    assert a.startswith("download_") and a.endswith(".pdf")
+    assert pdf_utils.filename_from_url("https://ir.example.com/files/%E5%B9%B4%E6%8A%A5.pdf") == "年报.pdf"
+
+
+def test_same_basename_in_one_batch_is_deduplicated():
+    urls = ["https://a.com/2023/report.pdf", "https://a.com/2024/report.pdf", "https://a.com/2023/report.pdf"]
+    names = pdf_utils.unique_filenames(urls)
+    assert len(names) == 2
+    assert names[urls[0]] == "report.pdf"
+    assert names[urls[1]] != "report.pdf" and names[urls[1]].endswith(".pdf")
+
+
+@pytest.mark.parametrize("newer, older", [
+    ("2024Q2 results", "2024Q1 results"),
+    ("results Q2_2024", "results Q1_2024"),
+    ("2024年第二季度报告", "2024年第一季度报告"),
+    ("Q3 2024", "2024 Q2"),
+])
+def test_recency_score_orders_quarters(newer, older):
+    assert pdf_utils.recency_score(newer) > pdf_utils.recency_score(older)
+
+
+def test_download_urls_keeps_every_file(tmp_path):
+    async def handler(request):
+        return web.Response(body=f"file {request.query.get('id')}".encode())
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/download.pdf", handler)
+        async with TestServer(app) as server:
+            urls = [str(server.make_url(f"/download.pdf?id={i}")) for i in range(3)]
+            return await pdf_utils.download_urls(urls, str(tmp_path))
+
+    results = asyncio.run(scenario())
+    paths = [path for _, path in results]
+    assert len(set(paths)) == 3
+    assert sorted(open(p).read() for p in paths) == ["file 0", "file 1", "file 2"]
+
+
+def test_interrupted_download_leaves_no_partial_file(tmp_path):
+    async def handler(request):
+        resp = web.StreamResponse(headers={"Content-Length": "1000000"})
+        await resp.prepare(request)
+        await resp.write(b"%PDF-1.4 truncated")
+        await asyncio.sleep(5)
+        return resp
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/report.pdf", handler)
+        async with TestServer(app) as server:
+            return await pdf_utils.download_urls([str(server.make_url("/report.pdf"))], str(tmp_path), timeout=0.5)
+
+    assert [path for _, path in asyncio.run(scenario())] == [None]
+    assert os.listdir(tmp_path) == []